@@ -1,32 +1,59 @@
 # analyzer.py (整個檔案，請直接覆蓋)
 import json
+import os
 import re
 import datetime
+import hashlib
 import time
-from urllib.parse import urlparse
+from functools import lru_cache
 
-from langchain_ollama import ChatOllama
 from langchain_core.prompts import ChatPromptTemplate
 
-# 將 tools 的導入暫時註解掉（由於需要停用工具呼叫）
-# from tools import (
-#     check_url_safety,
-#     analyze_domain_age,
-#     check_url_patterns,
-#     extract_contact_info,
-#     detect_language_anomaly,
-# )
+import rules
+from brand_index import brand_lookalike
+from html_utils import ParsedPage
+from llm_pool import LLM_POOL
+# CPU 階段（工具證據、網域分類、規則評分）在 rules，批次的子行程只匯入那邊；這裡沿用同樣的名稱
+from rules import (
+    classify_domain,
+    collect_tool_evidence,
+    default_tool_args,
+    domain_of,
+    is_safe_domain,
+    is_suspicious_tld,
+    is_trusted_domain,
+    log_decision,
+    prepare_analysis,
+    rule_score,
+    validate_plan,
+)
+from near_dup import NEAR_DUP_INDEX, minhash_sketch, site_signature
+from verdict_cache import VERDICT_CACHE, content_fingerprint
 # Optional: 如果你有 SimplePhishingAnalysis，可以保留；本版本 LLM 直接回 JSON，我們以 dict 處理
 # from models import SimplePhishingAnalysis
+from models import FastPhishingVerdict
 
-# ------------------ TOOL REGISTRY & CONFIG ------------------
-# 工具呼叫暫時停用：將 TOOL_REGISTRY 保持為空，並註解原始工具導入。
-TOOL_REGISTRY = {}
+# 分層判斷：規則結果已足以定案時直接回傳、不呼叫 LLM（TIERED_PIPELINE=0 則每個頁面都跑兩段 LLM）
+TIERED_PIPELINE = os.environ.get("TIERED_PIPELINE", "1") == "1"
+# 規則分數達到此值直接判定高風險；0 為關閉（預設），只有 hard_flag 直接判定。
+# merge_llm_verdict 裡模型信心 ≥ 70 時以模型為準，真正的銀行登入頁關鍵字分數也很高，只看分數會改變原本的結論
+TIER_PHISHING_MIN_SCORE = int(os.environ.get("TIER_PHISHING_MIN_SCORE", 0))
+# 所有網址都在允許名單內、沒有命中任何可疑關鍵字，且扣除允許名單減分前的規則分數不超過此值時直接判定安全
+# （允許名單的網址每個減 1 分，不先加回去的話，架在 Google Sites / Forms 上的釣魚頁也會被分數抵銷）
+TIER_BENIGN_MAX_SCORE = int(os.environ.get("TIER_BENIGN_MAX_SCORE", 2))
 
-SAFE_DOMAINS = {"google.com", "google.com.tw", "microsoft.com", "facebook.com", "github.com", "gov.tw", "edu.tw"}
-SUSPICIOUS_TLDS = {".xyz", ".top", ".loan", ".vip", ".click", ".buzz", ".shop", ".loan", ".info", ".ru", ".tk"}
-LOG_PATH = "planner_tool_log.jsonl"
 MODEL_NAME = "qwen3:8b"
+# LLM 分析模式：cot＝兩段呼叫（自由推理 → JSON 判斷，保留完整推理過程供稽核）；
+# fast＝一次呼叫，輸出受 JSON Schema 限制，只附一兩句理由。每個請求可用 mode 覆寫
+ANALYSIS_MODES = ("cot", "fast")
+ANALYSIS_MODE = os.environ.get("ANALYSIS_MODE", "cot")
+if ANALYSIS_MODE not in ANALYSIS_MODES:
+    print(f"[ANALYZER] 未知的 ANALYSIS_MODE={ANALYSIS_MODE!r}，改用 cot")
+    ANALYSIS_MODE = "cot"
+# fast 模式輸出 token 上限（JSON 判斷加短理由綽綽有餘）
+FAST_MAX_TOKENS = int(os.environ.get("FAST_MAX_TOKENS", 320))
+# 判斷邏輯（規則、prompt、合併方式）改變時遞增，讓 VERDICT_CACHE 中舊版本的結果失效
+RULESET_VERSION = 8
 
 # ------------------ PROMPT (few-shot, JSON, escaped braces) ------------------
 plan_prompt = ChatPromptTemplate.from_messages(
@@ -43,173 +70,33 @@ args 可為空 dict（程式會補足），最多 3 個呼叫，無需工具時
     ],
 )
 
-planner_llm = ChatOllama(model=MODEL_NAME, temperature=0)
-
 # ------------------ HELPERS ------------------
-def log_decision(record: dict):
-    try:
-        with open(LOG_PATH, "a", encoding="utf-8") as f:
-            f.write(json.dumps(record, ensure_ascii=False) + "\n")
-    except Exception:
-        pass
-
 def extract_visible_text(html: str) -> str:
-    html = re.sub(r"<(script|style|meta|link|noscript)[^>]*>.*?</\1>", "", html, flags=re.DOTALL)
-    blocks = re.findall(r">(.*?)<", html)
-    return "\n".join(x.strip() for x in blocks if x.strip())
+    return ParsedPage(html).visible_text
 
 def find_urls(text: str) -> list:
-    return [m.group(1).rstrip('.,;') for m in re.finditer(r"(?i)\b((?:https?://|www\.)\S+)", text)]
+    return ParsedPage(text).urls
 
-def domain_of(url: str) -> str:
-    try:
-        return urlparse(url).netloc.lower()
-    except:
-        return ""
-
-def is_suspicious_tld(domain: str) -> bool:
-    return any(domain.endswith(tld) for tld in SUSPICIOUS_TLDS)
-
-def contains_brand_typo(domain: str) -> bool:
-    # very simple heuristic: common brand substrings with minor typo patterns (1 char different)
-    suspicious_patterns = ["paypa", "faceb00k", "chasebannk", "googl", "g00gle", "appleid", "banking-secure"]
-    return any(p in domain for p in suspicious_patterns)
-
-def is_safe_domain(domain: str) -> bool:
-    return any(domain.endswith(sd) for sd in SAFE_DOMAINS)
-
-# ------------------ PLANNER + TOOL INVOCATION ------------------
-ALLOWED_TOOLS = set(TOOL_REGISTRY.keys())
-
-def validate_plan(raw_plan: dict) -> list:
-    if not isinstance(raw_plan, dict):
-        return []
-    calls = raw_plan.get("calls")
-    if not isinstance(calls, list):
-        return []
-    valid_calls = []
-    for c in calls[:3]:
-        if not isinstance(c, dict):
-            continue
-        tool = c.get("tool")
-        args = c.get("args", {}) or {}
-        if tool not in ALLOWED_TOOLS:
-            continue
-        if not isinstance(args, dict):
-            continue
-        valid_calls.append({"tool": tool, "args": args})
-    return valid_calls
-
-def collect_tool_evidence(urls: list, visible: str) -> dict:
-    """
-    工具調用已被暫時停用。
-    目前直接回傳空的 evidence dict，並在日誌中記錄此狀態以便追蹤。
-    """
-    log_decision({
-        "time": datetime.datetime.utcnow().isoformat(),
-        "phase": "planner_disabled",
-        "visible_snippet": visible[:300],
-        "urls": urls[:3],
-        "note": "工具調用已停用（collect_tool_evidence stub）"
-    })
-    return {}
+# ------------------ PLANNER ------------------
+def plan_tool_calls(urls: list, visible: str) -> list:
+    """請 planner LLM 挑工具；回傳經 validate_plan 過濾的呼叫清單。"""
+    resp = build_planner_chain().invoke({"visible": visible[:1500], "urls": "\n".join(urls[:10])})
+    content = resp.content if hasattr(resp, "content") else str(resp)
+    m = re.search(r"(\{[\s\S]*\})", content)
+    return validate_plan(json.loads(m.group(1) if m else content))
 
-# ------------------ RULE-BASED SCORING ------------------
-def rule_score(visible: str, urls: list, evidence: dict) -> dict:
-    """
-    Compute rule-based risk score and reasons.
-    Returns: {"score": int, "reasons": [...], "hard_flag": bool}
-    """
-    score = 0
-    reasons = []
-    hard_flag = False
-
-    v = visible.lower()
-    # keyword groups
-    urgent = ["立即", "馬上", "盡快", "緊急", "限時", "逾期", "警告", "必須"]
-    auth = ["驗證", "重新驗證", "帳號", "密碼", "登入", "解除限制", "確認身分", "身份驗證"]
-    money = ["付款", "轉帳", "刷卡", "金額", "匯款", "銀行", "信用卡"]
-    click = ["點擊", "點此", "連結", "href"]
-
-    cnt_urgent = sum(1 for k in urgent if k in v)
-    cnt_auth = sum(1 for k in auth if k in v)
-    cnt_money = sum(1 for k in money if k in v)
-    cnt_click = sum(1 for k in click if k in v)
-
-    # weight and reasons
-    if cnt_auth:
-        score += cnt_auth * 3
-        reasons.append(f"身份/驗證要求 x{cnt_auth}")
-    if cnt_money:
-        score += cnt_money * 3
-        reasons.append(f"金錢/付款相關 x{cnt_money}")
-    if cnt_urgent:
-        score += cnt_urgent * 2
-        reasons.append(f"緊急語氣 x{cnt_urgent}")
-    if cnt_click:
-        score += cnt_click * 1
-        reasons.append(f"要求點擊 x{cnt_click}")
-
-    # URL based checks
-    for u in urls:
-        d = domain_of(u)
-        if not d:
-            continue
-        # 優先採用安全規則：如果是安全域名，跳過可疑檢查
-        if is_safe_domain(d):
-            reasons.append(f"安全域名：{d}")
-            # 對安全域名減分（降低風險）
-            score -= 1
-        else:
-            # 只在非安全域名時才檢查可疑特徵
-            if is_suspicious_tld(d) or contains_brand_typo(d) or any(x in d for x in ["verify", "secure", "account", "login", "update", "reset"]):
-                score += 4
-                reasons.append(f"疑似可疑域名：{d}")
-            # very high risk for credential phishing patterns
-            if any(x in d for x in ["-secure-", "login-", "verify-", "account-"]):
-                score += 5
-                reasons.append(f"域名含 phishing pattern：{d}")
-
-    # Evidence-based bumps (tools)
-    for k, v in evidence.items():
-        sv = str(v).lower()
-        if "suspicious" in sv or "phish" in sv or "malicious" in sv or "blacklist" in sv:
-            score += 4
-            reasons.append(f"工具 {k} 標記可疑")
-        # domain age returned as very new (example structure) -> bump
-        if "created" in sv and "days" in sv:
-            # best-effort parse small age -> bump if < 90 days
-            m = re.search(r"(\d+)\s*day", sv)
-            if m and int(m.group(1)) < 90:
-                score += 3
-                reasons.append(f"{k}：網域年齡小於90天")
-
-    # JS 混淆檢測
-    from tools import detect_suspicious_js
-    html_sample = visible  # 使用可見文字作為檢測樣本
-    js_result = detect_suspicious_js(html_sample)
-    if js_result["has_suspicious_js"]:
-        if js_result["severity"] == "high":
-            score += 5
-        elif js_result["severity"] == "medium":
-            score += 3
-        elif js_result["severity"] == "low":
-            score += 1
-        reasons.append(f"檢測到可疑 JavaScript：{'; '.join(js_result['findings'])}")
-    
-
-    # Hard rules: if both auth + urgent present -> high risk regardless
-    if cnt_auth >= 1 and cnt_urgent >= 1:
-        hard_flag = True
-        reasons.append("同時出現身份驗證要求與緊急語氣（強制標記）")
+# ------------------ LLM CHAIN (analysis with Chain-of-Thought) ------------------
+# 各 chain 只建一次：模型呼叫經由 LLM_POOL 分流到各 Ollama 端點，客戶端與連線長駐重複使用
+@lru_cache(maxsize=None)
+def build_planner_chain():
+    """TOOL_PLANNER=1 時挑工具用；第一次用到才建立"""
+    return plan_prompt | LLM_POOL.chat(model=MODEL_NAME, temperature=0)
 
-    # clamp and return
-    return {"score": max(score, 0), "reasons": reasons, "hard_flag": hard_flag}
 
-# ------------------ LLM CHAIN (analysis with Chain-of-Thought) ------------------
+@lru_cache(maxsize=None)
 def build_cot_thinking_chain():
     """第一步：讓 LLM 進行自由文字思考（較高 temperature）"""
-    llm = ChatOllama(model=MODEL_NAME, temperature=0.5)  # Higher temperature for exploration
+    llm = LLM_POOL.chat(model=MODEL_NAME, temperature=0.5)  # Higher temperature for exploration
     prompt = ChatPromptTemplate.from_messages([
         ("system", """
 你是一個資安分析 AI。請逐步分析以下信息，並詳細說明你的推理過程。
@@ -239,9 +126,10 @@ def build_cot_thinking_chain():
     return prompt | llm
 
 
+@lru_cache(maxsize=None)
 def build_analysis_chain():
     """第二步：基於 CoT 思考結果，給出嚴格 JSON 判斷"""
-    llm = ChatOllama(model=MODEL_NAME, temperature=0)  # deterministic
+    llm = LLM_POOL.chat(model=MODEL_NAME, temperature=0)  # deterministic
     prompt = ChatPromptTemplate.from_messages([
         ("system", """
 你是一個資安分析 AI，請基於前面的思考過程進行最終判斷。
@@ -273,21 +161,155 @@ def build_analysis_chain():
     ])
     return prompt | llm
 
+
+@lru_cache(maxsize=None)
+def build_fast_analysis_chain():
+    """fast 模式：一次呼叫直接給出 JSON 判斷（format 以 JSON Schema 限制輸出、關閉 qwen3 的 thinking）"""
+    llm = LLM_POOL.chat(model=MODEL_NAME, temperature=0, format=FastPhishingVerdict.model_json_schema(),
+                        reasoning=False, num_predict=FAST_MAX_TOKENS)
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", """
+你是一個資安分析 AI，請直接判斷網頁是否為釣魚網站，只輸出 JSON：
+{{
+    "is_potential_phishing": true/false,
+    "risk_level": "high"|"medium"|"low",
+    "explanation": ["短理由一","短理由二"],
+    "confidence": 0-100,
+    "reasoning": "一兩句話的判斷依據"
+}}
+考慮內文的可疑特徵（緊急語氣、身份驗證要求、金錢相關）、URL 特徵（域名、TLD、可疑模式）與工具檢測結果中的警告。
+只根據提供的內容判斷，不要加入外部未提供資訊。
+若不確定，請給出中間值 confidence 並用 "medium"。
+"""),
+        ("human", """
+=== 網頁內文 ===
+{visible_text}
+
+=== URL ===
+{urls}
+
+=== 工具檢測結果 ===
+{evidence}
+""")
+    ])
+    return prompt | llm
+
 # ------------------ ANALYZE (主流程) ------------------
-def analyze_deep(html_text: str) -> dict:
-    start = time.time()
-    visible = extract_visible_text(html_text)
-    urls = find_urls(html_text)
-    urls_str = "\n".join(urls[:10]) if urls else "（無網址）"
+_RULESET = (None, None)
+
+def ruleset_version() -> str:
+    """影響判斷結果的設定摘要：RULESET_VERSION、模型、規則關鍵字與網域名單；任何一項改變，舊的快取結果都不再命中。"""
+    global _RULESET
+    lists, version = _RULESET
+    if lists is None or lists[0] is not rules.SAFE_DOMAINS or lists[1] is not rules.SUSPICIOUS_TLDS:
+        lists = (rules.SAFE_DOMAINS, rules.SUSPICIOUS_TLDS)
+        material = json.dumps([RULESET_VERSION, MODEL_NAME, sorted(rules.SAFE_DOMAINS), sorted(rules.SUSPICIOUS_TLDS),
+                               rules.RULE_KEYWORD_GROUPS, rules.LLM_TEXT_LIMIT,
+                               TIERED_PIPELINE, TIER_PHISHING_MIN_SCORE, TIER_BENIGN_MAX_SCORE],
+                              ensure_ascii=False)
+        version = hashlib.blake2b(material.encode("utf-8"), digest_size=8).hexdigest()
+        _RULESET = (lists, version)
+    return version
+
+def verdict_key(visible: str, urls: list, mode: str, code: str = "") -> str:
+    """VERDICT_CACHE 的鍵：分析模式也算進去，cot 請求不會拿到 fast 模式的結果（少了完整推理過程）。
+    code 是頁面程式碼摘要（rules.page_code_digest）：文字相同但內嵌 JS 不同的頁面規則分數可能不同，不共用結果。
+
+    近似重複索引不分模式：命中時本來就是沿用別的頁面的判斷（tier=near_duplicate），結果的 mode 是該頁面分析時的模式。
+    """
+    return content_fingerprint(visible, urls, f"{ruleset_version()}/{mode}", code)
 
-    # Collect evidence
-    evidence = collect_tool_evidence(urls, visible)
+def near_dup_index():
+    """NEAR_DUP_INDEX；規則版本和索引記錄的不同時先清空（舊規則的判斷不沿用）。"""
+    version = ruleset_version()
+    if NEAR_DUP_INDEX.tag != version:
+        NEAR_DUP_INDEX.reset(version)
+    return NEAR_DUP_INDEX
 
-    # Compute rule score
-    r = rule_score(visible, urls, evidence)
-    score = r["score"]
-    reasons = r["reasons"]
-    hard_flag = r["hard_flag"]
+def page_site_signature(urls: list) -> int:
+    return site_signature(domain_of(u) for u in urls)
+
+def near_duplicate_verdict(visible: str, urls: list, start: float = None):
+    """查近似重複索引：找到先前分析過、文字幾乎相同的頁面時沿用它的判斷，否則 None。
+
+    鄰居的完整結果還在 VERDICT_CACHE 時整份沿用（證據、推理過程），已被淘汰時只有索引裡的判斷、等級與信心。
+    頁面的網址全都在允許名單或屬於品牌本身時（is_trusted_domain），不沿用其他主機的釣魚判斷：
+    文字相似的可能是仿冒這個真頁面的複製頁。工具包搬到雲端儲存桶、CDN、github.io 或 paypal.top 時照樣沿用。
+    """
+    start = time.time() if start is None else start
+    domains = {domain_of(u) for u in urls} - {""}
+    trusted = bool(domains) and all(is_trusted_domain(d) for d in domains)
+    match = near_dup_index().lookup(minhash_sketch(visible), page_site_signature(urls), reuse_phishing=not trusted)
+    if match is None:
+        return None
+    result = VERDICT_CACHE.get(match["key"])
+    if result is None:
+        result = {
+            "is_potential_phishing": match["is_potential_phishing"],
+            "risk_level": match["risk_level"],
+            "confidence": match["confidence"],
+            "explanation": [],
+            "evidence": {},
+            "cot_thinking": "",
+        }
+    note = f"🔁 與先前分析過的頁面高度相似（相似度 {match['similarity']:.0%}），沿用其判斷"
+    result["explanation"] = ([note] + list(result.get("explanation") or []))[:3]
+    result["cached"] = True
+    result["tier"] = "near_duplicate"
+    result["near_duplicate"] = {"similarity": match["similarity"], "fingerprint": match["key"]}
+    result["elapsed_time"] = time.time() - start
+    log_decision({
+        "time": datetime.datetime.utcnow().isoformat(),
+        "phase": "near_dup_hit",
+        "similarity": match["similarity"],
+        "fingerprint": match["key"],
+        "urls": urls[:5],
+    })
+    return result
+
+def cached_verdict(page: ParsedPage, start: float = None, mode: str = None):
+    """查 VERDICT_CACHE，沒有時再查近似重複索引：命中時回傳先前的結果（cached=True、elapsed_time 為這次的耗時），否則 None。"""
+    return lookup_verdict(page.visible_text, page.analysis_urls, start, mode, rules.page_code_digest(page))
+
+def lookup_verdict(visible: str, urls: list, start: float = None, mode: str = None, code: str = ""):
+    """同 cached_verdict，但直接給可見文字、網址與程式碼摘要（/analyze_batch 在子行程解析過頁面）。"""
+    start = time.time() if start is None else start
+    key = verdict_key(visible, urls, mode or ANALYSIS_MODE, code)
+    result = VERDICT_CACHE.get(key)
+    if result is None:
+        return near_duplicate_verdict(visible, urls, start)
+    result["cached"] = True
+    result["tier"] = "cache"
+    result["elapsed_time"] = time.time() - start
+    log_decision({
+        "time": datetime.datetime.utcnow().isoformat(),
+        "phase": "cache_hit",
+        "fingerprint": key,
+        "urls": urls[:5],
+    })
+    return result
+
+def llm_verdict(visible: str, urls: list, evidence: dict, r: dict, mode: str = "cot") -> tuple:
+    """LLM 判斷再與規則結果合併。mode="cot" 為兩段呼叫（CoT 推理 → JSON 判斷），"fast" 為一次呼叫。
+
+    回傳 (is_phishing, risk_level, confidence, explanations, cot_thinking, llm_raw, llm_ok)；
+    fast 模式的 cot_thinking 是 JSON 裡的 reasoning 短句。
+    llm_ok 為 False 表示 LLM 沒有回傳可解析的 JSON，用的是保底結果。
+    """
+    stages = llm_verdict_stages(visible, urls, evidence, r, mode)
+    try:
+        while True:
+            next(stages)
+    except StopIteration as done:
+        return done.value
+
+def llm_verdict_stages(visible: str, urls: list, evidence: dict, r: dict, mode: str = "cot", stream: bool = False):
+    """llm_verdict 的 generator 版本（以 yield from 取得回傳值）。
+
+    stream=True 時改用串流呼叫模型：CoT 推理的片段 yield ("cot", 片段)，JSON 判斷的片段 yield ("tick", None)；
+    呼叫端關閉 generator 時模型串流跟著關閉，端點上的生成隨之中止。stream=False 時不 yield。
+    """
+    urls_str = "\n".join(urls[:10]) if urls else "（無網址）"
 
     # Build evidence_text to LLM (structured but concise)
     def serialize_evidence(ev: dict) -> str:
@@ -298,17 +320,64 @@ def analyze_deep(html_text: str) -> dict:
         return "\n".join(parts) if parts else "（無工具結果）"
 
     evidence_text = serialize_evidence(evidence)
+    if mode == "fast":
+        cot_thinking, content = yield from _fast_llm_call(visible, urls_str, evidence_text, stream)
+    else:
+        cot_thinking, content = yield from _cot_llm_calls(visible, urls_str, evidence_text, stream)
+    return merge_llm_verdict(content, cot_thinking, r, urls)
+
+def _chain_text(chain, inputs: dict, event: str = None):
+    """呼叫 chain 取得輸出文字（generator，以 yield from 取得回傳值）。
+
+    event 為 None 時一次 invoke；否則串流，每個片段 yield (event, 片段)（event 為 "tick" 時不附內容）。
+    """
+    if event is None:
+        resp = chain.invoke(inputs)
+        return resp.content if hasattr(resp, "content") else str(resp)
+    parts = []
+    chunks = chain.stream(inputs)
+    try:
+        for chunk in chunks:
+            text = chunk.content if hasattr(chunk, "content") else str(chunk)
+            if text:
+                parts.append(text)
+                yield event, (None if event == "tick" else text)
+    finally:
+        # 中途被關閉（用戶端斷線）時立刻關掉模型串流，不等垃圾回收
+        close = getattr(chunks, "close", None)
+        if close:
+            close()
+    return "".join(parts)
+
+def _fast_llm_call(visible: str, urls_str: str, evidence_text: str, stream: bool = False):
+    """fast 模式：一次呼叫，回傳 (reasoning, llm_raw)。"""
+    content = ""
+    try:
+        content = yield from _chain_text(build_fast_analysis_chain(), {
+            "visible_text": visible[:rules.LLM_TEXT_LIMIT],
+            "urls": urls_str,
+            "evidence": evidence_text,
+        }, "tick" if stream else None)
+    except Exception as e:
+        log_decision({"time": datetime.datetime.utcnow().isoformat(), "phase": "llm_error", "error": str(e)})
+    # format 限制了輸出，整段就是 JSON；解析失敗時交給 merge_llm_verdict 走保底結果
+    try:
+        reasoning = str(json.loads(content).get("reasoning") or "")
+    except (ValueError, AttributeError):
+        reasoning = ""
+    return reasoning, content
 
+def _cot_llm_calls(visible: str, urls_str: str, evidence_text: str, stream: bool = False):
+    """cot 模式：先自由推理再給 JSON 判斷，回傳 (cot_thinking, llm_raw)。"""
     # ========== STEP 1: Chain-of-Thought (Thinking) ==========
     cot_thinking = ""
     try:
         cot_chain = build_cot_thinking_chain()
-        cot_resp = cot_chain.invoke({
-            "visible_text": visible[:3000],
+        cot_thinking = yield from _chain_text(cot_chain, {
+            "visible_text": visible[:rules.LLM_TEXT_LIMIT],
             "urls": urls_str,
             "evidence": evidence_text,
-        })
-        cot_thinking = cot_resp.content if hasattr(cot_resp, "content") else str(cot_resp)
+        }, "cot" if stream else None)
         
         log_decision({
             "time": datetime.datetime.utcnow().isoformat(),
@@ -323,16 +392,21 @@ def analyze_deep(html_text: str) -> dict:
     content = ""
     try:
         chain = build_analysis_chain()
-        resp = chain.invoke({
-            "visible_text": visible[:3000],
+        content = yield from _chain_text(chain, {
+            "visible_text": visible[:rules.LLM_TEXT_LIMIT],
             "urls": urls_str,
             "evidence": evidence_text,
             "cot_thinking": cot_thinking,
-        })
-        content = resp.content if hasattr(resp, "content") else str(resp)
+        }, "tick" if stream else None)
     except Exception as e:
         content = ""
         log_decision({"time": datetime.datetime.utcnow().isoformat(), "phase": "llm_error", "error": str(e)})
+    return cot_thinking, content
+
+def merge_llm_verdict(content: str, cot_thinking: str, r: dict, urls: list) -> tuple:
+    """解析 LLM 的 JSON 判斷並依模型信心與規則結果合併（兩種模式共用），回傳值同 llm_verdict。"""
+    score = r["score"]
+    hard_flag = r["hard_flag"]
 
     # Try parse LLM JSON, fallback to minimal structure
     parsed = {}
@@ -341,6 +415,10 @@ def analyze_deep(html_text: str) -> dict:
         jtext = m.group(1) if m else content
         parsed = json.loads(jtext)
     except Exception:
+        parsed = None
+    # LLM 失敗時的保底結果不寫入快取，下次同樣內容仍會重新分析
+    llm_ok = isinstance(parsed, dict)
+    if not llm_ok:
         parsed = {"is_potential_phishing": False, "risk_level": "low", "explanation": ["AI 判斷正常或回傳錯誤"], "confidence": 30}
 
     # RULE-CONFIDENCE HYBRID LOGIC
@@ -401,13 +479,130 @@ def analyze_deep(html_text: str) -> dict:
         if not final_decision or final_conf < 60:
             for u in urls:
                 d = domain_of(u)
-                if is_suspicious_tld(d) or contains_brand_typo(d):
+                lookalike = brand_lookalike(d)
+                if lookalike or is_suspicious_tld(d):
                     final_decision = True
                     final_level = "high"
                     final_conf = 75
-                    final_explanations = [f"🔴 域名疑似高風險：{d}"] + final_explanations
+                    if lookalike:
+                        final_explanations = [f"🔴 域名疑似仿冒 {lookalike[0]}：{d}"] + final_explanations
+                    else:
+                        final_explanations = [f"🔴 域名疑似高風險：{d}"] + final_explanations
                     break
 
+    return final_decision, final_level, final_conf, final_explanations, cot_thinking, content, llm_ok
+
+def rule_tier_verdict(r: dict, urls: list):
+    """規則結果是否已足以定案：回傳 (is_phishing, risk_level, confidence, explanations)，仍需 LLM 時回傳 None。
+
+    hard_flag 在 LLM 之後本來就會強制判定高風險；只連到允許名單、沒有命中任何可疑關鍵字的頁面，
+    LLM 也幾乎不會改變結果。關鍵字只有中文，英文等其他語言的登入頁一定零命中，所以有密碼欄位
+    或表單送到其他網站（docs.google.com 上的表單收集帳密）的頁面仍交給 LLM。
+    分數門檻見 TIER_PHISHING_MIN_SCORE（預設關閉）/ TIER_BENIGN_MAX_SCORE。
+    """
+    if r["hard_flag"]:
+        return True, "high", 85, ["✓ 規則判定：身份驗證+緊急語氣（強制優先）"] + r["reasons"]
+    if TIER_PHISHING_MIN_SCORE and r["score"] >= TIER_PHISHING_MIN_SCORE:
+        return True, "high", 80, [f"📋 規則評分 {r['score']} 已達直接判定門檻（≥{TIER_PHISHING_MIN_SCORE}）"] + r["reasons"]
+    domains = {domain_of(u) for u in urls} - {""}
+    # 舊格式（沒有 keyword_hits / gross_score / 表單欄位）的規則結果一律交給 LLM
+    gross = r.get("gross_score")
+    if (domains and r.get("keyword_hits", 1) == 0 and gross is not None and gross <= TIER_BENIGN_MAX_SCORE
+            and r.get("password_inputs", 1) == 0 and r.get("offsite_forms", 1) == 0
+            and all(is_safe_domain(d) for d in domains)):
+        if gross == 0:
+            return False, "low", 80, ["✓ 規則判定：只連到允許名單網域，未發現可疑特徵"]
+        signals = [x for x in r["reasons"] if not x.startswith("安全域名：")]
+        return False, "low", 70, [f"✓ 規則判定：只連到允許名單網域，無可疑關鍵字（其他訊號評分 {gross}）"] + signals
+    return None
+
+def provisional_verdict(r: dict, urls: list) -> dict:
+    """LLM 回覆前的暫定結論：規則已足以定案時即為最終結論（final=True），否則依規則分數粗估（門檻同 merge_llm_verdict）。"""
+    decided = rule_tier_verdict(r, urls)
+    if decided is not None:
+        return {"is_potential_phishing": decided[0], "risk_level": decided[1], "final": TIERED_PIPELINE}
+    if r["score"] >= 7:
+        return {"is_potential_phishing": True, "risk_level": "high", "final": False}
+    return {"is_potential_phishing": False, "risk_level": "medium" if r["score"] >= 4 else "low", "final": False}
+
+def analyze_deep(html_text, check_cache: bool = True, mode: str = None) -> dict:
+    """html_text 可以是原始字串，或 server 已建立的 ParsedPage（避免重複解析）。
+
+    相同內容（可見文字 + 網址 + 規則版本）的結果存在 VERDICT_CACHE，命中時不再呼叫 LLM，回傳 cached=True；
+    文字只差幾個字的頁面（同一工具包重新部署）由 NEAR_DUP_INDEX 找到時同樣沿用，並附上 near_duplicate。
+    check_cache=False：呼叫端剛查過快取（/analyze_async），不重複查詢。
+    TIERED_PIPELINE 開啟時，規則結果已足以定案（rule_tier_verdict）的頁面不呼叫 LLM；結果的 tier 記錄由哪一層判斷。
+    mode：LLM 分析模式（"cot" / "fast"），None 時用 ANALYSIS_MODE。
+    """
+    for event, data in analyze_stages(html_text, check_cache, mode):
+        if event == "verdict":
+            return data
+
+def analysis_mode(mode: str = None) -> str:
+    """請求指定的分析模式，None 時用 ANALYSIS_MODE；不認得時丟 ValueError。"""
+    mode = mode or ANALYSIS_MODE
+    if mode not in ANALYSIS_MODES:
+        raise ValueError(f"未知的分析模式：{mode}")
+    return mode
+
+
+def analyze_prepared(prepared: dict, mode: str = None, start: float = None) -> dict:
+    """由 prepare_analysis 的結果完成分析（分層判斷、LLM、合併、寫快取），回傳值同 analyze_deep。"""
+    for event, data in verdict_stages(prepared, analysis_mode(mode), start):
+        if event == "verdict":
+            return data
+
+def analyze_stages(html_text, check_cache: bool = True, mode: str = None, stream: bool = False):
+    """analyze_deep 的分段版本（generator），參數同 analyze_deep。
+
+    依序 yield ("rules", 規則分數、理由、證據與 provisional_verdict)、stream=True 時的 ("cot", 推理片段) 與
+    ("tick", None)（JSON 判斷生成中），最後 ("verdict", 結果)；快取命中時只有 ("verdict", 結果)。
+    呼叫端中途關閉 generator（/analyze_stream 的用戶端斷線）時，進行中的模型串流一併關閉，不寫快取。
+    """
+    mode = analysis_mode(mode)
+    start = time.time()
+    page = html_text if isinstance(html_text, ParsedPage) else ParsedPage(html_text)
+    if check_cache:
+        hit = cached_verdict(page, start, mode)
+        if hit is not None:
+            yield "verdict", hit
+            return
+    yield from verdict_stages(prepare_analysis(page), mode, start, stream)
+
+def verdict_stages(prepared: dict, mode: str, start: float = None, stream: bool = False):
+    """analyze_stages 在 prepare_analysis 之後的部分：yield ("rules", ...)、("cot", ...)/("tick", None)、("verdict", 結果)。"""
+    start = time.time() if start is None else start
+    visible, urls, evidence, r = prepared["visible"], prepared["urls"], prepared["evidence"], prepared["rule"]
+
+    yield "rules", {
+        "score": r["score"],
+        "reasons": r["reasons"],
+        "hard_flag": r["hard_flag"],
+        "evidence": evidence,
+        "provisional": provisional_verdict(r, urls),
+    }
+
+    tier = "llm"
+    decided = rule_tier_verdict(r, urls) if TIERED_PIPELINE else None
+    if decided is not None:
+        # 規則已足以定案：不呼叫 LLM
+        tier = "rules"
+        final_decision, final_level, final_conf, final_explanations = decided
+        cot_thinking, content, llm_ok = "", "", True
+    else:
+        try:
+            final_decision, final_level, final_conf, final_explanations, cot_thinking, content, llm_ok = \
+                yield from llm_verdict_stages(visible, urls, evidence, r, mode, stream)
+        except GeneratorExit:
+            log_decision({
+                "time": datetime.datetime.utcnow().isoformat(),
+                "phase": "cancelled",
+                "urls": urls[:5],
+                "mode": mode,
+                "elapsed": time.time() - start,
+            })
+            raise
+
     # Normalize
     final_explanations = [e.strip() for e in final_explanations if str(e).strip()]
     if not final_explanations:
@@ -426,6 +621,8 @@ def analyze_deep(html_text: str) -> dict:
         "rule": r,
         "cot_thinking": cot_thinking[:500],  # 記錄思考過程（前 500 字）
         "llm_raw": content,
+        "tier": tier,
+        "mode": mode,
         "final": {
             "is_potential_phishing": final_decision,
             "risk_level": final_level,
@@ -435,12 +632,21 @@ def analyze_deep(html_text: str) -> dict:
         "elapsed": elapsed
     })
 
-    return {
+    result = {
         "is_potential_phishing": final_decision,
         "risk_level": final_level,
         "confidence": final_conf,
         "explanation": final_explanations[:3],
         "evidence": evidence,
         "cot_thinking": cot_thinking,  # 完整思考過程直接回傳
-        "elapsed_time": elapsed
+        "elapsed_time": elapsed,
+        "cached": False,
+        "tier": tier,       # 哪一層做出判斷：rules / llm（快取命中時為 cache / near_duplicate）
+        "mode": mode,
     }
+    if llm_ok:
+        key = verdict_key(visible, urls, mode, prepared.get("code", ""))
+        VERDICT_CACHE.put(key, result)
+        near_dup_index().add(minhash_sketch(visible), page_site_signature(urls),
+                             final_decision, final_level, final_conf, key)
+    yield "verdict", result
@@ -0,0 +1,101 @@
+# batch_pipeline.py — 批次分析：CPU 階段（解析 HTML、工具證據、規則分數）在行程池平行執行，LLM 階段在並行上限內重疊執行
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import analyzer
+import rules
+from domain_age import load_domain_ages
+
+# CPU 階段的子行程數；0 表示不開子行程，改在本行程的執行緒裡執行
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", os.cpu_count() or 1))
+# 同一批同時進行的 LLM 分析數；0 表示 LLM_POOL 所有端點的並行上限總和
+BATCH_LLM_CONCURRENCY = int(os.environ.get("BATCH_LLM_CONCURRENCY", 0))
+
+_CPU_POOL = None
+_CPU_POOL_LOCK = threading.Lock()
+
+
+def cpu_pool():
+    """CPU 階段共用的行程池，第一次批次請求時建立；BATCH_WORKERS=0 時回傳 None。
+
+    用 spawn 而不是 fork：伺服器已有多個執行緒（工具、LLM、請求），fork 出的子行程可能繼承被佔住的鎖。
+    子行程只匯入 rules（prepare_analysis）與 domain_age（initializer 載入網域年齡資料庫），
+    不匯入 analyzer：LLM 客戶端、結果快取與名單都留在主行程。
+    """
+    global _CPU_POOL
+    if BATCH_WORKERS <= 0:
+        return None
+    with _CPU_POOL_LOCK:
+        if _CPU_POOL is None:
+            _CPU_POOL = ProcessPoolExecutor(max_workers=BATCH_WORKERS, initializer=load_domain_ages,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        return _CPU_POOL
+
+
+def analyze_batch(pages, mode: str = None, screen=None, llm_concurrency: int = None):
+    """pages：[(id, html), ...]；依完成順序 yield (id, 結果)，結果格式同 analyze_deep，失敗時為 {"error": 訊息}。
+
+    每頁先在行程池跑 prepare_analysis，回到主行程後依序：screen(urls)（例如黑名單，回傳結果即定案）、
+    快取 / 近似重複、規則分層；仍需 LLM 的頁面交給最多 llm_concurrency 個執行緒，與其他頁面的 CPU 階段重疊。
+    同一批內容相同的頁面只送一次 LLM，其餘沿用（tier=cache）。elapsed_time 自收到這一批起算。
+    呼叫端中途關閉 generator 時，尚未開始的工作全部取消；已送出的 LLM 呼叫會跑完並寫入快取。
+    """
+    mode = analyzer.analysis_mode(mode)
+    start = time.time()
+    llm_concurrency = llm_concurrency or BATCH_LLM_CONCURRENCY or analyzer.LLM_POOL.stats()["capacity"]
+    cpu = cpu_pool()
+    local_cpu = ThreadPoolExecutor(max_workers=1, thread_name_prefix="batch-cpu") if cpu is None else None
+    llm = ThreadPoolExecutor(max_workers=llm_concurrency, thread_name_prefix="batch-llm")
+    prepare = {(cpu or local_cpu).submit(rules.prepare_analysis, html): page_id for page_id, html in pages}
+    inflight = {}       # 指紋 → 等同一個 LLM 結果的頁面 id
+    llm_futures = {}    # LLM future → 指紋
+    pending = set(prepare)
+    try:
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in prepare:
+                    page_id = prepare.pop(future)
+                    try:
+                        prepared = future.result()
+                    except Exception as e:
+                        yield page_id, {"error": str(e)}
+                        continue
+                    visible, urls = prepared["visible"], prepared["urls"]
+                    hit = screen(prepared["page_urls"]) if screen else None
+                    if hit is None:
+                        hit = analyzer.lookup_verdict(visible, urls, start, mode, prepared["code"])
+                    if hit is not None:
+                        yield page_id, hit
+                        continue
+                    key = analyzer.verdict_key(visible, urls, mode, prepared["code"])
+                    if key in inflight:
+                        inflight[key].append(page_id)
+                    elif analyzer.TIERED_PIPELINE and analyzer.rule_tier_verdict(prepared["rule"], urls) is not None:
+                        # 規則已足以定案：不佔 LLM 名額，直接完成
+                        yield page_id, analyzer.analyze_prepared(prepared, mode, start)
+                    else:
+                        inflight[key] = [page_id]
+                        submitted = llm.submit(analyzer.analyze_prepared, prepared, mode, start)
+                        llm_futures[submitted] = key
+                        pending.add(submitted)
+                else:
+                    ids = inflight.pop(llm_futures.pop(future))
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        for page_id in ids:
+                            yield page_id, {"error": str(e)}
+                        continue
+                    yield ids[0], result
+                    for page_id in ids[1:]:
+                        yield page_id, dict(result, cached=True, tier="cache")
+    finally:
+        for future in pending:
+            future.cancel()
+        llm.shutdown(wait=False, cancel_futures=True)
+        if local_cpu is not None:
+            local_cpu.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,1552 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+效能基準測試腳本
+
+用法：
+    python benchmark.py blacklist      # 黑名單索引查詢成本 vs 名單大小
+    python benchmark.py snapshot       # CSV 載入 vs mmap 快照：啟動時間與記憶體
+    python benchmark.py bloom          # 快照前加 Bloom filter：記憶體與每秒查詢數
+    python benchmark.py check_urls     # POST /check_urls 批次查詢 10k 網址
+    python benchmark.py memory         # 原始字串集合 vs 標準化索引 vs mmap 快照的記憶體
+    python benchmark.py parse          # 大型頁面：每個請求重複解析 vs ParsedPage 解析一次
+    python benchmark.py parser         # 解析後端 stream vs bs4 的速度（輸出一致性：tests/test_html_parser.py）
+    python benchmark.py relevant       # extract_relevant_html：完整解析 vs 串流提前停止（時間、峰值記憶體）
+    python benchmark.py keywords       # 100 KB 文字：逐一 in 檢查 vs KeywordMatcher 一次掃描
+    python benchmark.py js             # JS 混淆檢測：10 個 regex vs 單次線性掃描（含 minified 大檔）
+    python benchmark.py domain_age     # 網域年齡資料庫：100 萬筆匯出檔的編譯時間、檔案大小、查詢微秒數與正確性
+    python benchmark.py brands         # 品牌仿冒索引：5000 個品牌的建置時間、每個主機的查詢時間、偵出率與誤判率（對照舊子字串清單）
+    python benchmark.py domains        # 網域分類：endswith 逐一比對 vs 反轉標籤 trie（允許名單 7 ~ 10 萬筆）
+    python benchmark.py features       # 重複網域流量：每次重算 vs FEATURE_CACHE 的網址 / 網域特徵（含名單變更作廢）
+    python benchmark.py verdict        # 分析結果快取：stub LLM 下的未命中 vs 命中耗時、/analyze 與 /analyze_async 的 cached 旗標、磁碟層重啟後命中
+    python benchmark.py near_dup       # 近似重複頁面索引：改字後的偵出率、100 萬個指紋的寫入 / 查詢 / 記憶體 / 持久化、端到端沿用判斷
+    python benchmark.py tiers          # 分層判斷：重播記錄的流量（REPLAY_LOG）與合成流量，不必呼叫 LLM 的比例與 p50 / p95 延遲
+    python benchmark.py modes          # LLM 分析模式：兩段 CoT vs 一次呼叫的 fast，本機 stub 模型下的 p50 / p95 延遲與結論一致率
+                                       # （BENCH_LLM=ollama 改用實際的 Ollama 模型）
+    python benchmark.py llm_pool       # LLM 連線池：本機假 Ollama 上每次新建客戶端 vs 長駐客戶端、多端點分流與排隊深度（正確性見 tests/test_llm_pool.py）
+    python benchmark.py stream         # POST /analyze_stream：各事件（blacklist / rules / 第一個 CoT 片段 / verdict）抵達時間 vs /analyze，斷線後模型生成是否中止
+    python benchmark.py batch          # POST /analyze_batch：逐頁 analyze_deep vs 分段管線（行程池 + LLM 重疊）的每秒頁數，假 Ollama 兩個端點
+    python benchmark.py tools          # 工具證據階段：並行執行的耗時，以及慢工具 / 慢 planner 是否守住階段上限
+"""
+
+import random
+import string
+import sys
+import time
+
+# 修正 Windows 編碼
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+
+
+def _random_label(rng: random.Random, n: int = 10) -> str:
+    return "".join(rng.choice(string.ascii_lowercase + string.digits + "-") for _ in range(n)).strip("-") or "x"
+
+
+def synthetic_urls(count: int, seed: int = 0) -> list:
+    """產生與 PhishTank 分佈類似的假網址（主機條目、路徑條目、帶 query 條目混合）。"""
+    rng = random.Random(seed)
+    tlds = ["com", "net", "xyz", "top", "app", "dev", "com.br", "it.com"]
+    urls = []
+    for i in range(count):
+        host = f"{_random_label(rng)}{i}.{rng.choice(tlds)}"
+        if rng.random() < 0.3:
+            host = f"{_random_label(rng, 6)}.{host}"
+        kind = rng.random()
+        if kind < 0.3:
+            urls.append(f"https://{host}/")
+        elif kind < 0.8:
+            urls.append(f"https://{host}/{_random_label(rng, 5)}/{_random_label(rng, 8)}.html")
+        else:
+            urls.append(f"https://{host}/login.php?id={rng.randint(0, 10**9)}")
+    return urls
+
+
+def _time_per_call(fn, items, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for it in items:
+            fn(it)
+        best = min(best, time.perf_counter() - t0)
+    return best / len(items) * 1e6
+
+
+def bench_blacklist():
+    from blacklist import BlacklistIndex
+
+    print("=" * 60)
+    print("黑名單索引：查詢成本 vs 名單大小")
+    print("=" * 60)
+
+    queries_miss = [f"https://www.{_random_label(random.Random(i))}.example/a/b/c?x={i}" for i in range(20000)]
+    for size in (49_000, 500_000, 2_000_000):
+        entries = synthetic_urls(size)
+        idx = BlacklistIndex()
+        t0 = time.perf_counter()
+        for u in entries:
+            idx.add(u)
+        build = time.perf_counter() - t0
+
+        rng = random.Random(1)
+        hits = [u + "extra/page" if u.endswith("/") else u for u in rng.sample(entries, 20000)]
+        us_hit = _time_per_call(idx.lookup, hits)
+        us_miss = _time_per_call(idx.lookup, queries_miss)
+        print(f"{size:>10,} 筆 | 建立 {build:6.2f} 秒 | 命中查詢 {us_hit:5.2f} µs | 未命中查詢 {us_miss:5.2f} µs")
+        del idx, entries
+
+
+def bench_snapshot(csv_path: str = "phishtank.csv"):
+    import csv
+    import os
+    import tracemalloc
+    from blacklist import BlacklistIndex, SnapshotIndex, compile_snapshot
+
+    print("=" * 60)
+    print("黑名單冷啟動：CSV 解析 vs mmap 快照")
+    print("=" * 60)
+
+    snap_path = os.path.splitext(csv_path)[0] + ".snap"
+    t0 = time.perf_counter()
+    compile_snapshot(csv_path, snap_path)
+    print(f"編譯快照：{time.perf_counter() - t0:.2f} 秒，檔案 {os.path.getsize(snap_path) / 1024:.0f} KB")
+
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    idx = BlacklistIndex()
+    with open(csv_path, "r", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            idx.add((row.get("url") or "").strip())
+    csv_time = time.perf_counter() - t0
+    csv_mem = tracemalloc.get_traced_memory()[0]
+    del idx
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    snap = SnapshotIndex(snap_path)
+    snap_time = time.perf_counter() - t0
+    snap_mem = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print(f"CSV 解析：{csv_time * 1000:8.1f} ms，Python 物件 {csv_mem / 1024 / 1024:6.1f} MB")
+    print(f"mmap 快照：{snap_time * 1000:8.3f} ms，Python 物件 {snap_mem / 1024:6.1f} KB（{len(snap)} 筆）")
+
+
+def bench_bloom(fp_rate: float = 0.01):
+    import os
+    import tempfile
+    from blacklist import SnapshotIndex, bloom_path_for, read_csv_urls, write_snapshot
+
+    print("=" * 60)
+    print(f"Bloom filter（目標誤判率 {fp_rate}）：記憶體與查詢吞吐量")
+    print("=" * 60)
+
+    queries_miss = [f"https://www.{_random_label(random.Random(i))}.example/a/b/c?x={i}" for i in range(20000)]
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, urls in (("phishtank.csv", list(read_csv_urls("phishtank.csv"))),
+                            ("合成 1M", synthetic_urls(1_000_000))):
+            snap_path = os.path.join(tmp, "bench.snap")
+            write_snapshot(urls, snap_path, fp_rate)
+            plain = SnapshotIndex(snap_path)
+            bloomed = SnapshotIndex(snap_path, bloom_path_for(snap_path))
+
+            hits = random.Random(2).sample(urls, min(20000, len(urls)))
+            false_pos = sum(1 for q in queries_miss if bloomed.bloom.might_contain(
+                q.encode("utf-8"), __import__("zlib").crc32(q.encode("utf-8"))))
+            print(f"[{label}] {len(plain):,} 鍵 | 快照 {os.path.getsize(snap_path) / 1024 / 1024:6.1f} MB"
+                  f" | Bloom {bloomed.bloom.nbytes / 1024:8.1f} KB（k={bloomed.bloom._k}，實測誤判 {false_pos / len(queries_miss):.4f}）")
+            for name, idx in (("無 Bloom", plain), ("有 Bloom", bloomed)):
+                miss = 1e6 / _time_per_call(idx.lookup, queries_miss)
+                hit = 1e6 / _time_per_call(idx.lookup, hits)
+                print(f"    {name}：未命中 {miss:10,.0f} 次/秒 | 命中 {hit:10,.0f} 次/秒")
+            plain.close()
+            bloomed.close()
+
+
+def bench_check_urls(count: int = 10000):
+    from blacklist import read_csv_urls
+    import server
+    server.init()
+
+    print("=" * 60)
+    print(f"POST /check_urls：{count:,} 筆網址")
+    print("=" * 60)
+
+    rng = random.Random(3)
+    known = list(read_csv_urls("phishtank.csv"))
+    urls = [rng.choice(known) if rng.random() < 0.05 else f"https://{_random_label(rng)}.example/p/{i}"
+            for i in range(count)]
+    client = server.app.test_client()
+    for stream in (False, True):
+        t0 = time.perf_counter()
+        resp = client.post("/check_urls", json={"urls": urls, "stream": stream})
+        body = resp.get_data()
+        elapsed = time.perf_counter() - t0
+        hits = body.count(b'"is_blacklisted": true') + body.count(b'"is_blacklisted":true')
+        print(f"{'NDJSON 串流' if stream else 'JSON 一次回傳'}：{elapsed * 1000:7.1f} ms，命中 {hits} 筆")
+
+
+def bench_memory(scale: int = 10):
+    import csv
+    import os
+    import tempfile
+    import tracemalloc
+    from blacklist import BlacklistIndex, SnapshotIndex, compile_snapshot, read_csv_urls
+
+    print("=" * 60)
+    print("黑名單記憶體：原始字串 set（舊版）vs 標準化索引 vs mmap 快照")
+    print("=" * 60)
+
+    def _traced(fn):
+        tracemalloc.start()
+        obj = fn()
+        used = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return obj, used / 1024 / 1024
+
+    rows = list(read_csv_urls("phishtank.csv"))
+    with tempfile.TemporaryDirectory() as tmp:
+        big_csv = os.path.join(tmp, f"phishtank_x{scale}.csv")
+        with open(big_csv, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["url"])
+            writer.writerows([u] for u in rows)
+            writer.writerows([u] for u in synthetic_urls(len(rows) * (scale - 1)))
+
+        for label, path in (("phishtank.csv", "phishtank.csv"), (f"{scale}x", big_csv)):
+            raw, raw_mb = _traced(lambda: set(read_csv_urls(path)))
+            del raw
+
+            def _index():
+                idx = BlacklistIndex()
+                for u in read_csv_urls(path):
+                    idx.add(u)
+                return idx
+            idx, idx_mb = _traced(_index)
+            keys = len(idx)
+            del idx
+
+            snap_path = os.path.join(tmp, "bench.snap")
+            compile_snapshot(path, snap_path)
+            snap, snap_mb = _traced(lambda: SnapshotIndex(snap_path))
+            rows_n = sum(1 for _ in read_csv_urls(path))
+            print(f"[{label}] {rows_n:,} 列 → {keys:,} 個標準化鍵")
+            print(f"    原始字串 set   ：{raw_mb:7.1f} MB（Python 物件）")
+            print(f"    標準化索引 dict：{idx_mb:7.1f} MB（Python 物件，含前綴/計數表）")
+            print(f"    mmap 快照      ：{snap_mb * 1024:7.1f} KB Python 物件 + 檔案 {os.path.getsize(snap_path) / 1024 / 1024:.1f} MB（共用 page cache）")
+            snap.close()
+
+
+def synthetic_page(target_bytes: int, seed: int = 0) -> str:
+    """產生類似真實釣魚/電商頁面的大型 HTML（段落、連結、表單、內嵌與壓縮過的 script）。"""
+    rng = random.Random(seed)
+    words = ["帳號", "登入", "驗證", "付款", "優惠", "會員", "客服", "商品", "account", "login", "secure",
+             "update", "order", "shipping", "please", "click", "here", "your", "bank", "card"]
+    head = ('<!DOCTYPE html><html><head><meta charset="utf-8"><title>Account Verification</title>'
+            '<meta name="description" content="secure login"><meta name="keywords" content="bank,login">'
+            '<style>body{font-family:sans-serif}.c{color:#333}</style></head><body>')
+    parts = [head]
+    size = len(head)
+    i = 0
+    while size < target_bytes:
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(10, 40)))
+        host = f"{_random_label(rng, 8)}.{rng.choice(['com', 'net', 'xyz'])}"
+        if i % 7 == 0:
+            block = "<script>var _0x%x=[%s];function f(a){return a.split('').reverse().join('')}</script>" % (
+                i, ",".join(f"'{_random_label(rng, 12)}'" for _ in range(30)))
+        elif i % 5 == 0:
+            block = (f'<form action="https://{host}/submit"><input name="user" placeholder="{text[:20]}">'
+                     f'<input type="password" name="pw"><button onclick="validate({i})">送出</button></form>')
+        else:
+            block = (f'<div class="c"><h3>{text[:30]}</h3><p>{text}</p>'
+                     f'<a href="https://{host}/p/{i}">{text[:15]}</a> 參考 https://www.{host}/info </div>')
+        parts.append(block)
+        size += len(block)
+        i += 1
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+def _legacy_parse_pipeline(text: str):
+    """舊版 /analyze 的解析流程：extract_urls、extract_relevant_html 各自建一次 soup，再跑兩個 regex。"""
+    import re
+    from bs4 import BeautifulSoup
+    from html_utils import _normalize_url
+
+    urls = set()
+    for a in BeautifulSoup(text, "html.parser").find_all("a", href=True):
+        norm = _normalize_url((a.get("href") or "").strip())
+        if norm:
+            urls.add(norm)
+    for m in re.finditer(r"(?i)\b((?:https?://|www\.)[^\s<>\"'\)]{3,})", text):
+        norm = _normalize_url(m.group(1))
+        if norm:
+            urls.add(norm)
+
+    soup = BeautifulSoup(text, "html.parser")
+    title = soup.title.string if soup.title else ""
+    metas = [str(m) for m in soup.find_all("meta") if m.get("name") in ["description", "keywords", "author"]]
+    links = [a.get("href") for a in soup.find_all("a", href=True)[:10]]
+    cleaned = f"<title>{title}</title>\n{' '.join(metas)}\n<links>{links}</links>\n<body>{soup.get_text(chr(10), strip=True)[:1000]}</body>"
+
+    stripped = re.sub(r"<(script|style|meta|link|noscript)[^>]*>.*?</\1>", "", cleaned, flags=re.DOTALL)
+    visible = "\n".join(x.strip() for x in re.findall(r">(.*?)<", stripped) if x.strip())
+    found = [m.group(1) for m in re.finditer(r"(?i)\b((?:https?://|www\.)\S+)", cleaned)]
+    return sorted(urls), visible, found
+
+
+def _shared_parse_pipeline(text: str):
+    """新版：一個 ParsedPage，黑名單、深度分析、JS 檢測都讀它的欄位。"""
+    from html_utils import ParsedPage
+
+    page = ParsedPage(text)
+    return page.urls, page.visible_text, page.scripts, page.event_handlers
+
+
+def bench_parse():
+    print("=" * 60)
+    print("每個 /analyze 請求的 HTML 解析 CPU：舊流程 vs ParsedPage")
+    print("=" * 60)
+
+    for size in (100_000, 1_000_000, 4_000_000):
+        page = synthetic_page(size)
+        legacy = min(_timed(_legacy_parse_pipeline, page) for _ in range(3))
+        shared = min(_timed(_shared_parse_pipeline, page) for _ in range(3))
+        print(f"{len(page) / 1024:8.0f} KB | 舊流程 {legacy * 1000:8.1f} ms | ParsedPage {shared * 1000:8.1f} ms"
+              f" | 節省 {(1 - shared / legacy) * 100:4.0f}%")
+
+
+def _timed(fn, *args) -> float:
+    t0 = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - t0
+
+
+def _parsed_fields(page) -> dict:
+    return {
+        "relevant_html": page.relevant_html(),
+        "urls": page.urls,
+        "title": page.title,
+        "metas": page.metas,
+        "links": page.links,
+        "body_text": page.body_text,
+        "visible_text": page.visible_text,
+        "scripts": page.scripts,
+        "event_handlers": page.event_handlers,
+    }
+
+
+def bench_parser():
+    import html_utils
+    from html_utils import ParsedPage
+
+    print("=" * 60)
+    print("HTML 解析後端：stream（HTMLParser 子類別）vs bs4（html.parser 建樹）")
+    print("=" * 60)
+
+    # 兩種後端的輸出逐字相同由 tests/test_html_parser.py 驗證（HTML_CORPUS_DIR=存檔頁面目錄 可加入實際頁面），這裡只量時間
+    original = html_utils.HTML_PARSER_BACKEND
+    try:
+        for size in (100_000, 1_000_000, 4_000_000):
+            page = synthetic_page(size)
+            timings = {}
+            for backend in ("bs4", "stream"):
+                html_utils.HTML_PARSER_BACKEND = backend
+                timings[backend] = min(_timed(lambda: _parsed_fields(ParsedPage(page))) for _ in range(3))
+            print(f"{len(page) / 1024:8.0f} KB | bs4 {timings['bs4'] * 1000:8.1f} ms | stream {timings['stream'] * 1000:8.1f} ms"
+                  f" | {timings['bs4'] / timings['stream']:4.1f}x")
+    finally:
+        html_utils.HTML_PARSER_BACKEND = original
+
+
+def bench_relevant():
+    import tracemalloc
+    from html_utils import extract_relevant_html
+
+    print("=" * 60)
+    print("extract_relevant_html：完整解析 vs 串流（收滿 title/meta/10 連結/1000 字就停）")
+    print("=" * 60)
+
+    # 串流與完整解析的輸出相同由 tests/test_html_parser.py 驗證
+    for size in (100_000, 1_000_000, 4_000_000, 16_000_000):
+        page = synthetic_page(size)
+        row = []
+        for streaming in (False, True):
+            elapsed = min(_timed(extract_relevant_html, page, 3000, streaming) for _ in range(2))
+            tracemalloc.start()
+            extract_relevant_html(page, streaming=streaming)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            row.append(f"{elapsed * 1000:9.1f} ms {peak / 1024 / 1024:7.1f} MB")
+        print(f"{len(page) / 1024 / 1024:6.1f} MB 頁面 | 完整 {row[0]} | 串流 {row[1]}")
+
+
+def synthetic_text(target_chars: int, keyword_rate: float, seed: int = 0) -> str:
+    """中英混雜的頁面文字；keyword_rate 控制 rule_score 關鍵字出現的比例。"""
+    from rules import RULE_KEYWORD_GROUPS
+
+    rng = random.Random(seed)
+    keywords = [k for _, _, words in RULE_KEYWORD_GROUPS.values() for k in words]
+    filler = [chr(c) for c in range(0x4E00, 0x4E00 + 3000)] + list("们这的了")
+    parts, size = [], 0
+    while size < target_chars:
+        if rng.random() < keyword_rate:
+            part = rng.choice(keywords)
+        elif rng.random() < 0.15:
+            part = " " + _random_label(rng, rng.randint(3, 9)).upper() + " "
+        else:
+            part = "".join(rng.choice(filler) for _ in range(rng.randint(2, 8)))
+        parts.append(part)
+        size += len(part)
+    return "".join(parts)[:target_chars]
+
+
+def _legacy_rule_counts(visible: str) -> dict:
+    from rules import RULE_KEYWORD_GROUPS
+
+    v = visible.lower()
+    return {name: sum(1 for k in words if k in v) for name, (_, _, words) in RULE_KEYWORD_GROUPS.items()}
+
+
+def _legacy_language_anomaly(text: str) -> str:
+    import re
+
+    findings = []
+    simplified_chars = "们这对机国观产层战领举办权进体为发过学说语讲"
+    simp_count = sum(1 for c in text if c in simplified_chars)
+    ratio = round(simp_count / max(len(text), 1), 3)
+    if ratio > 0.05:
+        findings.append(f"簡體字比例偏高({ratio})")
+    zh = len(re.findall(r"[\u4e00-\u9fa5]", text))
+    en = len(re.findall(r"[A-Za-z]", text))
+    if zh > 0 and en > 0 and (en / (zh + 1)) > 0.4:
+        findings.append("語言混雜比例異常")
+    if re.search(r"的的|了了|是不|會會|它它", text):
+        findings.append("疑似翻譯腔或重複片段")
+    if len(findings) == 0:
+        return "語言檢查正常"
+    return "語言異常：" + "、".join(findings)
+
+
+def bench_keywords():
+    from rules import RULE_KEYWORDS
+    from tools import detect_language_anomaly
+
+    language_anomaly = detect_language_anomaly.func   # @tool 包裝後的原始函式
+
+    print("=" * 60)
+    print("100 KB 文字：rule_score 關鍵字與語言檢查")
+    print("=" * 60)
+
+    # 與舊版結果相同由 tests/test_keywords.py 驗證，這裡只量時間
+    for rate in (0.001, 0.01, 0.1):
+        texts = [synthetic_text(100_000, rate, seed) for seed in range(5)]
+        old_kw = min(_timed(lambda: [_legacy_rule_counts(t) for t in texts]) for _ in range(5)) / len(texts)
+        new_kw = min(_timed(lambda: [RULE_KEYWORDS.counts(t) for t in texts]) for _ in range(5)) / len(texts)
+        old_lang = min(_timed(lambda: [_legacy_language_anomaly(t) for t in texts]) for _ in range(5)) / len(texts)
+        new_lang = min(_timed(lambda: [language_anomaly(t) for t in texts]) for _ in range(5)) / len(texts)
+        print(f"關鍵字比例 {rate:5.3f} | rule 關鍵字 {old_kw * 1000:6.2f} → {new_kw * 1000:6.2f} ms"
+              f" | 語言檢查 {old_lang * 1000:6.2f} → {new_lang * 1000:6.2f} ms")
+
+
+def _legacy_js_findings(code: str) -> tuple:
+    """舊版 detect_suspicious_js 的 regex（對合併後的程式碼逐一執行）。"""
+    import re
+
+    findings, score = [], 0
+    for pattern, text, points in [
+        (r'\beval\s*\(', "包含 eval() 動態執行代碼", 3),
+        (r'\batob\s*\(', "包含 atob() Base64 解碼", 2),
+        (r'\bnew\s+Function\s*\(', "包含 Function constructor 動態生成代碼", 3),
+        (r'innerHTML\s*=', "包含 innerHTML 動態注入", 2),
+        (r'document\.write\s*\(', "包含 document.write 動態注入", 2),
+        (r'insertAdjacentHTML\s*\(', "包含 insertAdjacentHTML 動態注入", 2),
+    ]:
+        if re.search(pattern, code):
+            findings.append(text)
+            score += points
+    n = len(re.findall(r'String\.fromCharCode\s*\(', code))
+    if n >= 3:
+        findings.append(f"大量使用 String.fromCharCode ({n} 次，通常用於混淆)")
+        score += n
+    n = len(re.findall(r'_0x[a-f0-9]+', code))
+    if n >= 5:
+        findings.append(f"檢測到大量十六進位混淆變數 ({n} 個，通常用於隱藏代碼)")
+        score += 2
+    for pattern in (r'\.replace\s*\([^,]+,\s*["\']', r'\.split\s*\([^)]+\)\s*\.join', r'String\.fromCharCode.*\.charCodeAt'):
+        if re.search(pattern, code):
+            findings.append("檢測到自我解密腳本特徵")
+            score += 2
+            break
+    return findings, score
+
+
+def synthetic_js(count: int, seed: int = 0) -> list:
+    """由可疑特徵與一般程式碼片段隨機拼出的 script 內容（特徵密集的最壞情況）。"""
+    rng = random.Random(seed)
+    pieces = ["eval(", "eval (x)", "evaluate(", "atob(", "xatob(", "new Function(", "new  Function (",
+              "el.innerHTML = s;", "innerHTML==", "document.write(", "insertAdjacentHTML(",
+              "String.fromCharCode(", "String.fromCharCode", ".charCodeAt(0)", "_0x1a2b", "_0xzz", "_0x",
+              "s.replace(/a/g, 'b')", "s.replace(x)", ".split('').reverse().join('')", ".split(a).map(f)",
+              "var a = 1;", "\n", " ", "function f(){return 0}", "if (a < b) {", "}", ",", "'", ")"]
+    return ["".join(rng.choice(pieces) for _ in range(rng.randint(1, 30))) for _ in range(count)]
+
+
+def bench_js():
+    import tools
+    from tools import detect_suspicious_js
+
+    print("=" * 60)
+    print("JS 混淆檢測：10 個獨立 regex vs 一次線性掃描")
+    print("=" * 60)
+
+    # 與舊版結果相同由 tests/test_js_detection.py 驗證，這裡只量時間
+    rng = random.Random(1)
+    # 一般網站程式碼：特徵很少；密集樣本則幾乎每個片段都是特徵（最壞情況，逐一處理每個命中）
+    normal = ("function init(el){var items=document.querySelectorAll('.item');"
+              "for(var i=0;i<items.length;i++){items[i].addEventListener('click',toggle)}}\n") * 2000
+    dense = "".join(rng.choice(synthetic_js(200, seed=2)) for _ in range(2000))
+    # minified bundle：一整行、大量 String.fromCharCode 卻沒有 charCodeAt，舊 regex 的 .* 每次都回溯到行尾
+    minified = ("var _0xabc=String.fromCharCode(97,98);function q(a){return a+1}" * 4000)
+    cases = [
+        (f"一般 script {len(normal) // 1024} KB", normal),
+        (f"特徵密集 {len(dense) // 1024} KB", dense),
+        (f"minified {len(minified) // 1024} KB（單行）", minified),
+        (f"minified x4 {len(minified) * 4 // 1024} KB", minified * 4),
+    ]
+    for name, code in cases:
+        legacy = _timed(_legacy_js_findings, code)
+        budget = tools.JS_SCRIPT_BUDGET
+        tools.JS_SCRIPT_BUDGET = tools.JS_TOTAL_BUDGET = len(code)     # 關掉預算，比較同樣的工作量
+        unbounded = _timed(detect_suspicious_js, code)
+        tools.JS_SCRIPT_BUDGET, tools.JS_TOTAL_BUDGET = budget, 1024 * 1024
+        capped = _timed(detect_suspicious_js, code)
+        print(f"{name:28} | 舊 {legacy * 1000:9.1f} ms | 新 {unbounded * 1000:7.1f} ms | 新（預算內）{capped * 1000:6.1f} ms")
+
+
+def bench_domain_age(count: int = 1_000_000):
+    import datetime
+    import os
+    import tempfile
+    import analyzer
+    import domain_age
+    import tools
+
+    print("=" * 60)
+    print(f"網域年齡資料庫：{count} 筆匯出檔")
+    print("=" * 60)
+
+    rng = random.Random(0)
+    today = datetime.date.today()
+    created = {}
+    while len(created) < count:
+        name = "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(5, 14)))
+        created[f"{name}.{rng.choice(['com', 'net', 'xyz', 'com.tw', 'shop', 'it.com'])}"] = \
+            today - datetime.timedelta(days=rng.randint(0, 9000))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        dump = os.path.join(tmp, "domain_ages.csv")
+        with open(dump, "w", encoding="utf-8") as f:
+            f.write("domain,created\n")
+            for domain, day in created.items():
+                f.write(f"{domain},{day.isoformat()}T00:00:00Z\n")
+            f.write("broken.example,not-a-date\n")
+        db = os.path.join(tmp, "domain_ages.dage")
+        build = _timed(domain_age.compile_domain_ages, dump, db)
+        index = domain_age.DomainAgeIndex(db)
+        print(f"編譯 {build:.2f} s | 匯出檔 {os.path.getsize(dump) / 1e6:.1f} MB → 資料庫 {os.path.getsize(db) / 1e6:.1f} MB")
+
+        sample = rng.sample(list(created), 20000)
+        for domain in sample:
+            assert index.created(domain) == created[domain], domain
+            assert index.created("login.secure." + domain) == created[domain], domain
+        assert index.created("not-in-dump.example") is None
+        assert index.created("broken.example") is None
+        misses = [f"missing{i}.example.com" for i in range(20000)]
+        hit = _timed(lambda: [index.created(d) for d in sample]) / len(sample)
+        sub = _timed(lambda: [index.created("www." + d) for d in sample]) / len(sample)
+        miss = _timed(lambda: [index.created(d) for d in misses]) / len(misses)
+        print(f"查詢：命中 {hit * 1e6:.1f} µs | 子網域往上找 {sub * 1e6:.1f} µs | 不在資料庫 {miss * 1e6:.1f} µs")
+
+        # 實際流程：新註冊網域讓工具與 rule_score 都標記
+        young = next(d for d in sample if (today - created[d]).days < domain_age.NEW_DOMAIN_DAYS)
+        previous = domain_age.DOMAIN_AGES
+        domain_age.DOMAIN_AGES = index
+        try:
+            print(tools.analyze_domain_age.func(young).replace("\n", " | "))
+            reasons = analyzer.rule_score("", [f"https://{young}/"], {})["reasons"]
+            assert any("網域年齡小於90天" in r for r in reasons), reasons
+            print("rule_score：", reasons)
+        finally:
+            domain_age.DOMAIN_AGES = previous
+            index.close()
+
+
+def _legacy_brand_typo(domain: str) -> bool:
+    suspicious_patterns = ["paypa", "faceb00k", "chasebannk", "googl", "g00gle", "appleid", "banking-secure"]
+    return any(p in domain for p in suspicious_patterns)
+
+
+def _lookalikes(brand: str, rng: random.Random) -> list:
+    """由品牌名產生仿冒主機：同形字、打錯字（刪、換、插入、互換）、品牌名嵌入。"""
+    glyphs = {"o": "0", "l": "1", "e": "3", "a": "а", "i": "і", "m": "rn", "s": "5"}
+    i = rng.randrange(len(brand))
+    swap = next((j for j in range(len(brand) - 1) if brand[j] in glyphs), None)
+    homoglyph = brand[:swap] + glyphs[brand[swap]] + brand[swap + 1:] if swap is not None else brand
+    variants = [
+        homoglyph,
+        brand[:i] + brand[i + 1:],
+        brand[:i] + rng.choice(string.ascii_lowercase.replace(brand[i], "")) + brand[i + 1:],
+        brand[:i] + rng.choice(string.ascii_lowercase) + brand[i:],
+        f"{brand}-login",
+        f"secure-{brand}",
+    ]
+    if i < len(brand) - 1 and brand[i] != brand[i + 1]:
+        variants.append(brand[:i] + brand[i + 1] + brand[i] + brand[i + 2:])
+    hosts = []
+    for label in variants:
+        try:
+            host = f"{label}.{rng.choice(['com', 'xyz', 'top', 'com.tw'])}".encode("idna").decode("ascii")
+        except UnicodeError:
+            continue
+        hosts.append(host)
+    return hosts
+
+
+def bench_brands(count: int = 5000):
+    import brand_index
+
+    print("=" * 60)
+    print(f"品牌仿冒索引：內建 {len(brand_index.DEFAULT_BRANDS)} + 隨機 {count} 個品牌")
+    print("=" * 60)
+
+    rng = random.Random(0)
+    syllables = ["ka", "lo", "mi", "ra", "ten", "vox", "zen", "bri", "cor", "dal", "fin", "gro", "pay", "sol", "tri", "nex"]
+    brands = dict(brand_index.DEFAULT_BRANDS)
+    while len(brands) < len(brand_index.DEFAULT_BRANDS) + count:
+        name = "".join(rng.choice(syllables) for _ in range(rng.randint(2, 4)))
+        brands.setdefault(name, (f"{name}.com",))
+    t0 = time.perf_counter()
+    index = brand_index.BrandIndex(brands)
+    build = time.perf_counter() - t0
+    print(f"建置 {build:.2f} s | {len(index)} 個名稱 | 刪除鄰域 {len(index._neighbors)} 個鍵")
+
+    defaults = list(brand_index.DEFAULT_BRANDS)
+    fuzzy = [b for b in defaults if len(b) >= brand_index.BRAND_MIN_FUZZY]
+    fakes = [h for b in fuzzy for h in _lookalikes(b, rng)]
+    words = ["shop", "news", "cloud", "travel", "garden", "studio", "market", "health", "coffee", "design",
+             "school", "photo", "music", "sports", "family", "kitchen", "office", "media", "store", "finance"]
+    benign = [f"{rng.choice(words)}{rng.choice(words)}{rng.randint(0, 99)}.{rng.choice(['com', 'net', 'org', 'com.tw'])}"
+              for _ in range(5000)]
+    official = [d for domains in brand_index.DEFAULT_BRANDS.values() for d in domains]
+
+    new_hits = sum(index.match(h) is not None for h in fakes)
+    old_hits = sum(_legacy_brand_typo(h) for h in fakes)
+    new_fp = sum(index.match(h) is not None for h in benign + official)
+    old_fp = sum(_legacy_brand_typo(h) for h in benign + official)
+    print(f"仿冒主機 {len(fakes)} 個（{len(fuzzy)} 個內建品牌）| 舊清單偵出 {old_hits:5} | 索引偵出 {new_hits:5}")
+    print(f"一般 + 官方主機 {len(benign) + len(official)} 個      | 舊清單誤判 {old_fp:5} | 索引誤判 {new_fp:5}")
+    assert all(index.match(d) is None for d in official)
+
+    per_host = _timed(lambda: [index.match(h) for h in benign]) / len(benign)
+    per_fake = _timed(lambda: [index.match(h) for h in fakes]) / len(fakes)
+    print(f"查詢：一般主機 {per_host * 1e6:.0f} µs | 仿冒主機 {per_fake * 1e6:.0f} µs")
+
+
+def bench_domains():
+    import analyzer
+    import rules
+    from domain_classifier import PUBLIC_SUFFIX_RULES, DomainClassifier
+
+    print("=" * 60)
+    print("網域分類：endswith 逐一比對 vs 反轉標籤 trie")
+    print("=" * 60)
+
+    rng = random.Random(0)
+    hosts = [f"{rng.choice(['www', 'login', 'mail', 'shop'])}.site{rng.randint(0, 500000)}.{rng.choice(['com', 'xyz', 'com.tw', 'top', 'net'])}"
+             for _ in range(20000)] + ["evilgoogle.com", "mail.google.com", "gov.tw.evil.xyz"]
+    for size in (len(rules.SAFE_DOMAINS), 1000, 10000, 100000):
+        allow = set(rules.SAFE_DOMAINS) | {f"site{i}.{rng.choice(['com', 'net'])}" for i in range(size - len(rules.SAFE_DOMAINS))}
+        t0 = time.perf_counter()
+        classifier = DomainClassifier(PUBLIC_SUFFIX_RULES, allow=allow, deny=rules.SUSPICIOUS_TLDS)
+        build = time.perf_counter() - t0
+        sample = hosts if size <= 1000 else hosts[:2000]
+        legacy = _timed(lambda: [(any(h.endswith(sd) for sd in allow), any(h.endswith(t) for t in rules.SUSPICIOUS_TLDS))
+                                 for h in sample]) / len(sample)
+        trie = _timed(lambda: [classifier.classify(h) for h in hosts]) / len(hosts)
+        print(f"允許名單 {len(allow):6} 筆 | 建置 {build * 1000:7.1f} ms | endswith {legacy * 1e6:8.1f} µs | trie {trie * 1e6:5.1f} µs / 主機")
+
+    assert not analyzer.is_safe_domain("evilgoogle.com")
+    assert analyzer.is_safe_domain("mail.google.com")
+    assert analyzer.classify_domain("shop.example.com.tw")["registrable"] == "example.com.tw"
+    print("evilgoogle.com 不再被當成 google.com；mail.google.com 仍在允許名單")
+
+
+def bench_features():
+    import analyzer
+    import rules
+    import tools
+    from feature_cache import FEATURE_CACHE
+
+    print("=" * 60)
+    print("網址 / 網域特徵：每次重算 vs FEATURE_CACHE")
+    print("=" * 60)
+
+    rng = random.Random(0)
+    hosts = [f"shop{i}.example{i % 7}.{rng.choice(['com', 'xyz', 'com.tw', 'top'])}" for i in range(50)] + ["accounts.google.com"]
+    # 實際流量：少數網域反覆出現
+    urls = [f"https://{rng.choice(hosts)}/{rng.choice(['login', 'item', 'cart', 'verify'])}/{rng.randint(1, 20)}"
+            for _ in range(20000)]
+    features = [analyzer.domain_of, analyzer.classify_domain, analyzer.brand_lookalike,
+                tools.check_url_safety.func, tools.analyze_domain_age.func]
+
+    def run(wrapped: bool):
+        domain_of, classify, lookalike, url_safety, domain_age = (f.__wrapped__ if wrapped else f for f in features)
+        for u in urls:
+            d = domain_of(u)
+            classify(d)
+            lookalike(d)
+            url_safety(u)
+            domain_age(d)
+
+    FEATURE_CACHE.invalidate()
+    plain = _timed(run, True)
+    cold = _timed(run, False)
+    warm = _timed(run, False)      # 命中統計含冷、熱兩輪
+    print(f"{len(urls)} 個網址、{len(hosts)} 個網域 | 每次重算 {plain * 1000:7.1f} ms | 快取（冷）{cold * 1000:7.1f} ms | 快取（熱）{warm * 1000:7.1f} ms")
+    for name, info in FEATURE_CACHE.stats()["features"].items():
+        print(f"  {name:22} 命中 {info['hits']:6} / 未命中 {info['misses']:6}")
+
+    assert analyzer.is_safe_domain("accounts.google.com")
+    safe = rules.SAFE_DOMAINS
+    rules.SAFE_DOMAINS = frozenset(safe - {"google.com"})
+    try:
+        assert not analyzer.is_safe_domain("accounts.google.com")
+        print("SAFE_DOMAINS 換掉後，is_safe_domain 的舊結果已作廢")
+    finally:
+        rules.SAFE_DOMAINS = safe
+
+
+class _StubChain:
+    """代替 prompt | ChatOllama 的假模型：固定延遲後回傳固定內容。"""
+
+    def __init__(self, content: str, delay: float):
+        self.content, self.delay, self.calls = content, delay, 0
+
+    def invoke(self, _inputs):
+        from langchain_core.messages import AIMessage
+        self.calls += 1
+        time.sleep(self.delay)
+        return AIMessage(content=self.content)
+
+
+def bench_verdict():
+    import os
+    import shutil
+    import tempfile
+    import analyzer
+    import rules
+    import verdict_cache
+
+    print("=" * 60)
+    print("分析結果快取：stub LLM（每次呼叫 0.5 秒）")
+    print("=" * 60)
+
+    verdict = '{"is_potential_phishing": true, "risk_level": "high", "explanation": ["stub"], "confidence": 90}'
+    cot, final = _StubChain("stub 推理", 0.5), _StubChain(verdict, 0.5)
+    chains = analyzer.build_cot_thinking_chain, analyzer.build_analysis_chain
+    tiered, analyzer.TIERED_PIPELINE = analyzer.TIERED_PIPELINE, False      # 量的是 LLM 未命中 vs 命中
+    shutil.copyfile(rules.LOG_PATH, rules.LOG_PATH + ".bench")
+    analyzer.build_cot_thinking_chain, analyzer.build_analysis_chain = (lambda: cot), (lambda: final)
+    tmp = tempfile.mkdtemp()
+    previous = analyzer.VERDICT_CACHE
+    analyzer.VERDICT_CACHE = verdict_cache.VerdictCache(db_path=os.path.join(tmp, "verdicts.sqlite"))
+    try:
+        from html_utils import ParsedPage
+        for size in (8, 200):
+            html = synthetic_page(size * 1024, seed=size)
+            calls = cot.calls
+            miss = _timed(analyzer.analyze_deep, ParsedPage(html))
+            page = ParsedPage(html)
+            page.visible_text, page.analysis_urls      # 解析時間另計，只量指紋與快取查詢
+            t0 = time.perf_counter()
+            hit = analyzer.analyze_deep(page)
+            hit_time = time.perf_counter() - t0
+            assert hit["cached"] and cot.calls == calls + 1
+            print(f"{size:3} KB 頁面 | 未命中 {miss * 1000:8.1f} ms（LLM 2 次）| 命中 {hit_time * 1e6:6.0f} µs（LLM 0 次）")
+
+        # 空白與網址順序不同的同一頁面仍命中
+        reordered = ParsedPage("<p>請  立即登入</p><a href='https://b.example/'>連結</a><a href='https://a.example/'>連結</a>")
+        analyzer.analyze_deep(reordered)
+        same = ParsedPage("<p>請 立即登入</p>\n<a href='https://a.example/'>連結</a><a href='https://b.example/'>連結</a>")
+        assert analyzer.analyze_deep(same)["cached"]
+
+        # 磁碟層：新的快取物件（等同重啟）仍可命中
+        restarted = verdict_cache.VerdictCache(db_path=os.path.join(tmp, "verdicts.sqlite"))
+        key = analyzer.verdict_key(page.visible_text, page.analysis_urls, analyzer.ANALYSIS_MODE,
+                                   rules.page_code_digest(page))
+        assert restarted.get(key) is not None and restarted.disk_hits == 1
+        print("空白 / 網址順序不同仍命中；重啟後由磁碟層命中")
+
+        import server
+        server.init()
+        client = server.app.test_client()
+        body = {"text": "<p>帳戶異常，請立即登入驗證</p><a href='https://paypa1-login.xyz/'>x</a>"}
+        first = client.post("/analyze", json=body).get_json()
+        second = client.post("/analyze", json=body).get_json()
+        queued = client.post("/analyze_async", json=body).get_json()
+        assert not first["cached"] and second["cached"] and queued["status"] == "done" and queued["result"]["cached"]
+        print(f"/analyze：第一次 cached={first['cached']}，第二次 cached={second['cached']}；"
+              f"/analyze_async 直接回傳 status={queued['status']}")
+        print("統計：", analyzer.VERDICT_CACHE.stats())
+    finally:
+        analyzer.TIERED_PIPELINE = tiered
+        analyzer.build_cot_thinking_chain, analyzer.build_analysis_chain = chains
+        analyzer.VERDICT_CACHE = previous
+        shutil.rmtree(tmp, ignore_errors=True)
+        shutil.move(rules.LOG_PATH + ".bench", rules.LOG_PATH)
+
+
+def _edited(text: str, edits: int, rng: random.Random) -> str:
+    """把文字裡 edits 個位置換成別的字（模擬工具包重新部署時改的品牌名、電話、日期）。"""
+    chars = list(text)
+    for _ in range(edits):
+        chars[rng.randrange(len(chars))] = chr(0x4E00 + rng.randrange(3000))
+    return "".join(chars)
+
+
+def bench_near_dup(count: int = 1_000_000):
+    import os
+    import shutil
+    import tempfile
+    import analyzer
+    import near_dup
+    import rules
+
+    print("=" * 60)
+    print(f"近似重複頁面索引：{count:,} 個指紋")
+    print("=" * 60)
+
+    # 偵出率 / 誤判率：同一頁面改 N 個字 vs 不相關的頁面
+    rng = random.Random(0)
+    bases = [synthetic_text(1500, 0.05, seed=i) for i in range(300)]
+    sketches = [near_dup.minhash_sketch(t) for t in bases]
+    for edits in (3, 10, 30):
+        found = sum(near_dup.similarity(sk, near_dup.minhash_sketch(_edited(t, edits, rng))) >= near_dup.NEAR_DUP_THRESHOLD
+                    for t, sk in zip(bases, sketches))
+        print(f"1500 字頁面改 {edits:2} 個字：相似度 ≥ {near_dup.NEAR_DUP_THRESHOLD} 的比例 {found / len(bases):.1%}")
+    unrelated = max(near_dup.similarity(a, b) for a, b in zip(sketches, sketches[1:]))
+    print(f"不相關頁面兩兩之間最高相似度 {unrelated:.2f}")
+    t0 = time.perf_counter()
+    for t in bases[:100]:
+        near_dup.minhash_sketch(t)
+    print(f"草圖計算：1500 字 {(time.perf_counter() - t0) / 100 * 1000:.2f} ms / 頁，"
+          f"{near_dup.NEAR_DUP_MAX_CHARS} 字上限 {_timed(near_dup.minhash_sketch, synthetic_text(50000, 0.05)) * 1000:.1f} ms")
+
+    # 100 萬筆：寫入、記憶體、查詢
+    index = near_dup.NearDupIndex(capacity=count)
+    data_rng = random.Random(1)
+    stored = [data_rng.randbytes(near_dup.SKETCH_BINS) for _ in range(count)]
+    key = "00" * 16
+    t0 = time.perf_counter()
+    for i, sk in enumerate(stored):
+        index.add(sk, i, i % 3 == 0, "high", 90, key)
+    insert = time.perf_counter() - t0
+    del stored[count // 10:]
+    print(f"寫入 {count:,} 筆 {insert:.1f} 秒（{insert / count * 1e6:.1f} µs / 筆），索引 {index.stats()['memory_mb']} MB")
+
+    def near(sk: bytes, changed: int) -> bytes:
+        b = bytearray(sk)
+        for j in data_rng.sample(range(near_dup.SKETCH_BINS), changed):
+            b[j] ^= 0x5A
+        return bytes(b)
+
+    phishing = [near(stored[i], 3) for i in range(0, 30000, 3)]        # 鄰居判斷為釣魚，任何主機都沿用
+    misses = [data_rng.randbytes(near_dup.SKETCH_BINS) for _ in range(10000)]
+    hit_cost = _time_per_call(index.lookup, phishing)
+    miss_cost = _time_per_call(index.lookup, misses)
+    assert all(index.lookup(q) for q in phishing[:1000]) and not any(index.lookup(q) for q in misses[:1000])
+    # 安全的鄰居只在主機相同時沿用
+    assert index.lookup(near(stored[1], 3), 1) and not index.lookup(near(stored[1], 3), 2)
+    print(f"查詢：命中 {hit_cost:.1f} µs，未命中 {miss_cost:.1f} µs")
+
+    # 持久化：寫檔、重新載入後結果相同
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, "near_dup.idx")
+    try:
+        index.path, index.tag = path, "bench"
+        index._dirty = True
+        t0 = time.perf_counter()
+        index.save()
+        saved = time.perf_counter() - t0
+        restored = near_dup.NearDupIndex(capacity=count)
+        t0 = time.perf_counter()
+        loaded = restored.load(path, "bench")
+        load_time = time.perf_counter() - t0
+        assert loaded == len(index) == count
+        assert all(restored.lookup(q)["key"] == index.lookup(q)["key"] for q in phishing[:200])
+        print(f"持久化：寫檔 {saved:.2f} 秒、{os.path.getsize(path) / 2**20:.0f} MB；載入 {load_time:.1f} 秒（{loaded:,} 筆）")
+        assert near_dup.NearDupIndex(capacity=10).load(path, "other") == 0
+        small = near_dup.NearDupIndex(capacity=1000)
+        assert small.load(path, "bench") == 1000 and small.lookup(near(stored[0], 0)) is None
+        print("規則版本不同時捨棄；容量較小時只保留最新的條目")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    del index, restored
+
+    # 淘汰：容量滿了覆蓋最舊的
+    ring = near_dup.NearDupIndex(capacity=100)
+    first = data_rng.randbytes(near_dup.SKETCH_BINS)
+    ring.add(first, 0, True, "high", 90, key)
+    for _ in range(100):
+        ring.add(data_rng.randbytes(near_dup.SKETCH_BINS), 0, True, "high", 90, key)
+    assert len(ring) == 100 and ring.lookup(first) is None
+    print("容量 100 寫入 101 筆：最舊的被覆蓋")
+
+    # 端到端：stub LLM 下，改過幾個字的同一頁面不再呼叫 LLM
+    verdict = '{"is_potential_phishing": true, "risk_level": "high", "explanation": ["stub"], "confidence": 90}'
+    cot, final = _StubChain("stub 推理", 0.2), _StubChain(verdict, 0.2)
+    chains = analyzer.build_cot_thinking_chain, analyzer.build_analysis_chain
+    shutil.copyfile(rules.LOG_PATH, rules.LOG_PATH + ".bench")
+    analyzer.build_cot_thinking_chain, analyzer.build_analysis_chain = (lambda: cot), (lambda: final)
+    try:
+        kit = bases[0]
+        analyzer.analyze_deep(f"<p>{kit}</p><a href='https://paypa1-verify.xyz/'>登入</a>")
+        calls = cot.calls
+        result = analyzer.analyze_deep(f"<p>{_edited(kit, 10, rng)}</p><a href='https://secure-paypa1.top/'>登入</a>")
+        assert result["cached"] and result["near_duplicate"] and cot.calls == calls
+        print(f"重新部署的工具包（改 10 字、換網域）：cached={result['cached']}，"
+              f"相似度 {result['near_duplicate']['similarity']}，LLM 未呼叫")
+    finally:
+        analyzer.build_cot_thinking_chain, analyzer.build_analysis_chain = chains
+        shutil.move(rules.LOG_PATH + ".bench", rules.LOG_PATH)
+
+
+def _percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+def synthetic_traffic(count: int, seed: int = 0) -> list:
+    """混合流量：只連到允許名單的一般頁面、帳號驗證 + 緊急語氣的釣魚頁、介於兩者之間需要 LLM 的頁面。"""
+    rng = random.Random(seed)
+    filler = [chr(c) for c in range(0x4E00, 0x4E00 + 3000)]
+    pages = []
+    for i in range(count):
+        text = "".join(rng.choice(filler) for _ in range(rng.randint(200, 800)))
+        kind = rng.random()
+        if kind < 0.35:
+            links = [f"https://{rng.choice(['www.google.com', 'github.com', 'www.microsoft.com'])}/p/{i}"]
+        elif kind < 0.65:
+            text += "您的帳號已被停用，請立即登入並重新驗證密碼"
+            links = [f"https://{_random_label(rng, 8)}-account.xyz/login"]
+        else:
+            text += rng.choice(["本週優惠商品", "會員付款說明", "訂單已出貨", "請確認收件資料"])
+            links = [f"https://{_random_label(rng, 8)}.com/{_random_label(rng, 5)}"]
+        pages.append("<p>" + text + "</p>" + "".join(f"<a href='{u}'>連結</a>" for u in links))
+    return pages
+
+
+def bench_tiers(count: int = 60):
+    import json
+    import os
+    import shutil
+    import analyzer
+    import rules
+
+    print("=" * 60)
+    print("分層判斷：規則足以定案時不呼叫 LLM")
+    print("=" * 60)
+
+    # 1) 重播記錄下來的流量（REPLAY_LOG，預設 planner_tool_log.jsonl 的 final 紀錄）：
+    #    規則定案的請求以「工具階段上限 + 重新計算規則的時間」計，其餘沿用記錄的實際耗時
+    replay_path = os.environ.get("REPLAY_LOG", rules.LOG_PATH)
+    records = []
+    with open(replay_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("phase") == "final" and "elapsed" in record:
+                records.append(record)
+    if records:
+        before, after, skipped = [], [], 0
+        for record in records:
+            t0 = time.perf_counter()
+            r = analyzer.rule_score(record.get("visible_snippet", ""), record.get("urls", []), record.get("evidence", {}))
+            decided = analyzer.rule_tier_verdict(r, record.get("urls", []))
+            rule_time = time.perf_counter() - t0
+            before.append(record["elapsed"])
+            if decided is not None:
+                skipped += 1
+                after.append(rules.TOOL_STAGE_BUDGET_MS / 1000 + rule_time)
+            else:
+                after.append(record["elapsed"])
+        print(f"重播 {replay_path}：{len(records)} 筆，{skipped / len(records):.0%} 不必呼叫 LLM")
+        print(f"  原本 p50 {_percentile(before, 0.5):6.2f} 秒 p95 {_percentile(before, 0.95):6.2f} 秒")
+        print(f"  分層 p50 {_percentile(after, 0.5):6.2f} 秒 p95 {_percentile(after, 0.95):6.2f} 秒")
+    if len(records) < 50:
+        print(f"記錄只有 {len(records)} 筆，另以合成流量實際執行（REPLAY_LOG=正式環境日誌 可重播真實流量）")
+
+    # 2) 合成流量端到端：stub LLM 每段 0.3 秒，分層開 / 關各跑一次
+    verdict = '{"is_potential_phishing": true, "risk_level": "high", "explanation": ["stub"], "confidence": 90}'
+    cot, final = _StubChain("stub 推理", 0.3), _StubChain(verdict, 0.3)
+    chains = analyzer.build_cot_thinking_chain, analyzer.build_analysis_chain
+    tiered = analyzer.TIERED_PIPELINE
+    shutil.copyfile(rules.LOG_PATH, rules.LOG_PATH + ".bench")
+    analyzer.build_cot_thinking_chain, analyzer.build_analysis_chain = (lambda: cot), (lambda: final)
+    try:
+        pages = synthetic_traffic(count)
+        outcomes = {}
+        for mode in (False, True):
+            analyzer.TIERED_PIPELINE = mode
+            latencies, tiers, decisions = [], {}, []
+            for html in pages:
+                t0 = time.perf_counter()
+                result = analyzer.analyze_deep(html, check_cache=False)
+                latencies.append(time.perf_counter() - t0)
+                tiers[result["tier"]] = tiers.get(result["tier"], 0) + 1
+                decisions.append((result["tier"], (result["is_potential_phishing"], result["risk_level"])))
+            outcomes[mode] = decisions
+            label = "分層" if mode else "全部 LLM"
+            print(f"{label:8}：p50 {_percentile(latencies, 0.5) * 1000:6.0f} ms  p95 {_percentile(latencies, 0.95) * 1000:6.0f} ms  "
+                  f"判斷層 {tiers}")
+        # hard_flag 在 LLM 之後本來就會強制高風險，兩種模式的結論必須相同
+        forced = [i for i, (tier, decision) in enumerate(outcomes[True]) if tier == "rules" and decision[0]]
+        assert all(outcomes[False][i][1] == outcomes[True][i][1] for i in forced)
+        print(f"規則判定高風險的 {len(forced)} 頁與全部 LLM 時的結論相同")
+    finally:
+        analyzer.TIERED_PIPELINE = tiered
+        analyzer.build_cot_thinking_chain, analyzer.build_analysis_chain = chains
+        shutil.move(rules.LOG_PATH + ".bench", rules.LOG_PATH)
+
+
+class _LocalModelStub:
+    """模擬本機模型的假 chain：依輸入與輸出長度累計模擬耗時（不實際 sleep），判斷由內文的可疑字詞決定。
+
+    一個字約當一個 token；prefill / decode 速度取 8B 模型在單張消費級 GPU 上的量級。
+    """
+    CUES = ("登入", "驗證", "密碼", "停用", "立即", ".xyz", "付款")
+    PROMPT_OVERHEAD = 300       # system prompt 與格式說明
+
+    def __init__(self, kind: str, clock: list, prefill_tps: float, decode_tps: float, cot_tokens: int):
+        self.kind, self.clock, self.calls = kind, clock, 0
+        self.prefill_tps, self.decode_tps, self.cot_tokens = prefill_tps, decode_tps, cot_tokens
+
+    def invoke(self, inputs):
+        import json
+        from langchain_core.messages import AIMessage
+        self.calls += 1
+        text = inputs["visible_text"] + inputs["urls"] + inputs["evidence"]
+        cues = [w for w in self.CUES if w in text]
+        if self.kind == "cot":
+            lines = [f"{i}. 內文或網址出現「{w}」，屬於常見的釣魚手法。" for i, w in enumerate(cues, 1)] or ["1. 未看到明顯的可疑特徵。"]
+            body = "\n".join(lines)
+            content = body + "\n" + "綜合考量內文語氣、網址與工具結果，逐項比對可疑程度。" * max(1, (self.cot_tokens - len(body)) // 28)
+        else:
+            verdict = {
+                "is_potential_phishing": len(cues) >= 2,
+                "risk_level": "high" if len(cues) >= 3 else "medium" if len(cues) == 2 else "low",
+                "explanation": [f"出現「{w}」" for w in cues[:3]] or ["未發現可疑特徵"],
+                "confidence": min(55 + 10 * len(cues), 95),
+            }
+            if self.kind == "fast":
+                verdict["reasoning"] = f"命中 {len(cues)} 個可疑特徵"
+            content = json.dumps(verdict, ensure_ascii=False)
+        prompt_tokens = self.PROMPT_OVERHEAD + sum(len(str(v)) for v in inputs.values())
+        self.clock[0] += prompt_tokens / self.prefill_tps + len(content) / self.decode_tps
+        return AIMessage(content=content)
+
+
+def bench_modes(count: int = 60):
+    import os
+    import shutil
+    import analyzer
+    import rules
+
+    use_ollama = os.environ.get("BENCH_LLM") == "ollama"
+    prefill_tps = float(os.environ.get("BENCH_PREFILL_TPS", 1500))
+    decode_tps = float(os.environ.get("BENCH_DECODE_TPS", 35))
+    cot_tokens = int(os.environ.get("BENCH_COT_TOKENS", 500))
+    print("=" * 60)
+    if use_ollama:
+        print(f"LLM 分析模式：cot vs fast（Ollama {analyzer.MODEL_NAME}）")
+    else:
+        print(f"LLM 分析模式：cot vs fast（stub 模型：prefill {prefill_tps:.0f} tok/s、decode {decode_tps:.0f} tok/s、"
+              f"CoT 推理 {cot_tokens} tok）")
+    print("=" * 60)
+
+    # 模擬耗時 = 各次 stub 呼叫的累計；延遲 = 實際執行時間（解析、工具、規則、合併）+ 模擬耗時
+    clock = [0.0]
+    stubs = {kind: _LocalModelStub(kind, clock, prefill_tps, decode_tps, cot_tokens) for kind in ("cot", "json", "fast")}
+    chains = analyzer.build_cot_thinking_chain, analyzer.build_analysis_chain, analyzer.build_fast_analysis_chain
+    tiered, analyzer.TIERED_PIPELINE = analyzer.TIERED_PIPELINE, False      # 每頁都走 LLM，才比得出兩種模式
+    shutil.copyfile(rules.LOG_PATH, rules.LOG_PATH + ".bench")
+    if not use_ollama:
+        analyzer.build_cot_thinking_chain = lambda: stubs["cot"]
+        analyzer.build_analysis_chain = lambda: stubs["json"]
+        analyzer.build_fast_analysis_chain = lambda: stubs["fast"]
+    try:
+        pages = synthetic_traffic(count, seed=7)
+        outcomes = {}
+        for mode in analyzer.ANALYSIS_MODES:
+            latencies, decisions, calls = [], [], sum(stub.calls for stub in stubs.values())
+            for html in pages:
+                clock[0] = 0.0
+                t0 = time.perf_counter()
+                result = analyzer.analyze_deep(html, check_cache=False, mode=mode)
+                latencies.append(time.perf_counter() - t0 + clock[0])
+                assert result["mode"] == mode and result["tier"] == "llm"
+                decisions.append((result["is_potential_phishing"], result["risk_level"]))
+            outcomes[mode] = decisions
+            calls = sum(stub.calls for stub in stubs.values()) - calls
+            print(f"{mode:4}：p50 {_percentile(latencies, 0.5) * 1000:7.0f} ms  p95 {_percentile(latencies, 0.95) * 1000:7.0f} ms  "
+                  + ("" if use_ollama else f"LLM 呼叫 {calls / len(pages):.0f} 次 / 頁"))
+        same_decision = sum(a[0] == b[0] for a, b in zip(outcomes["cot"], outcomes["fast"]))
+        same_level = sum(a == b for a, b in zip(outcomes["cot"], outcomes["fast"]))
+        print(f"結論一致 {same_decision}/{len(pages)}（{same_decision / len(pages):.0%}），"
+              f"風險等級也一致 {same_level}/{len(pages)}（{same_level / len(pages):.0%}）")
+        if not use_ollama:
+            # stub 的判斷只看內文，不受模式影響；不一致代表 fast 路徑的解析或合併有差異
+            assert same_level == len(pages)
+
+        import server
+        server.init()
+        analyzer.VERDICT_CACHE.clear()
+        analyzer.NEAR_DUP_INDEX.reset(analyzer.ruleset_version())
+        client = server.app.test_client()
+        body = {"text": pages[0], "mode": "fast"}
+        first = client.post("/analyze", json=body).get_json()
+        again = client.post("/analyze", json=body).get_json()
+        other = client.post("/analyze", json={"text": pages[0], "mode": "cot"}).get_json()
+        bad = client.post("/analyze", json={"text": pages[0], "mode": "slow"})
+        # 精確快取依模式分開；近似重複索引不分模式，cot 請求在這裡是沿用相似頁面（tier=near_duplicate）
+        assert first["mode"] == "fast" and again["tier"] == "cache" and other["tier"] == "near_duplicate"
+        assert bad.status_code == 400
+        print("/analyze：mode 依請求切換，精確快取依模式分開，未知的 mode 回 400")
+    finally:
+        analyzer.TIERED_PIPELINE = tiered
+        analyzer.build_cot_thinking_chain, analyzer.build_analysis_chain, analyzer.build_fast_analysis_chain = chains
+        shutil.move(rules.LOG_PATH + ".bench", rules.LOG_PATH)
+
+
+class _FakeOllama:
+    """本機假 Ollama：POST /api/chat 等 delay 秒後回傳固定內容（串流 NDJSON、HTTP/1.1 keep-alive）。
+
+    content 也可以是函式（收到的請求 body → 內容）。token_delay > 0 時每兩個字送一個片段、片段間隔 token_delay 秒，
+    像真的模型一樣邊生成邊送；對方中途斷線時停止並記入 cancelled。
+    記錄請求數、TCP 連線數與同時處理中的請求數峰值。
+    """
+
+    def __init__(self, content, delay: float = 0.0, token_delay: float = 0.0):
+        import json
+        import socket
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        fake = self
+        self.content, self.delay, self.token_delay = content, delay, token_delay
+        self.requests = self.connections = self.active = self.max_active = self.cancelled = 0
+        self._lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # 和 Ollama（Go）一樣關閉 Nagle，否則標頭與內容分兩次寫出時每個請求多等 40 ms
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                with fake._lock:
+                    fake.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                with fake._lock:
+                    fake.requests += 1
+                    fake.active += 1
+                    fake.max_active = max(fake.max_active, fake.active)
+                time.sleep(fake.delay)
+                with fake._lock:
+                    fake.active -= 1
+                content = fake.content(body) if callable(fake.content) else fake.content
+                base = {"model": body.get("model", ""), "created_at": "2025-01-01T00:00:00Z"}
+                done = dict(base, message={"role": "assistant", "content": ""}, done=True, done_reason="stop",
+                            prompt_eval_count=1, eval_count=1)
+                if body.get("stream", True):
+                    step = 2 if fake.token_delay else max(1, len(content) // 3)
+                    chunks = [dict(base, message={"role": "assistant", "content": content[i:i + step]}, done=False)
+                              for i in range(0, len(content), step)] + [done]
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/x-ndjson")
+                    self.send_header("Transfer-Encoding", "chunked")
+                    self.end_headers()
+                    try:
+                        for chunk in chunks:
+                            data = (json.dumps(chunk, ensure_ascii=False) + "\n").encode("utf-8")
+                            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                            time.sleep(fake.token_delay)
+                        self.wfile.write(b"0\r\n\r\n")
+                    except (BrokenPipeError, ConnectionResetError):
+                        with fake._lock:
+                            fake.cancelled += 1
+                        self.close_connection = True
+                else:
+                    data = json.dumps(dict(done, message={"role": "assistant", "content": content}),
+                                      ensure_ascii=False).encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def bench_llm_pool():
+    import shutil
+    from concurrent.futures import ThreadPoolExecutor
+    from langchain_core.prompts import ChatPromptTemplate
+    from langchain_ollama import ChatOllama
+    import analyzer
+    import llm_pool
+    import rules
+
+    print("=" * 60)
+    print("LLM 連線池：本機假 Ollama")
+    print("=" * 60)
+
+    verdict = '{"is_potential_phishing": true, "risk_level": "high", "explanation": ["stub"], "confidence": 90}'
+    prompt = ChatPromptTemplate.from_messages([("human", "{visible_text}")])
+    fakes = []
+    try:
+        # 1) 每次請求新建 ChatOllama（舊做法） vs 長駐客戶端：客戶端成本與 TCP 連線數
+        fake = _FakeOllama(verdict)
+        fakes.append(fake)
+        n = 200
+        t0 = time.perf_counter()
+        for i in range(n):
+            (prompt | ChatOllama(base_url=fake.url, model="stub", temperature=0)).invoke({"visible_text": str(i)})
+        fresh = (time.perf_counter() - t0) / n
+        fresh_conns, fake.connections = fake.connections, 0
+        chain = prompt | llm_pool.LLMPool([fake.url]).chat(model="stub", temperature=0)
+        t0 = time.perf_counter()
+        for i in range(n):
+            chain.invoke({"visible_text": str(i)})
+        pooled = (time.perf_counter() - t0) / n
+        print(f"每次新建客戶端 {fresh * 1000:6.2f} ms / 次、{fresh_conns} 條連線 | "
+              f"連線池 {pooled * 1000:6.2f} ms / 次、{fake.connections} 條連線（{n} 次呼叫）")
+        assert fake.connections <= 2
+
+        # 2) 三個端點（其中一個慢 4 倍）、每個並行上限 2，16 個執行緒同時送 240 個請求
+        fast_a, fast_b, slow = _FakeOllama(verdict, 0.05), _FakeOllama(verdict, 0.05), _FakeOllama(verdict, 0.2)
+        fakes += [fast_a, fast_b, slow]
+        pool = llm_pool.LLMPool([fast_a.url, fast_b.url, slow.url], max_concurrency=2)
+        chain = prompt | pool.chat(model="stub", temperature=0)
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(16) as executor:
+            list(executor.map(lambda i: chain.invoke({"visible_text": str(i)}), range(240)))
+        elapsed = time.perf_counter() - t0
+        stats = pool.stats()
+        for label, server in (("快端點 A", fast_a), ("快端點 B", fast_b), ("慢端點  ", slow)):
+            print(f"{label}：{server.requests:3} 個請求，同時處理峰值 {server.max_active}")
+            assert server.max_active <= 2
+        print(f"240 個請求 {elapsed:5.2f} 秒（{240 / elapsed:5.1f} 次 / 秒）；排隊深度峰值 {stats['max_waiting']}、"
+              f"排隊過的請求 {stats['queued']}、平均等待 {stats['avg_wait_ms']} ms")
+        assert slow.requests < fast_a.requests and slow.requests < fast_b.requests
+
+        # 3) analyzer 的兩種模式都經由 LLM_POOL，chain 只建一次
+        shutil.copyfile(rules.LOG_PATH, rules.LOG_PATH + ".bench")
+        tiered, analyzer.TIERED_PIPELINE = analyzer.TIERED_PIPELINE, False
+        analyzer.LLM_POOL.set_endpoints([fast_a.url, fast_b.url])
+        try:
+            before = fast_a.requests + fast_b.requests
+            for mode, calls in (("cot", 2), ("fast", 1)):
+                result = analyzer.analyze_deep(synthetic_traffic(1, seed=3)[0], check_cache=False, mode=mode)
+                assert result["tier"] == "llm" and result["confidence"] == 95, result
+            assert fast_a.requests + fast_b.requests - before == 3
+            assert analyzer.build_cot_thinking_chain() is analyzer.build_cot_thinking_chain()
+            import server
+            server.init()
+            print("analyze_deep（cot 2 次 + fast 1 次呼叫）經由連線池：",
+                  server.app.test_client().get("/admin/llm_pool").get_json()["endpoints"])
+        finally:
+            analyzer.TIERED_PIPELINE = tiered
+            analyzer.LLM_POOL.set_endpoints(llm_pool.OLLAMA_ENDPOINTS)
+            shutil.move(rules.LOG_PATH + ".bench", rules.LOG_PATH)
+    finally:
+        for fake in fakes:
+            fake.close()
+
+
+def bench_stream():
+    import http.client
+    import json
+    import shutil
+    import threading
+    from werkzeug.serving import make_server
+    import analyzer
+    import llm_pool
+    import rules
+    import server
+    server.init()
+
+    verdict = '{"is_potential_phishing": true, "risk_level": "high", "explanation": ["stub"], "confidence": 90}'
+    reasoning = "1. 內文要求登入並驗證帳號。\n2. 網址不是官方網域。\n" * 10
+
+    def content(body):
+        # CoT 第一段的 prompt 要求「詳細說明你的分析思路」，其餘呼叫回 JSON 判斷
+        return reasoning if "分析思路" in json.dumps(body, ensure_ascii=False) else verdict
+
+    print("=" * 60)
+    print("POST /analyze_stream：本機假 Ollama 每 2 字 20 ms（CoT 約 %d 字）" % len(reasoning))
+    print("=" * 60)
+
+    fake = _FakeOllama(content, token_delay=0.02)
+    httpd = make_server("127.0.0.1", 0, server.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    port = httpd.server_address[1]
+    shutil.copyfile(rules.LOG_PATH, rules.LOG_PATH + ".bench")
+    tiered, analyzer.TIERED_PIPELINE = analyzer.TIERED_PIPELINE, False
+    analyzer.LLM_POOL.set_endpoints([fake.url])
+
+    def post(path: str, text: str, mode: str = "cot"):
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        conn.request("POST", path, body=json.dumps({"text": text, "mode": mode}), headers={"Content-Type": "application/json"})
+        return conn, conn.getresponse()
+
+    try:
+        for mode in analyzer.ANALYSIS_MODES:
+            pages = [f"<p>第 {mode} 號通知：您的帳戶需要重新確認資料 {i}</p><a href='https://shop-{mode}{i}.com/a'>連結</a>"
+                     for i in range(2)]
+            t0 = time.perf_counter()
+            conn, resp = post("/analyze", pages[0], mode)
+            json.loads(resp.read())
+            conn.close()
+            blocking = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            conn, resp = post("/analyze_stream", pages[1], mode)
+            arrivals, event, cot_chunks = {}, None, 0
+            for raw in resp:
+                line = raw.decode("utf-8").rstrip("\n")
+                if line.startswith("event: "):
+                    event = line[7:]
+                    arrivals.setdefault(event, time.perf_counter() - t0)
+                    cot_chunks += event == "cot"
+                elif line.startswith("data: ") and event == "verdict":
+                    final = json.loads(line[6:])
+            conn.close()
+            assert list(arrivals) == ["blacklist", "rules"] + (["cot"] if mode == "cot" else []) + ["verdict"], arrivals
+            assert final["tier"] == "llm" and final["mode"] == mode and final["is_blacklisted"] is False
+            print(f"{mode:4}：/analyze 整段 {blocking * 1000:6.0f} ms | /analyze_stream " +
+                  "  ".join(f"{name} {t * 1000:6.1f} ms" for name, t in arrivals.items()) +
+                  (f"（CoT {cot_chunks} 個片段）" if cot_chunks else ""))
+
+        # 讀到第一個 CoT 片段就斷線：模型端的生成應隨之中止、連線池名額歸還
+        cancelled = fake.cancelled
+        conn, resp = post("/analyze_stream", "<p>帳戶異常，請確認</p><a href='https://cancel-test.com/'>連結</a>")
+        for raw in resp:
+            if raw.startswith(b"event: cot"):
+                break
+        t0 = time.perf_counter()
+        resp.close()
+        conn.close()
+        while (fake.cancelled == cancelled or analyzer.LLM_POOL.stats()["outstanding"]) and time.perf_counter() - t0 < 3:
+            time.sleep(0.01)
+        assert fake.cancelled == cancelled + 1 and analyzer.LLM_POOL.stats()["outstanding"] == 0
+        with open(rules.LOG_PATH, "r", encoding="utf-8") as f:
+            assert any('"phase": "cancelled"' in line for line in f)
+        print(f"斷線後 {(time.perf_counter() - t0) * 1000:.0f} ms 內模型端停止生成、連線池名額歸還，日誌記錄 cancelled")
+    finally:
+        analyzer.TIERED_PIPELINE = tiered
+        analyzer.LLM_POOL.set_endpoints(llm_pool.OLLAMA_ENDPOINTS)
+        httpd.shutdown()
+        fake.close()
+        shutil.move(rules.LOG_PATH + ".bench", rules.LOG_PATH)
+
+
+def bench_batch(count: int = 60):
+    import json
+    import os
+    import shutil
+    import analyzer
+    import batch_pipeline
+    import llm_pool
+    import rules
+
+    verdict = '{"is_potential_phishing": true, "risk_level": "high", "explanation": ["stub"], "confidence": 90}'
+    fakes = [_FakeOllama(verdict, 0.2), _FakeOllama(verdict, 0.2)]
+    analyzer.LLM_POOL.set_endpoints([fake.url for fake in fakes], max_concurrency=2)
+    print("=" * 60)
+    print(f"批次分析：{count} 頁（每頁另含約 30 KB 一般內容），假 Ollama 2 個端點 × 並行 2、每次呼叫 0.2 秒；"
+          f"BATCH_WORKERS={batch_pipeline.BATCH_WORKERS}（本機 {os.cpu_count()} 核）")
+    print("=" * 60)
+
+    rng = random.Random(11)
+    words = ["商品", "介紹", "規格", "配送", "說明", "會員", "評價", "product", "detail", "shipping", "review"]
+    pages = []
+    for html in synthetic_traffic(count - count // 10, seed=5):
+        filler = "".join("<div><p>" + " ".join(rng.choice(words) for _ in range(30)) + "</p></div>" for _ in range(120))
+        pages.append(html + filler)
+    pages += [rng.choice(pages) for _ in range(count // 10)]        # 爬蟲常重複抓到同一頁
+    items = list(enumerate(pages))
+
+    def reset_caches():
+        analyzer.VERDICT_CACHE.clear()
+        analyzer.NEAR_DUP_INDEX.reset(analyzer.ruleset_version())
+
+    shutil.copyfile(rules.LOG_PATH, rules.LOG_PATH + ".bench")
+    try:
+        t0 = time.perf_counter()
+        list(batch_pipeline.analyze_batch([("warmup", pages[0])]))
+        print(f"行程池啟動（第一次批次請求） {time.perf_counter() - t0:5.2f} 秒")
+
+        reset_caches()
+        calls = sum(fake.requests for fake in fakes)
+        t0 = time.perf_counter()
+        sequential = {page_id: analyzer.analyze_deep(html) for page_id, html in items}
+        seq_time = time.perf_counter() - t0
+        seq_calls = sum(fake.requests for fake in fakes) - calls
+
+        reset_caches()
+        calls = sum(fake.requests for fake in fakes)
+        order, first = [], None
+        t0 = time.perf_counter()
+        batched = {}
+        for page_id, result in batch_pipeline.analyze_batch(items):
+            first = first or time.perf_counter() - t0
+            order.append(page_id)
+            batched[page_id] = result
+        batch_time = time.perf_counter() - t0
+        batch_calls = sum(fake.requests for fake in fakes) - calls
+
+        assert sorted(order) == [page_id for page_id, _ in items]
+        assert all("error" not in result for result in batched.values())
+        assert all((sequential[i]["is_potential_phishing"], sequential[i]["risk_level"]) ==
+                   (batched[i]["is_potential_phishing"], batched[i]["risk_level"]) for i in sequential)
+        tiers = {}
+        for result in batched.values():
+            tiers[result["tier"]] = tiers.get(result["tier"], 0) + 1
+        print(f"逐頁 analyze_deep：{seq_time:6.2f} 秒，{count / seq_time:5.1f} 頁 / 秒，LLM 呼叫 {seq_calls} 次")
+        print(f"分段管線        ：{batch_time:6.2f} 秒，{count / batch_time:5.1f} 頁 / 秒，LLM 呼叫 {batch_calls} 次，"
+              f"第一筆結果 {first * 1000:.0f} ms")
+        print(f"判斷層 {tiers}；依完成順序回傳（前 10 筆 id：{order[:10]}）；結論與逐頁分析相同")
+
+        import server
+        server.init()
+        reset_caches()
+        body = {"pages": [{"id": f"p{i}", "text": html} for i, html in items[:6]], "mode": "fast"}
+        lines = [json.loads(line) for line in server.app.test_client().post("/analyze_batch", json=body).get_data(as_text=True).splitlines()]
+        assert lines[-1]["done"] and lines[-1]["count"] == 6
+        assert sorted(line["id"] for line in lines[:-1]) == [f"p{i}" for i in range(6)]
+        assert all(line["result"]["mode"] == "fast" for line in lines[:-1] if line["result"]["tier"] == "llm")
+        print(f"POST /analyze_batch：6 頁 NDJSON，最後一行 {lines[-1]}")
+    finally:
+        analyzer.LLM_POOL.set_endpoints(llm_pool.OLLAMA_ENDPOINTS)
+        for fake in fakes:
+            fake.close()
+        shutil.move(rules.LOG_PATH + ".bench", rules.LOG_PATH)
+
+
+def bench_tools():
+    import shutil
+    import analyzer
+    import rules
+    from langchain_core.tools import StructuredTool
+    from html_utils import ParsedPage
+
+    print("=" * 60)
+    print(f"工具證據階段：TOOL_TIMEOUT_MS={rules.TOOL_TIMEOUT_MS}、TOOL_STAGE_BUDGET_MS={rules.TOOL_STAGE_BUDGET_MS}")
+    print("=" * 60)
+
+    page = ParsedPage(synthetic_page(200 * 1024))
+    urls, visible = page.analysis_urls, page.visible_text
+
+    def slow_check(text: str) -> str:
+        """模擬卡住的外部查詢。"""
+        time.sleep(2)
+        return "slow"
+
+    def slow_planner(urls, visible):
+        time.sleep(2)
+        return []
+
+    # 證據階段會寫 planner_tool_log.jsonl，跑完還原
+    shutil.copyfile(rules.LOG_PATH, rules.LOG_PATH + ".bench")
+    registry, always_on = dict(rules.TOOL_REGISTRY), list(rules.ALWAYS_ON_TOOLS)
+    planner, planner_enabled = analyzer.plan_tool_calls, rules.TOOL_PLANNER_ENABLED
+    try:
+        sequential = _timed(lambda: [rules.TOOL_REGISTRY[t].func(**analyzer.default_tool_args(t, urls, visible))
+                                     for t in rules.ALWAYS_ON_TOOLS])
+        evidence = analyzer.collect_tool_evidence(urls, visible)
+        concurrent = _timed(analyzer.collect_tool_evidence, urls, visible)
+        print(f"{len(evidence)} 個工具依序執行 {sequential * 1000:7.1f} ms | 並行 {concurrent * 1000:7.1f} ms")
+
+        rules.TOOL_REGISTRY["slow_check"] = StructuredTool.from_function(slow_check)
+        rules.ALWAYS_ON_TOOLS.append("slow_check")
+        t0 = time.perf_counter()
+        evidence = analyzer.collect_tool_evidence(urls, visible)
+        elapsed = (time.perf_counter() - t0) * 1000
+        print(f"加入 2 秒的慢工具           | 階段 {elapsed:7.1f} ms | slow_check → {evidence['slow_check']}")
+        assert elapsed < rules.TOOL_TIMEOUT_MS + 50, elapsed
+
+        analyzer.plan_tool_calls, rules.TOOL_PLANNER_ENABLED = slow_planner, True
+        t0 = time.perf_counter()
+        evidence = analyzer.collect_tool_evidence(urls, visible)
+        elapsed = (time.perf_counter() - t0) * 1000
+        print(f"planner 需要 2 秒           | 階段 {elapsed:7.1f} ms | 取得 {sum(isinstance(v, str) for v in evidence.values())} 個工具結果")
+        assert elapsed < rules.TOOL_STAGE_BUDGET_MS + 50, elapsed
+    finally:
+        rules.TOOL_REGISTRY.clear()
+        rules.TOOL_REGISTRY.update(registry)
+        rules.ALWAYS_ON_TOOLS[:] = always_on
+        analyzer.plan_tool_calls, rules.TOOL_PLANNER_ENABLED = planner, planner_enabled
+        shutil.move(rules.LOG_PATH + ".bench", rules.LOG_PATH)
+
+
+BENCHMARKS = {
+    "blacklist": bench_blacklist,
+    "snapshot": bench_snapshot,
+    "bloom": bench_bloom,
+    "check_urls": bench_check_urls,
+    "memory": bench_memory,
+    "parse": bench_parse,
+    "parser": bench_parser,
+    "relevant": bench_relevant,
+    "keywords": bench_keywords,
+    "js": bench_js,
+    "domain_age": bench_domain_age,
+    "brands": bench_brands,
+    "domains": bench_domains,
+    "features": bench_features,
+    "verdict": bench_verdict,
+    "near_dup": bench_near_dup,
+    "tiers": bench_tiers,
+    "modes": bench_modes,
+    "llm_pool": bench_llm_pool,
+    "stream": bench_stream,
+    "batch": bench_batch,
+    "tools": bench_tools,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"未知的基準測試：{name}（可用：{', '.join(BENCHMARKS)}）")
+            sys.exit(1)
+        BENCHMARKS[name]()
@@ -1,119 +1,988 @@
 # blacklist.py — 官方黑名單 + 使用者黑名單
 import csv
+import json
+import math
+import mmap
 import os
-OFFICIAL_BLACKLIST = set()
-USER_BLACKLIST = set()
-USER_FILE = "user_blacklist.txt"
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from itertools import islice
+
+from domain_classifier import PUBLIC_SUFFIXES
+from file_utils import snapshot_is_stale
+from url_utils import canonical_parts, canonicalize_url
+
+USER_FILE = "user_blacklist.txt"        # 舊版純文字名單，只在第一次啟動時匯入日誌
+USER_JOURNAL = "user_blacklist.jsonl"
+
+# 命中粒度（由精確到寬鬆）
+MATCH_LEVELS = ("exact", "path", "host", "domain")
+
+# 索引節點旗標
+_EXACT = 1    # 完整網址
+_PATH = 2     # 路徑前綴（同主機、路徑以此開頭）
+_HOST = 4     # 整個主機（條目只有網域、沒有路徑）
+_DOMAIN = 8   # 整個可註冊網域（條目本身就是可註冊網域）
+
+
+def _key_parts(url: str):
+    """把網址拆成 (反轉主機標籤, 路徑, query)，忽略協定、port 與 fragment。
+
+    正規化規則與 html_utils.extract_urls 相同（url_utils.canonical_parts），
+    因此 http://x.com、https://x.com/、HTTP://X.COM:80 都會落在同一個鍵。
+    """
+    parts = canonical_parts(url, assume_http=True)
+    if not parts:
+        return None
+    _, host, _, path, query = parts
+    rhost = ".".join(reversed(host.split(".")))
+    return rhost, path, query
+
+
+def _is_registrable(rhost: str) -> bool:
+    """反轉主機是否剛好是可註冊網域（例如 com.evil、tw.com.evil）；公共後綴規則見 domain_classifier。"""
+    host = ".".join(reversed(rhost.split(".")))
+    info = PUBLIC_SUFFIXES.classify(host)
+    return info["tld_class"] != "ip" and info["registrable"] == host
+
+
+def _entry_key(url: str):
+    """把一筆黑名單條目轉成 (鍵, 旗標)；無法解析回傳 None。"""
+    parts = _key_parts(url)
+    if not parts:
+        return None
+    rhost, path, query = parts
+    if query:
+        # 帶 query 的條目只做精確比對（避免 google.com/url?q=... 汙染整個路徑）
+        return f"{rhost}{path}?{query}", _EXACT
+    if path == "/":
+        return rhost + "/", _HOST | (_DOMAIN if _is_registrable(rhost) else 0)
+    return rhost + path, _EXACT | _PATH
+
+
+def _match(url: str, flags_of):
+    """依序探測候選鍵，回傳最精確的命中粒度；flags_of(key) 回傳該鍵的旗標。"""
+    parts = _key_parts(url)
+    if not parts:
+        return None
+    rhost, path, query = parts
+
+    if query and flags_of(f"{rhost}{path}?{query}") & _EXACT:
+        return "exact"
+
+    flags = flags_of(rhost + path)
+    if not query and flags & _EXACT:
+        return "exact"
+    if flags & _PATH:
+        return "path"
+
+    # 較短的路徑前綴：/a/b/c → /a/b → /a
+    prefix = path
+    while True:
+        cut = prefix.rfind("/")
+        if cut <= 0:
+            break
+        prefix = prefix[:cut]
+        if flags_of(rhost + prefix) & _PATH:
+            return "path"
+
+    flags = flags_of(rhost + "/")
+    if flags & _HOST:
+        return "host"
+    if flags & _DOMAIN:
+        return "domain"
+
+    # 上層網域：com.evil.login.www → com.evil.login → com.evil
+    cut = rhost.rfind(".")
+    while cut > 0:
+        if flags_of(rhost[:cut] + "/") & _DOMAIN:
+            return "domain"
+        cut = rhost.rfind(".", 0, cut)
+    return None
+
+
+class BlacklistIndex:
+    """以「反轉主機標籤 + 路徑」為鍵的黑名單索引。
+
+    鍵的形式為 ``com.evil.www/login``，主機條目為 ``com.evil.www/``。
+    查詢時只需探測 O(標籤數 + 路徑層數) 個鍵，與名單大小無關。
+    """
+
+    version = 0
+    bloom = None
+
+    def __init__(self):
+        self._keys = {}
+        self._refs = {}   # 每個鍵由幾筆條目產生，刪除時用來判斷能否移除鍵
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, url: str) -> bool:
+        entry = _entry_key(url)
+        if not entry:
+            return False
+        key, flags = entry
+        self._keys[key] = self._keys.get(key, 0) | flags
+        self._refs[key] = self._refs.get(key, 0) + 1
+        return True
+
+    def discard(self, url: str):
+        entry = _entry_key(url)
+        if not entry:
+            return
+        key = entry[0]
+        refs = self._refs.get(key, 0)
+        if refs > 1:
+            self._refs[key] = refs - 1
+        elif refs:
+            del self._refs[key]
+            del self._keys[key]
+
+    def clear(self):
+        self._keys.clear()
+        self._refs.clear()
+
+    def items(self):
+        return self._keys.items()
+
+    def _flags(self, key: str) -> int:
+        return self._keys.get(key, 0)
+
+    def lookup(self, url: str):
+        """回傳最精確的命中粒度（MATCH_LEVELS 之一），未命中回傳 None。"""
+        return _match(url, self._flags)
+
+
+# ------------------ 二進位快照 ------------------
+# 檔案格式（little-endian）：
+#   header  : magic(8) + 筆數 uint32 + 版本 uint32
+#   hashes  : 筆數 個 uint32，每個鍵的 CRC32，遞增排序
+#   offsets : (筆數 + 1) 個 uint32，每筆記錄在 blob 中的起點
+#   blob    : 每筆記錄 = 旗標 1 byte + 鍵（UTF-8），依 (CRC32, 鍵) 排序、去重
+SNAPSHOT_MAGIC = b"BLSNAP04"
+_HEADER = struct.Struct("<8sII")
+
+
+class BloomFilter:
+    """快照前的 Bloom filter：絕大多數未命中的鍵不必進入二分搜尋。
+
+    檔案格式：magic(8) + 位元數 uint64 + 雜湊數 uint32 + 鍵數 uint32 + 快照版本 uint32
+    + 目標誤判率 float64 + 位元陣列。使用雙重雜湊 h1 + i*h2，h1 與快照的 CRC32 欄共用。
+    """
+
+    MAGIC = b"BLBLOOM2"
+    _HEADER = struct.Struct("<8sQIIId")
+    _SEED = 0x5BD1E995
+    MAX_HASHES = 3
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._m, self._k, self.count, self.version, self.fp_rate = self._HEADER.unpack_from(self._mm, 0)
+        if magic != self.MAGIC:
+            self._mm.close()
+            raise ValueError(f"Bloom filter 格式不符：{path}")
+        self._bits = memoryview(self._mm)[self._HEADER.size:]
+        self.path = path
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._bits)
+
+    @classmethod
+    def write(cls, keys, count: int, path: str, fp_rate: float, version: int = 0):
+        """keys 為 (CRC32, 鍵 bytes) 序列。"""
+        count = max(count, 1)
+        # 雜湊數上限 MAX_HASHES：每次查詢是 Python 迴圈，寧可多用一點位元換較少的雜湊
+        k = max(1, min(cls.MAX_HASHES, round(-math.log2(fp_rate))))
+        m = max(64, math.ceil(-k * count / math.log(1 - fp_rate ** (1 / k))))
+        bits = bytearray((m + 7) // 8)
+        for h1, key in keys:
+            h2 = zlib.crc32(key, cls._SEED) | 1
+            for i in range(k):
+                pos = (h1 + i * h2) % m
+                bits[pos >> 3] |= 1 << (pos & 7)
+
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(cls._HEADER.pack(cls.MAGIC, m, k, count, version, fp_rate))
+            f.write(bits)
+        os.replace(tmp, path)
+
+    def might_contain(self, key: bytes, h1: int) -> bool:
+        h2 = zlib.crc32(key, self._SEED) | 1
+        m, bits = self._m, self._bits
+        for i in range(self._k):
+            pos = (h1 + i * h2) % m
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def close(self):
+        self._bits.release()
+        self._mm.close()
+
+
+def bloom_path_for(snap_path: str) -> str:
+    return os.path.splitext(snap_path)[0] + ".bloom"
+
+
+def write_snapshot(urls, snap_path: str, bloom_fp_rate: float = 0.0, version: int = 0) -> int:
+    """把網址集合編譯成排序好的二進位快照（先寫暫存檔再原子替換），回傳鍵數。
+
+    bloom_fp_rate > 0 時，先在旁邊寫出同版本的 Bloom filter（見 bloom_path_for），
+    再替換快照，讀者換到新快照時一定找得到對應的 filter。
+    """
+    merged = {}
+    for url in urls:
+        entry = _entry_key(url)
+        if entry:
+            key, flags = entry
+            merged[key] = merged.get(key, 0) | flags
+
+    records = sorted((zlib.crc32(k), k, v) for k, v in ((k.encode("utf-8"), v) for k, v in merged.items()))
+    hashes = array("I", (h for h, _, _ in records))
+    offsets = array("I", [0])
+    blob = bytearray()
+    for _, key, flags in records:
+        blob.append(flags)
+        blob += key
+        offsets.append(len(blob))
+    if sys.byteorder != "little":
+        hashes.byteswap()
+        offsets.byteswap()
+
+    if bloom_fp_rate > 0:
+        BloomFilter.write(((h, k) for h, k, _ in records), len(records),
+                          bloom_path_for(snap_path), bloom_fp_rate, version)
+
+    tmp = snap_path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(SNAPSHOT_MAGIC, len(records), version))
+        f.write(hashes.tobytes())
+        f.write(offsets.tobytes())
+        f.write(blob)
+    os.replace(tmp, snap_path)
+    return len(records)
+
+
+def snapshot_version(snap_path: str) -> int:
+    """讀快照 header 中的版本號；不存在或格式不符時回傳 0。"""
+    try:
+        with open(snap_path, "rb") as f:
+            magic, _, version = _HEADER.unpack(f.read(_HEADER.size))
+        return version if magic == SNAPSHOT_MAGIC else 0
+    except (OSError, struct.error):
+        return 0
+
+
+def read_csv_urls(csv_path: str):
+    with open(csv_path, "r", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            url = (row.get("url") or "").strip()
+            if url:
+                yield url
+
+
+def read_user_urls(user_path: str) -> list:
+    """依加入順序讀出使用者名單（去重）。"""
+    if not os.path.exists(user_path):
+        return []
+    with open(user_path, "r", encoding="utf-8") as f:
+        return list(dict.fromkeys(u for u in (line.strip() for line in f) if u))
+
+
+def compile_snapshot(csv_path: str, snap_path: str, bloom_fp_rate: float = 0.0) -> int:
+    """把官方 CSV 編譯成二進位快照（版本號接續舊快照），回傳鍵數。"""
+    return write_snapshot(read_csv_urls(csv_path), snap_path, bloom_fp_rate, snapshot_version(snap_path) + 1)
+
+
+class SnapshotIndex:
+    """以 mmap 開啟快照檔，對 CRC32 欄二分搜尋後比對鍵，不為每筆條目建立 Python 物件。
+
+    同一台主機上的多個 worker 映射同一個檔案時，共用作業系統的 page cache，
+    整份名單在記憶體中只有一份唯讀副本。
+    """
+
+    def __init__(self, snap_path: str, bloom_path: str = None):
+        if sys.byteorder != "little":
+            raise ValueError("快照僅支援 little-endian 平台")
+        with open(snap_path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, self.version = _HEADER.unpack_from(self._mm, 0)
+        if magic != SNAPSHOT_MAGIC:
+            self._mm.close()
+            raise ValueError(f"快照格式不符：{snap_path}")
+        self._count = count
+        view = memoryview(self._mm)
+        start = _HEADER.size
+        self._hashes = view[start:start + 4 * count].cast("I")
+        start += 4 * count
+        self._offsets = view[start:start + 4 * (count + 1)].cast("I")
+        self._blob_start = start + 4 * (count + 1)
+        self.path = snap_path
+        self.bloom = BloomFilter(bloom_path) if bloom_path else None
+        if self.bloom is not None and self.bloom.version != self.version:
+            # filter 與快照版本不一致時寧可不用，避免漏判
+            self.bloom.close()
+            self.bloom = None
+
+    def __len__(self):
+        return self._count
+
+    def _flags(self, key: str) -> int:
+        target = key.encode("utf-8")
+        h = zlib.crc32(target)
+        if self.bloom is not None and not self.bloom.might_contain(target, h):
+            return 0
+        hashes, offsets, mm, base = self._hashes, self._offsets, self._mm, self._blob_start
+        i = bisect_left(hashes, h)
+        while i < self._count and hashes[i] == h:
+            start = base + offsets[i]
+            if mm[start + 1:base + offsets[i + 1]] == target:
+                return mm[start]
+            i += 1
+        return 0
+
+    def lookup(self, url: str):
+        if not self._count:
+            return None
+        return _match(url, self._flags)
+
+    def close(self):
+        if self.bloom is not None:
+            self.bloom.close()
+        self._hashes.release()
+        self._offsets.release()
+        self._mm.close()
+
+
+# ------------------ 跨 worker 共用的使用者名單 ------------------
+try:
+    import fcntl
+except ImportError:  # Windows：開發伺服器只有單一行程，不需要跨行程鎖
+    fcntl = None
+
+
+class SharedSnapshot:
+    """多個 worker 共用的 mmap 快照。
+
+    每個 worker 最多每 sync_interval 秒 stat 一次快照檔，檔案換了才重新 mmap，
+    並以一次參考賦值切換到新版本：查詢中的請求繼續讀舊版本，不會看到半成品。
+    寫入者以檔案鎖序列化，寫完暫存檔再原子替換。
+    """
+
+    def __init__(self, snap_path: str, sync_interval: float = 1.0, bloom_path: str = None):
+        self.snap_path = snap_path
+        self.bloom_path = bloom_path
+        self.lock_path = snap_path + ".lock"
+        self.sync_interval = sync_interval
+        self._index = None
+        self._signature = None
+        self._checked = 0.0
+        self._local_lock = threading.Lock()
+
+    def __len__(self):
+        index = self._index
+        return len(index) if index else 0
+
+    @property
+    def version(self) -> int:
+        index = self._index
+        return index.version if index else 0
+
+    @property
+    def bloom(self):
+        index = self._index
+        return index.bloom if index else None
+
+    @contextmanager
+    def _locked(self):
+        with self._local_lock, open(self.lock_path, "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def refresh(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._checked < self.sync_interval:
+            return
+        self._checked = now
+        try:
+            st = os.stat(self.snap_path)
+        except OSError:
+            return
+        signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if signature == self._signature:
+            return
+        try:
+            index = SnapshotIndex(self.snap_path, self.bloom_path)
+        except (OSError, ValueError) as e:
+            print("[BLACKLIST] 黑名單快照載入失敗:", e)
+            return
+        # 只換參考，不關閉舊的 mmap：正在查詢的執行緒仍可安全讀完
+        self._index, self._signature = index, signature
+
+    def lookup(self, url: str):
+        self.refresh()
+        index = self._index
+        try:
+            return index.lookup(url) if index else None
+        except ValueError:
+            # Windows 換版時舊 mmap 剛被關閉：改查已換上的索引
+            index = self._index
+            return index.lookup(url) if index else None
+
+    def _release_for_replace(self, urls, version: int):
+        """Windows 無法替換仍被映射的檔案：先換上新內容的記憶體索引，再關閉舊 mmap，換版期間查詢不會落空。"""
+        if os.name != "nt" or not self._index:
+            return
+        old, stand_in = self._index, BlacklistIndex()
+        for url in urls:
+            stand_in.add(url)
+        stand_in.version = version
+        self._index = stand_in
+        old.close()
+
+
+class UserBlacklistJournal:
+    """使用者名單：append-only 日誌（JSON lines）+ 記憶體中的有序索引。
+
+    - 寫入：持有檔案鎖，先追上日誌尾端，再附加一筆 add / del / clear 記錄，O(1)
+    - 同步：每個 worker 最多每 sync_interval 秒 stat 一次日誌，只讀取新增的位元組；
+      日誌被壓縮（inode 改變）時才整份重讀
+    - 壓縮：作廢的記錄數、或尚未進快照的條目數超過門檻時，背景執行緒把仍有效的條目寫成
+      mmap 快照（格式同官方名單，所有 worker 共用一份），再改寫成以 snap 記錄開頭的新日誌
+    - 查詢：快照 + 各 worker 只為快照之後新增的條目建的小索引；快照內被刪除的鍵以遮罩排除
+    - 列表：依 seq（加入順序）分頁，cursor 為上一頁最後一筆的 seq
+    查詢與列表不持鎖，只讀 _view（一次參考賦值換上）：重讀日誌時新狀態建好才換上，不會看到空的名單。
+    """
+
+    def __init__(self, path: str, legacy_path: str = None, sync_interval: float = 1.0,
+                 compact_min: int = 1000):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.lock_path = path + ".lock"
+        self.snap_path = os.path.splitext(path)[0] + ".snap"
+        self.sync_interval = sync_interval
+        self.compact_min = compact_min
+        self._lock = threading.RLock()
+        self._compacting = False
+        self._reset()
+        self._publish()
+
+    def _reset(self):
+        """清空狀態（不換上 _view：查詢繼續用舊狀態，直到 _tail 讀完後 _publish）。"""
+        self._urls = {}          # url -> (seq, ts)，依加入順序
+        self._by_seq = {}        # seq -> url
+        self._order = []         # 遞增的 seq；刪除留下的空洞在壓縮時清掉
+        self._index = BlacklistIndex()   # 只含快照之後新增的條目
+        self._base = None        # 這份日誌 snap 記錄對應的共用快照（SnapshotIndex）
+        self._base_version = 0   # 快照涵蓋到的 seq
+        self._base_refs = {}     # 快照中由多筆條目共用的鍵 → 條目數
+        self._masked = set()     # 快照中已無有效條目的鍵
+        self._overlay = 0        # 不在快照裡的有效條目數
+        self._records = 0        # 日誌中的記錄數（含已作廢者）
+        self._max_seq = 0
+        self._offset = 0
+        self._inode = None
+        self._checked = 0.0
+
+    def _publish(self):
+        """把查詢 / 列表用的狀態以一次參考賦值換上。"""
+        self._view = (self._index, self._base, self._masked, self._urls, self._by_seq, self._order)
+
+    def __len__(self):
+        return len(self._view[3])
+
+    @property
+    def version(self) -> int:
+        return self._max_seq
+
+    @property
+    def dead_records(self) -> int:
+        return self._records - len(self._urls)
+
+    @property
+    def snapshot_version(self) -> int:
+        """目前使用的共用快照版本；0 表示沒有快照，查詢全靠記憶體索引。"""
+        return self._base_version if self._base is not None else 0
+
+    @property
+    def overlay_entries(self) -> int:
+        """只在本 worker 記憶體索引裡、尚未進快照的條目數。"""
+        return self._overlay
+
+    @contextmanager
+    def _locked(self):
+        with self._lock, open(self.lock_path, "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # ---------- 讀取 / 同步 ----------
+    def load(self):
+        with self._locked():
+            if not os.path.exists(self.path) and self.legacy_path:
+                self._migrate_legacy()
+            self._reset()
+            self.sync(force=True)
+        # 舊版日誌（沒有 snap 記錄）或快照之後累積太多條目：背景建立新快照
+        self._maybe_compact()
+
+    def _migrate_legacy(self):
+        """第一次啟動時，把舊版純文字 user_blacklist.txt 匯入成日誌。"""
+        urls = read_user_urls(self.legacy_path)
+        now = time.time()
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for seq, url in enumerate(urls, 1):
+                f.write(json.dumps({"op": "add", "seq": seq, "url": url, "ts": now}, ensure_ascii=False) + "\n")
+        os.replace(tmp, self.path)
+
+    def sync(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._checked < self.sync_interval:
+            return
+        with self._lock:
+            self._checked = now
+            try:
+                st = os.stat(self.path)
+            except OSError:
+                return
+            if st.st_ino != self._inode or st.st_size < self._offset:
+                # 其他 worker 壓縮過日誌：整份重讀進新的索引與快照，讀完才換上（查詢期間一直用舊的）
+                self._reset()
+                self._inode = st.st_ino
+                self._checked = now
+                self._tail()
+            elif st.st_size > self._offset:
+                self._tail()
+
+    def _tail(self):
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        end = data.rfind(b"\n")
+        # end < 0：另一個行程正寫到一半，剩下的等下次
+        if end >= 0:
+            for line in data[:end].split(b"\n"):
+                if line.strip():
+                    try:
+                        self._apply(json.loads(line))
+                    except ValueError:
+                        print("[BLACKLIST] 略過損毀的使用者黑名單記錄:", line[:80])
+            self._offset += end + 1
+        self._publish()
+
+    def _apply(self, rec: dict):
+        op, url = rec.get("op"), rec.get("url")
+        if op == "snap":
+            # 壓縮後日誌的第一筆：其後 seq ≤ version 的 add 都已在共用快照裡
+            self._open_base(int(rec.get("version") or 0), rec.get("dups") or {})
+            return
+        self._records += 1
+        if op == "add":
+            seq = int(rec.get("seq") or self._max_seq + 1)
+            self._max_seq = max(self._max_seq, seq)
+            if url and url not in self._urls:
+                self._urls[url] = (seq, rec.get("ts"))
+                self._by_seq[seq] = url
+                self._order.append(seq)
+                if not self._in_base(seq):
+                    self._index.add(url)
+                    self._overlay += 1
+        elif op == "del":
+            if url in self._urls:
+                seq, _ = self._urls.pop(url)
+                del self._by_seq[seq]
+                if self._in_base(seq):
+                    self._mask(url)
+                else:
+                    self._index.discard(url)
+                    self._overlay -= 1
+        elif op == "clear":
+            self._urls, self._by_seq, self._order = {}, {}, []
+            self._index = BlacklistIndex()
+            self._base, self._masked, self._overlay = None, set(), 0
+
+    def _in_base(self, seq: int) -> bool:
+        return self._base is not None and seq <= self._base_version
+
+    def _open_base(self, version: int, dups: dict):
+        self._max_seq = max(self._max_seq, version)
+        self._base_version, self._base_refs, self._masked = version, dict(dups), set()
+        try:
+            base = SnapshotIndex(self.snap_path)
+        except (OSError, ValueError) as e:
+            print("[BLACKLIST] 使用者黑名單快照載入失敗，改用記憶體索引:", e)
+            base = None
+        if base is not None and base.version != version:
+            # 快照已被更新的壓縮換掉：這份日誌改用記憶體索引，下次換日誌時再接上快照
+            base.close()
+            base = None
+        self._base = base
+
+    def _mask(self, url: str):
+        """快照內的條目被刪除：該鍵沒有其他快照條目時，查詢改為忽略快照中的這個鍵。"""
+        entry = _entry_key(url)
+        if not entry:
+            return
+        key = entry[0]
+        refs = self._base_refs.get(key, 1)
+        if refs > 1:
+            self._base_refs[key] = refs - 1
+        else:
+            self._base_refs.pop(key, None)
+            self._masked.add(key)
+
+    def lookup(self, url: str):
+        self.sync()
+        try:
+            return self._lookup(url, self._view)
+        except ValueError:
+            # Windows 壓縮時舊快照的 mmap 剛被關閉：改查已換上的狀態
+            return self._lookup(url, self._view)
+
+    @staticmethod
+    def _lookup(url: str, view):
+        index, base, masked = view[:3]
+        if base is None:
+            return index.lookup(url)
+        return _match(url, lambda key: index._flags(key) | (0 if key in masked else base._flags(key)))
+
+    def contains(self, url: str) -> bool:
+        self.sync()
+        return url in self._view[3]
+
+    def page(self, cursor: int = None, limit: int = None):
+        """回傳 (該頁網址, 下一頁 cursor)；cursor 為 None 表示從頭開始，下一頁 cursor 為 None 表示已到底。"""
+        self.sync()
+        _, _, _, _, by_seq, order = self._view
+        i = bisect_right(order, cursor) if cursor else 0
+        page = []
+        while i < len(order) and (limit is None or len(page) < limit):
+            url = by_seq.get(order[i])
+            if url is not None:
+                page.append(url)
+            i += 1
+        more = any(seq in by_seq for seq in islice(order, i, None))
+        return page, (order[i - 1] if page and more else None)
+
+    # ---------- 寫入 ----------
+    def _write(self, rec: dict):
+        rec["ts"] = time.time()
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        self._tail()
+
+    def add(self, url: str) -> bool:
+        with self._locked():
+            self.sync(force=True)
+            if url not in self._urls:
+                self._write({"op": "add", "seq": self._max_seq + 1, "url": url})
+        self._maybe_compact()
+        return True
+
+    def delete(self, url: str) -> bool:
+        with self._locked():
+            self.sync(force=True)
+            if url not in self._urls:
+                return False
+            self._write({"op": "del", "url": url})
+        self._maybe_compact()
+        return True
+
+    def clear(self):
+        with self._locked():
+            self.sync(force=True)
+            self._write({"op": "clear"})
+        self._maybe_compact()
+
+    # ---------- 壓縮 ----------
+    def _maybe_compact(self):
+        if self._compacting:
+            return
+        live = len(self._urls)
+        threshold = max(self.compact_min, live - self._overlay)
+        if self.dead_records < max(self.compact_min, live) and self._overlay < threshold:
+            return
+        self._compacting = True
+        threading.Thread(target=self.compact, name="user-blacklist-compact", daemon=True).start()
+
+    def compact(self):
+        """把仍有效的條目寫成共用快照，再改寫成新日誌（皆原子替換）；其他 worker 偵測到 inode 改變後重讀。
+
+        先換快照再換日誌：讀到新日誌 snap 記錄的 worker 一定找得到同版本的快照。
+        """
+        try:
+            with self._locked():
+                self.sync(force=True)
+                version = self._max_seq
+                refs = {}
+                for url in self._urls:
+                    entry = _entry_key(url)
+                    if entry:
+                        refs[entry[0]] = refs.get(entry[0], 0) + 1
+                dups = {key: n for key, n in refs.items() if n > 1}
+                if os.name == "nt" and self._base is not None:
+                    # Windows 無法替換仍被映射的檔案：先換上含全部條目的記憶體索引，再關閉舊快照
+                    stand_in = BlacklistIndex()
+                    for url in self._urls:
+                        stand_in.add(url)
+                    self._view = (stand_in, None, set(), *self._view[3:])
+                    self._base.close()
+                    self._base = None
+                write_snapshot(self._urls, self.snap_path, version=version)
+                tmp = self.path + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    f.write(json.dumps({"op": "snap", "version": version, "dups": dups}, ensure_ascii=False) + "\n")
+                    for url, (seq, ts) in self._urls.items():
+                        f.write(json.dumps({"op": "add", "seq": seq, "url": url, "ts": ts}, ensure_ascii=False) + "\n")
+                os.replace(tmp, self.path)
+                st = os.stat(self.path)
+                self._inode, self._offset = st.st_ino, st.st_size
+                self._records = len(self._urls)
+                self._order = [seq for seq, _ in self._urls.values()]
+                # 先接上新快照再清空小索引：切換途中的查詢只會多命中、不會漏判
+                self._open_base(version, dups)
+                self._index, self._overlay = BlacklistIndex(), 0
+                if self._base is None:
+                    for url in self._urls:
+                        self._index.add(url)
+                    self._overlay = len(self._urls)
+                self._publish()
+            print(f"[BLACKLIST] 使用者黑名單日誌已壓縮（{len(self._urls)} 筆，快照 v{version}）")
+        except Exception as e:
+            print("[BLACKLIST] 使用者黑名單日誌壓縮失敗:", e)
+        finally:
+            self._compacting = False
+
+
+# 官方名單前的 Bloom filter 目標誤判率；0 表示不使用
+BLOOM_FP_RATE = float(os.environ.get("BLACKLIST_BLOOM_FP_RATE", "0") or 0)
+# 各 worker 檢查快照是否換版的間隔（秒），即跨 worker 生效的最大延遲
+SYNC_INTERVAL = float(os.environ.get("BLACKLIST_SYNC_INTERVAL", "1.0"))
+
+OFFICIAL_CSV = "phishtank.csv"
+OFFICIAL_BLACKLIST = BlacklistIndex()
+USER_BLACKLIST = UserBlacklistJournal(USER_JOURNAL, legacy_path=USER_FILE, sync_interval=SYNC_INTERVAL)
 
 def load_blacklist(csv_path: str):
-    global OFFICIAL_BLACKLIST
+    """載入黑名單：官方名單 mmap 二進位快照（CSV 比快照新時自動重建）+ 共用使用者名單。"""
+    global OFFICIAL_BLACKLIST, OFFICIAL_CSV
+
+    OFFICIAL_CSV = csv_path
+    snap_path = os.path.splitext(csv_path)[0] + ".snap"
+    bloom_path = bloom_path_for(snap_path) if BLOOM_FP_RATE > 0 else None
+    shared = SharedSnapshot(snap_path, SYNC_INTERVAL, bloom_path)
+
+    def _rebuild():
+        count = compile_snapshot(csv_path, snap_path, BLOOM_FP_RATE)
+        print(f"[BLACKLIST] 已重建黑名單快照 {snap_path}（{count} 筆）")
+
+    def _check():
+        index = SnapshotIndex(snap_path, bloom_path)
+        ok = not bloom_path or (index.bloom is not None and index.bloom.fp_rate == BLOOM_FP_RATE)
+        index.close()
+        if not ok:
+            raise ValueError("Bloom filter 缺少、版本不符或誤判率設定已變更")
 
     try:
-        with open(csv_path, "r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                url = (row.get("url") or "").strip()
-                if url:
-                    OFFICIAL_BLACKLIST.add(url)
-
-        print(f"[BLACKLIST] 已載入官方黑名單 {len(OFFICIAL_BLACKLIST)} 筆")
+        # 多個 worker 同時啟動時只讓一個重建
+        with shared._locked():
+            if snapshot_is_stale(snap_path, csv_path):
+                _rebuild()
+            try:
+                _check()
+            except (OSError, ValueError):
+                # 舊版、損毀或設定不符的快照：重建一次
+                _rebuild()
+                _check()
+        shared.refresh(force=True)
+        OFFICIAL_BLACKLIST = shared
+        print(f"[BLACKLIST] 已載入黑名單快照 v{shared.version} {len(shared)} 筆")
     except Exception as e:
-        print("[BLACKLIST] 官方黑名單載入失敗:", e)
+        print("[BLACKLIST] 黑名單快照載入失敗，改讀 CSV:", e)
+        try:
+            index = BlacklistIndex()
+            for url in read_csv_urls(csv_path):
+                index.add(url)
+            OFFICIAL_BLACKLIST = index
+            print(f"[BLACKLIST] 已載入官方黑名單 {len(OFFICIAL_BLACKLIST)} 筆")
+        except Exception as e:
+            print("[BLACKLIST] 官方黑名單載入失敗:", e)
 
     load_user_blacklist()
 
-def load_user_blacklist():
-    global USER_BLACKLIST
-    if not os.path.exists(USER_FILE):
-        return
+def _feed_key(url: str) -> str:
+    """增量比對用的鍵：標準化網址（HTTP://Example.com/ 與 http://example.com 相同）；無法解析時用原字串。"""
+    return canonicalize_url(url, assume_http=True) or url
 
-    try:
-        with open(USER_FILE, "r", encoding="utf-8") as f:
-            for line in f:
-                url = line.strip()
-                if url:
-                    USER_BLACKLIST.add(url)
 
+def ingest_feed(added=(), removed=(), feed_path: str = None) -> dict:
+    """把 PhishTank 增量（新增 / 移除的列）套用到目前版本，產生下一版快照。
+
+    feed_path 給定時，以整份新 feed 與目前版本比對算出增量。列以標準化網址比對（_feed_key），
+    移除時同一個標準化網址的所有列一起刪除。新版本寫好後才原子替換，
+    所有 worker 在 SYNC_INTERVAL 內以一次參考賦值切換，查詢不會阻塞也不會看到半成品。
+    """
+    official = OFFICIAL_BLACKLIST
+    if not isinstance(official, SharedSnapshot):
+        raise RuntimeError("官方黑名單未使用快照，無法熱更新")
+
+    with official._locked():
+        urls = dict.fromkeys(read_csv_urls(OFFICIAL_CSV))
+        rows = {}   # 標準化網址 → CSV 中的原始列
+        for u in urls:
+            rows.setdefault(_feed_key(u), []).append(u)
+        if feed_path:
+            feed = dict.fromkeys(read_csv_urls(feed_path))
+            feed_keys = {_feed_key(u) for u in feed}
+            added = [u for u in feed if _feed_key(u) not in rows]
+            removed = [u for u in urls if _feed_key(u) not in feed_keys]
+        new = {}
+        for u in (x.strip() for x in added):
+            if u and _feed_key(u) not in rows:
+                new.setdefault(_feed_key(u), u)
+        added = list(new.values())
+        removed = [u for key in dict.fromkeys(_feed_key(x.strip()) for x in removed if x.strip())
+                   for u in rows.get(key, ())]
+
+        if added or removed:
+            for u in removed:
+                del urls[u]
+            urls.update(dict.fromkeys(added))
+
+            # 先寫 CSV 再寫快照：快照較新，重啟時不會被判定過期
+            tmp = OFFICIAL_CSV + ".tmp"
+            with open(tmp, "w", encoding="utf-8", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["url"])
+                writer.writerows([u] for u in urls)
+            os.replace(tmp, OFFICIAL_CSV)
+            version = snapshot_version(official.snap_path) + 1
+            official._release_for_replace(urls, version)
+            write_snapshot(urls, official.snap_path, BLOOM_FP_RATE, version)
+
+    official.refresh(force=True)
+    print(f"[BLACKLIST] 官方黑名單更新至 v{official.version}（+{len(added)} / -{len(removed)}）")
+    return {"version": official.version, "added": len(added), "removed": len(removed), "entries": len(official)}
+
+def blacklist_stats() -> dict:
+    """目前各名單的版本與鍵數，供管理端點使用。"""
+    official = OFFICIAL_BLACKLIST
+    if isinstance(official, SharedSnapshot):
+        official.refresh()
+    USER_BLACKLIST.sync()
+    return {
+        "official": {
+            "version": official.version,
+            "entries": len(official),
+            "snapshot": isinstance(official, SharedSnapshot),
+            "bloom": official.bloom is not None,
+        },
+        "user": {
+            "version": USER_BLACKLIST.version,
+            "entries": len(USER_BLACKLIST),
+            "dead_records": USER_BLACKLIST.dead_records,
+            "snapshot": USER_BLACKLIST.snapshot_version,
+            "in_memory": USER_BLACKLIST.overlay_entries,
+        },
+    }
+
+def load_user_blacklist():
+    try:
+        USER_BLACKLIST.load()
         print(f"[BLACKLIST] 已載入使用者黑名單 {len(USER_BLACKLIST)} 筆")
     except Exception as e:
         print("[BLACKLIST] 使用者黑名單載入失敗:", e)
 
 def add_to_user_blacklist(url: str) -> bool:
-    global USER_BLACKLIST
     url = url.strip()
     if not url:
         return False
-    if url in USER_BLACKLIST:
-        return True
 
     try:
-        USER_BLACKLIST.add(url)
-        with open(USER_FILE, "a", encoding="utf-8") as f:
-            f.write(url + "\n")
-        return True
+        return USER_BLACKLIST.add(url)
     except Exception as e:
         print("[BLACKLIST] 新增使用者黑名單失敗:", e)
         return False
 
 def delete_from_user_blacklist(url: str) -> bool:
-    global USER_BLACKLIST
     url = url.strip()
-    if url not in USER_BLACKLIST:
-        return False
 
     try:
-        USER_BLACKLIST.remove(url)
-        with open(USER_FILE, "w", encoding="utf-8") as f:
-            for u in USER_BLACKLIST:
-                f.write(u + "\n")
-        return True
+        return USER_BLACKLIST.delete(url)
     except Exception as e:
         print("[BLACKLIST] 刪除使用者黑名單失敗:", e)
         return False
 
+def lookup_blacklist(url: str):
+    """回傳 (來源, 命中粒度)，例如 ("official", "host")；未命中回傳 None。
+
+    兩份名單都查，取較精確的粒度；粒度相同時官方優先。
+    """
+    official = OFFICIAL_BLACKLIST.lookup(url)
+    if official == "exact":
+        return "official", official
+    user = USER_BLACKLIST.lookup(url)
+    if official and (not user or MATCH_LEVELS.index(official) <= MATCH_LEVELS.index(user)):
+        return "official", official
+    if user:
+        return "user", user
+    return None
+
 def is_blacklisted(url: str) -> bool:
-    url = url.strip()
-    return url in OFFICIAL_BLACKLIST or url in USER_BLACKLIST
+    return lookup_blacklist(url) is not None
 
 # ✅ 新增：回傳命中來源
 def check_blacklist_source(url: str):
-    url = url.strip()
-    if url in OFFICIAL_BLACKLIST:
-        return "official"
-    if url in USER_BLACKLIST:
-        return "user"
-    return None
+    hit = lookup_blacklist(url)
+    return hit[0] if hit else None
 
-def get_user_blacklist() -> list:
-    #依照時間排序
-    if not os.path.exists(USER_FILE):
-        return []
-        
-    urls = []
+def get_user_blacklist(cursor: int = None, limit: int = None):
+    """依加入順序列出使用者名單。
+
+    未指定 limit 時回傳完整 list（舊介面）；指定時回傳 (該頁網址, 下一頁 cursor)。
+    """
     try:
-        with open(USER_FILE, "r", encoding="utf-8") as f:
-            for line in f:
-                u = line.strip()
-                if u:
-                    urls.append(u)
-        return urls
-    except:
-        return []
+        page, next_cursor = USER_BLACKLIST.page(cursor, limit)
+    except Exception as e:
+        print("[BLACKLIST] 讀取使用者黑名單失敗:", e)
+        page, next_cursor = [], None
+    if limit is None:
+        return page
+    return page, next_cursor
+
 def clear_user_blacklist() -> bool:
-    """清空所有使用者黑名單（記憶體 + 檔案）"""
-    global USER_BLACKLIST
-    
+    """清空所有使用者黑名單（寫入一筆 clear 記錄，所有 worker 同步生效）"""
     try:
-        # 1. 清空記憶體中的集合
         USER_BLACKLIST.clear()
-        
-        # 2. 清空檔案內容 (以 "w" 模式開啟但不寫入任何東西，就會清空檔案)
-        with open(USER_FILE, "w", encoding="utf-8") as f:
-            pass
-            
         print("[BLACKLIST] 使用者黑名單已全部清空")
         return True
-        
+
     except Exception as e:
         print("[BLACKLIST] 清空使用者黑名單失敗:", e)
-        return False
\ No newline at end of file
+        return False
+
+if __name__ == "__main__":
+    # 手動編譯快照：python blacklist.py [phishtank.csv]
+    src = sys.argv[1] if len(sys.argv) > 1 else "phishtank.csv"
+    dst = os.path.splitext(src)[0] + ".snap"
+    print(f"[BLACKLIST] 已編譯 {dst}（{compile_snapshot(src, dst)} 筆）")
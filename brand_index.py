@@ -0,0 +1,330 @@
+# brand_index.py — 品牌仿冒網域偵測（打錯字 typosquat、同形字 homoglyph、品牌名嵌入）
+import os
+from itertools import combinations
+
+from domain_classifier import PUBLIC_SUFFIXES
+from feature_cache import cached_feature
+
+# 受保護品牌：名稱 → 官方網域。名稱是網域標籤中會出現的字樣，同一品牌可以有多個名稱（appleid、icloud）
+DEFAULT_BRANDS = {
+    "paypal": ("paypal.com", "paypal.me"),
+    "google": ("google.com", "google.com.tw", "youtube.com", "gmail.com"),
+    "gmail": ("gmail.com", "google.com"),
+    "youtube": ("youtube.com", "youtu.be"),
+    "facebook": ("facebook.com", "fb.com", "messenger.com"),
+    "instagram": ("instagram.com",),
+    "whatsapp": ("whatsapp.com",),
+    "microsoft": ("microsoft.com", "live.com", "office.com"),
+    "outlook": ("outlook.com", "live.com", "microsoft.com"),
+    "office365": ("office.com", "microsoft.com"),
+    "apple": ("apple.com", "icloud.com"),
+    "appleid": ("apple.com",),
+    "icloud": ("icloud.com", "apple.com"),
+    "amazon": ("amazon.com", "amazon.co.jp", "amazon.co.uk"),
+    "netflix": ("netflix.com",),
+    "github": ("github.com",),
+    "linkedin": ("linkedin.com",),
+    "twitter": ("twitter.com", "x.com"),
+    "dropbox": ("dropbox.com",),
+    "adobe": ("adobe.com",),
+    "chase": ("chase.com",),
+    "chasebank": ("chase.com",),
+    "wellsfargo": ("wellsfargo.com",),
+    "bankofamerica": ("bankofamerica.com",),
+    "citibank": ("citibank.com", "citi.com"),
+    "hsbc": ("hsbc.com", "hsbc.com.tw"),
+    "binance": ("binance.com",),
+    "coinbase": ("coinbase.com",),
+    "metamask": ("metamask.io",),
+    "steam": ("steampowered.com", "steamcommunity.com"),
+    "steamcommunity": ("steamcommunity.com",),
+    "shopee": ("shopee.tw", "shopee.com"),
+    "momoshop": ("momoshop.com.tw",),
+    "pchome": ("pchome.com.tw",),
+    "ruten": ("ruten.com.tw",),
+    "yahoo": ("yahoo.com", "yahoo.com.tw"),
+    "cathaybk": ("cathaybk.com.tw",),
+    "ctbcbank": ("ctbcbank.com",),
+    "esunbank": ("esunbank.com", "esunbank.com.tw"),
+    "fubon": ("fubon.com",),
+    "taishinbank": ("taishinbank.com.tw",),
+    "megabank": ("megabank.com.tw",),
+    "dhl": ("dhl.com",),
+    "fedex": ("fedex.com",),
+    "ups": ("ups.com",),
+}
+# 品牌自有的基礎設施網域（API、CDN、登入）：名稱含品牌字樣但不是仿冒，其下所有主機都屬於品牌本身
+BRAND_INFRA_DOMAINS = frozenset({
+    "googleapis.com", "gstatic.com", "googlevideo.com", "googletagmanager.com",
+    "google-analytics.com", "googlesyndication.com", "googleadservices.com", "ggpht.com", "withgoogle.com",
+    "amazontrust.com", "media-amazon.com", "ssl-images-amazon.com", "awsstatic.com",
+    "microsoftonline.com", "microsoftonline-p.com", "msauth.net", "msftauth.net",
+    "office.net", "onedrive.com", "microsoft365.com",
+    "paypalobjects.com", "paypal-community.com",
+    "facebook.net", "fbcdn.net", "fbsbx.com", "cdninstagram.com",
+    "apple-cloudkit.com", "icloud-content.com", "mzstatic.com", "cdn-apple.com",
+    "yahooapis.com", "yimg.com",
+    "githubassets.com",
+    "twimg.com", "licdn.com", "nflxext.com", "nflximg.net", "nflxvideo.net",
+    "adobelogin.com", "steamstatic.com",
+})
+# 任何人都能放內容的雲端平台（靜態網站、儲存桶、CDN、租戶子網域）：平台名稱本身不算仿冒，
+# 但其下的主機不屬於品牌，當成公共後綴處理：evil.github.io 不可信，paypal-login.github.io 照樣比對
+USER_CONTENT_DOMAINS = frozenset({
+    "github.io", "githubusercontent.com", "amazonaws.com", "cloudfront.net",
+    "windows.net", "azureedge.net", "sharepoint.com", "googleusercontent.com", "storage.googleapis.com",
+    "dropboxusercontent.com",
+})
+# 剛好和品牌名只差一兩個字的一般英文單字：不算打錯字（applied≈appleid、finance≈binance、cloud≈icloud）
+TYPO_EXCEPTIONS = frozenset({"applied", "finance", "cloud", "shoppe"})
+# 二級網域常見的通用標籤：com.cn、co.uk 這類後綴上的 <品牌>.<後綴> 才算品牌在各國的官方網域
+GENERIC_SECOND_LEVEL = frozenset({"com", "co", "net", "org", "or", "ne", "ac", "gov", "go", "edu"})
+# 不算「品牌在各國官方網域」的國碼 TLD：免費或廉價、常被當成泛用 TLD 大量註冊（google.tk、paypal.co 是仿冒）；
+# 非兩字母的 TLD（xyz、top、click）一律不算國碼
+ABUSED_CCTLDS = frozenset({
+    "tk", "ml", "ga", "cf", "gq", "co", "io", "me", "tv", "cc", "ws", "to", "su", "pw", "ly", "nu", "cm", "la", "st", "sh",
+})
+# 額外品牌清單（每行「名稱 官方網域...」或只有官方網域，名稱取網域第一段）；不存在時只用內建清單
+BRAND_LIST = os.environ.get("BRAND_LIST", "brands.txt")
+
+# 名稱至少幾個字才做模糊比對；更短的品牌（ups、chase）只認同形字與完全相同的字樣，
+# 否則 phase / stream 這類一般單字會被當成 chase / steam 的打錯字
+BRAND_MIN_FUZZY = 6
+# 名稱長度 ≥ 此值時容許 2 個編輯距離，否則 1 個
+BRAND_TWO_EDITS = 9
+# 名稱至少幾個字才檢查「嵌在標籤開頭 / 結尾」（paypalsecure、secure-paypal 已由 - 分段處理）
+BRAND_MIN_EMBED = 6
+
+# 同形字：先把非 ASCII 的相似字母與數字換成 ASCII 字母，再合併 rn→m、vv→w 這類多字元視覺組合
+HOMOGLYPHS = str.maketrans({
+    "0": "o", "1": "l", "3": "e", "4": "a", "5": "s", "7": "t", "8": "b", "9": "g", "@": "a", "$": "s", "|": "l",
+    "а": "a", "е": "e", "о": "o", "р": "p", "с": "c", "у": "y", "х": "x", "і": "i", "ј": "j", "ӏ": "l", "ԁ": "d",
+    "ԛ": "q", "ѕ": "s", "ԝ": "w", "һ": "h", "к": "k", "м": "m", "т": "t", "в": "b", "н": "h", "г": "r",
+    "α": "a", "ο": "o", "ρ": "p", "ν": "v", "ι": "i", "κ": "k", "τ": "t", "υ": "u", "χ": "x", "ε": "e",
+    "à": "a", "á": "a", "â": "a", "ä": "a", "ã": "a", "å": "a", "è": "e", "é": "e", "ê": "e", "ë": "e",
+    "ì": "i", "í": "i", "î": "i", "ï": "i", "ò": "o", "ó": "o", "ô": "o", "ö": "o", "õ": "o", "ø": "o",
+    "ù": "u", "ú": "u", "û": "u", "ü": "u", "ý": "y", "ÿ": "y", "ç": "c", "ñ": "n", "ı": "i", "ł": "l",
+})
+MULTI_GLYPHS = (("rn", "m"), ("vv", "w"))
+
+
+def skeleton(text: str) -> str:
+    """同形字正規化後的字串（g00gle、gооgle（西里爾字母）、goog1e 都變成 google）。"""
+    text = text.lower().translate(HOMOGLYPHS)
+    for seq, glyph in MULTI_GLYPHS:
+        if seq in text:
+            text = text.replace(seq, glyph)
+    return text
+
+
+def _deletes(word: str, depth: int) -> set:
+    """刪除 0~depth（最多 2）個字元後的所有字串（deletion neighborhood）。"""
+    result = {word}
+    if depth >= 1:
+        result.update(word[:i] + word[i + 1:] for i in range(len(word)))
+    if depth >= 2:
+        result.update(word[:i] + word[i + 1:j] + word[j + 1:] for i, j in combinations(range(len(word)), 2))
+    return result
+
+
+def _edit_distance(a: str, b: str, limit: int) -> int:
+    """含相鄰字元互換的編輯距離（optimal string alignment）；超過 limit 時提早回傳 limit + 1。"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+    return current[-1]
+
+
+def _host_labels(host: str) -> list:
+    """主機的各段標籤（去掉 port、結尾的點；xn-- 轉回 Unicode，同形字才比得到）。"""
+    labels = []
+    for label in host.lower().split(":")[0].rstrip(".").split("."):
+        if label.startswith("xn--"):
+            try:
+                label = label.encode("ascii").decode("idna")
+            except UnicodeError:
+                pass
+        labels.append(label)
+    return labels
+
+
+class BrandIndex:
+    """品牌名稱的預先計算索引，每個主機的檢查在數十微秒內完成。
+
+    - 同形字：skeleton → 品牌名（g00gle、раураl）
+    - 打錯字：品牌名 skeleton 的刪除鄰域（刪 1~2 個字）→ 品牌名；查詢時把標籤的刪除鄰域拿來查，
+      候選再以真正的編輯距離確認（gooogle、paypall、micrsoft）
+    - 品牌名嵌入：標籤以 - 分段後完全相同（paypal-login），或長品牌名出現在標籤開頭 / 結尾（paypalsecure）
+    屬於品牌本身的主機：任何品牌的官方網域或 infra 網域（BRAND_INFRA_DOMAINS）底下的主機，
+    以及可註冊網域就是「品牌名.國碼後綴」的主機（google.de、yahoo.co.jp、apple.com.cn；不含 ABUSED_CCTLDS）。
+    使用者內容平台（USER_CONTENT_DOMAINS：github.io、amazonaws.com）視同公共後綴：
+    平台本身不算仿冒，但其下的主機既不屬於品牌，左邊的標籤也照樣比對。
+    """
+
+    def __init__(self, brands: dict = None, infra=(), platforms=()):
+        self.brands = {}             # 名稱 → 官方網域 tuple
+        self._owned = set(infra)     # 官方 + infra 網域：其下的主機都屬於品牌本身
+        self._platforms = set(platforms)   # 使用者內容平台，當成額外的公共後綴
+        self._skeletons = {}         # skeleton → 名稱
+        self._neighbors = {}         # 刪除鄰域字串 → {名稱}
+        self._embed_lengths = set()  # 需要檢查開頭 / 結尾嵌入的 skeleton 長度
+        self._fuzzy_min, self._fuzzy_max = 1 << 30, 0   # 做模糊比對的品牌 skeleton 長度範圍
+        for name, domains in (brands or {}).items():
+            self.add(name, domains)
+
+    def __len__(self):
+        return len(self.brands)
+
+    def add(self, name: str, domains=()):
+        name = name.strip().lower()
+        if not name:
+            return
+        self.brands[name] = tuple(dict.fromkeys((*self.brands.get(name, ()), *(d.lower() for d in domains))))
+        self._owned.update(self.brands[name])
+        key = skeleton(name)
+        self._skeletons.setdefault(key, name)
+        if len(name) >= BRAND_MIN_EMBED:
+            self._embed_lengths.add(len(key))
+        if len(name) >= BRAND_MIN_FUZZY:
+            self._fuzzy_min = min(self._fuzzy_min, len(key))
+            self._fuzzy_max = max(self._fuzzy_max, len(key))
+            for variant in _deletes(key, 2 if len(name) >= BRAND_TWO_EDITS else 1):
+                self._neighbors.setdefault(variant, set()).add(name)
+
+    def add_infra(self, domains):
+        """品牌自有的基礎設施網域，其下的主機不比對。"""
+        self._owned.update(d.strip().lower() for d in domains if d.strip())
+
+    def add_platforms(self, domains):
+        """使用者內容平台：平台本身不比對，其下的主機不屬於任何品牌。"""
+        self._platforms.update(d.strip().lower() for d in domains if d.strip())
+
+    def _is_owned(self, labels: list, suffix_len: int) -> bool:
+        """可註冊網域或其上層的主機是否為官方 / infra 網域（公共後綴本身不算：github.io 上的主機不是 GitHub 的）。"""
+        return any(".".join(labels[i:]) in self._owned for i in range(len(labels) - suffix_len))
+
+    @staticmethod
+    def _is_country_suffix(suffix: str) -> bool:
+        """兩字母國碼 TLD（de、jp），或通用二級標籤 + 國碼（co.uk、com.cn）；ABUSED_CCTLDS 不算。"""
+        labels = suffix.split(".")
+        if len(labels) > 2 or (len(labels) == 2 and labels[0] not in GENERIC_SECOND_LEVEL):
+            return False
+        tld = labels[-1]
+        return len(tld) == 2 and tld.isalpha() and tld not in ABUSED_CCTLDS
+
+    def _tokens(self, labels: list):
+        """要比對的字樣：每段標籤、以 - 分段的片段，以及去掉 - 後的整段（pay-pal）。"""
+        for label in labels:
+            yield label
+            if "-" in label:
+                yield from (part for part in label.split("-") if part)
+                yield label.replace("-", "")
+
+    def _split(self, host: str):
+        """(標籤, 公共後綴的段數, 是否屬於品牌本身)；主機本身就是公共後綴（或只有一段）時回傳 None。"""
+        labels = _host_labels(host)
+        if len(labels) < 2:
+            return None
+        info = PUBLIC_SUFFIXES.classify(host)
+        suffix_len = len(info["suffix"].split(".")) if info["suffix"] else 1
+        # 使用者內容平台：平台網域以下才是使用者取的名字，一律不屬於品牌
+        for i in range(len(labels) - 1):
+            if ".".join(labels[i:]) in self._platforms:
+                suffix_len = max(suffix_len, len(labels) - i)
+                return (labels, suffix_len, False) if len(labels) > suffix_len else None
+        if len(labels) <= suffix_len:
+            return None
+        # <品牌名>.<國碼後綴> 是品牌在各國的官方網域
+        official = self._is_owned(labels, suffix_len) or \
+            (labels[-suffix_len - 1] in self.brands and self._is_country_suffix(info["suffix"]))
+        return labels, suffix_len, official
+
+    def is_official(self, host: str) -> bool:
+        """主機是否屬於受保護品牌本身（官方 / infra 網域之下，或 <品牌名>.<國碼後綴>）。"""
+        parts = self._split(host)
+        return parts is not None and parts[2]
+
+    def match(self, host: str):
+        """回傳 (品牌名, 類型)，類型為 "homoglyph" / "typo" / "embedded"；不像任何品牌時回傳 None。"""
+        parts = self._split(host)
+        if parts is None or parts[2]:
+            return None
+        labels, suffix_len, _ = parts
+        # 公共後綴的各段不比對
+        for token in dict.fromkeys(self._tokens(labels[:-suffix_len])):
+            key = skeleton(token)
+            name = self._skeletons.get(key)
+            if name is not None:
+                return name, ("embedded" if token == name else "homoglyph")
+
+            for length in self._embed_lengths:
+                if length < len(key):
+                    for part in (key[:length], key[-length:]):
+                        name = self._skeletons.get(part)
+                        if name is not None and len(name) >= BRAND_MIN_EMBED:
+                            return name, ("embedded" if name in token else "homoglyph")
+
+            # 長度差超過容許的編輯距離就不可能命中；只有夠長的字樣需要刪到 2 個字
+            if not self._neighbors or not self._fuzzy_min - 2 <= len(key) <= self._fuzzy_max + 2 or token in TYPO_EXCEPTIONS:
+                continue
+            neighbors = self._neighbors
+            depth = 2 if len(key) >= BRAND_TWO_EDITS - 2 else 1
+            candidates = set().union(*(neighbors[v] for v in _deletes(key, depth) if v in neighbors))
+            for name in sorted(candidates):
+                limit = 2 if len(name) >= BRAND_TWO_EDITS else 1
+                if _edit_distance(key, skeleton(name), limit) <= limit:
+                    return name, "typo"
+        return None
+
+
+def read_brand_list(path: str) -> dict:
+    """讀品牌清單檔：每行「名稱 官方網域...」或只有官方網域；# 開頭為註解。"""
+    brands = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            fields = line.split("#", 1)[0].split()
+            if not fields:
+                continue
+            if "." in fields[0]:
+                name, domains = fields[0].split(".")[0], fields
+            else:
+                name, domains = fields[0], fields[1:]
+            brands.setdefault(name, []).extend(domains)
+    return brands
+
+
+def load_brand_index(path: str = BRAND_LIST) -> BrandIndex:
+    """內建品牌、infra 網域與使用者內容平台 + 品牌清單檔（存在時）建成索引。"""
+    index = BrandIndex(DEFAULT_BRANDS, BRAND_INFRA_DOMAINS, USER_CONTENT_DOMAINS)
+    if path and os.path.exists(path):
+        try:
+            for name, domains in read_brand_list(path).items():
+                index.add(name, domains)
+            print(f"[BRAND] 已載入品牌清單 {path}，共 {len(index)} 個品牌名稱")
+        except (OSError, UnicodeError) as e:
+            print("[BRAND] 品牌清單載入失敗，只用內建品牌:", e)
+    return index
+
+
+BRAND_INDEX = load_brand_index()
+
+
+@cached_feature("brand_lookalike", depends=lambda: (BRAND_INDEX,))
+def brand_lookalike(host: str):
+    """主機是否仿冒受保護品牌：回傳 (品牌名, 類型) 或 None。"""
+    return BRAND_INDEX.match(host)
+
+
+@cached_feature("brand_official", depends=lambda: (BRAND_INDEX,))
+def brand_official(host: str) -> bool:
+    """主機是否屬於受保護品牌本身（見 BrandIndex.is_official）。"""
+    return BRAND_INDEX.is_official(host)
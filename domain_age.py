@@ -0,0 +1,188 @@
+# domain_age.py — 本地網域註冊日期資料庫（取代逐筆即時 WHOIS）
+import csv
+import datetime
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_left
+
+from feature_cache import cached_feature
+from file_utils import snapshot_is_stale
+
+# ------------------ 二進位資料庫 ------------------
+# 由 WHOIS 匯出檔（CSV：domain,created）編譯而來，格式與黑名單快照相同的思路（little-endian）：
+#   header  : magic(8) + 筆數 uint32
+#   hashes  : 筆數 個 uint32，每個網域的 CRC32，遞增排序
+#   created : 筆數 個 uint32，註冊日期（1970-01-01 起算的天數）
+#   offsets : (筆數 + 1) 個 uint32，每個網域在 blob 中的起點
+#   blob    : 網域（小寫 ASCII / punycode），依 (CRC32, 網域) 排序、去重（同一網域保留最早日期）
+DOMAIN_AGE_MAGIC = b"DAGEDB01"
+_HEADER = struct.Struct("<8sI")
+_EPOCH = datetime.date(1970, 1, 1)
+
+# 匯出檔位置；編譯結果放在同名 .dage，匯出檔較新時自動重建
+DOMAIN_AGE_DUMP = os.environ.get("DOMAIN_AGE_DUMP", "domain_ages.csv")
+# 註冊未滿幾天視為新網域
+NEW_DOMAIN_DAYS = 90
+
+
+def _parse_created(value: str):
+    """註冊日期欄：ISO 日期 / 日期時間，或 Unix timestamp；無法解析回傳 None。"""
+    value = (value or "").strip()
+    try:
+        if value.isdigit():
+            return datetime.datetime.fromtimestamp(int(value), datetime.timezone.utc).date()
+        return datetime.date.fromisoformat(value[:10])
+    except (ValueError, OverflowError, OSError):
+        return None
+
+
+def read_dump(dump_path: str):
+    """逐列讀出 (網域, 註冊日期)；略過無法解析的列。"""
+    with open(dump_path, "r", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            domain = (row.get("domain") or "").strip().lower().rstrip(".")
+            created = _parse_created(row.get("created"))
+            if domain and created:
+                yield domain, created
+
+
+def compile_domain_ages(dump_path: str, db_path: str) -> int:
+    """把匯出檔編譯成排序好的二進位資料庫（先寫暫存檔再原子替換），回傳網域數。"""
+    earliest = {}
+    for domain, created in read_dump(dump_path):
+        try:
+            key = domain.encode("ascii") if domain.isascii() else domain.encode("idna")
+        except UnicodeError:
+            continue
+        days = (created - _EPOCH).days
+        if days >= 0 and days < earliest.get(key, 1 << 32):
+            earliest[key] = days
+
+    records = sorted((zlib.crc32(k), k, d) for k, d in earliest.items())
+    hashes = array("I", (h for h, _, _ in records))
+    created = array("I", (d for _, _, d in records))
+    offsets = array("I", [0])
+    blob = bytearray()
+    for _, key, _ in records:
+        blob += key
+        offsets.append(len(blob))
+    if sys.byteorder != "little":
+        for column in (hashes, created, offsets):
+            column.byteswap()
+
+    tmp = db_path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(DOMAIN_AGE_MAGIC, len(records)))
+        f.write(hashes.tobytes())
+        f.write(created.tobytes())
+        f.write(offsets.tobytes())
+        f.write(blob)
+    os.replace(tmp, db_path)
+    return len(records)
+
+
+class DomainAgeIndex:
+    """以 mmap 開啟網域年齡資料庫：CRC32 欄二分搜尋後比對網域，每次查詢數微秒。
+
+    子網域查不到時依序往上找（login.shop.example.com → shop.example.com → example.com），
+    匯出檔通常只有可註冊網域。
+    """
+
+    def __init__(self, db_path: str = None):
+        self._count = 0
+        self._mm = None
+        self.path = db_path
+        if db_path is None:
+            return
+        if sys.byteorder != "little":
+            raise ValueError("網域年齡資料庫僅支援 little-endian 平台")
+        with open(db_path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = _HEADER.unpack_from(self._mm, 0)
+        if magic != DOMAIN_AGE_MAGIC:
+            self._mm.close()
+            raise ValueError(f"網域年齡資料庫格式不符：{db_path}")
+        self._count = count
+        view = memoryview(self._mm)
+        start = _HEADER.size
+        self._hashes = view[start:start + 4 * count].cast("I")
+        start += 4 * count
+        self._created = view[start:start + 4 * count].cast("I")
+        start += 4 * count
+        self._offsets = view[start:start + 4 * (count + 1)].cast("I")
+        self._blob_start = start + 4 * (count + 1)
+
+    def __len__(self):
+        return self._count
+
+    def _days(self, key: bytes):
+        h = zlib.crc32(key)
+        hashes, offsets, mm, base = self._hashes, self._offsets, self._mm, self._blob_start
+        i = bisect_left(hashes, h)
+        while i < self._count and hashes[i] == h:
+            if mm[base + offsets[i]:base + offsets[i + 1]] == key:
+                return self._created[i]
+            i += 1
+        return None
+
+    def created(self, domain: str):
+        """網域（或其上層網域）的註冊日期；資料庫沒有時回傳 None。"""
+        if not self._count:
+            return None
+        domain = (domain or "").strip().lower().rstrip(".").split(":")[0]
+        try:
+            key = domain.encode("ascii") if domain.isascii() else domain.encode("idna")
+        except UnicodeError:
+            return None
+        labels = key.split(b".")
+        for i in range(max(len(labels) - 1, 1)):
+            days = self._days(b".".join(labels[i:]))
+            if days is not None:
+                return _EPOCH + datetime.timedelta(days=days)
+        return None
+
+    def close(self):
+        if self._mm is not None:
+            self._hashes.release()
+            self._created.release()
+            self._offsets.release()
+            self._mm.close()
+            self._mm = None
+            self._count = 0
+
+
+DOMAIN_AGES = DomainAgeIndex()
+
+
+def load_domain_ages(dump_path: str = DOMAIN_AGE_DUMP):
+    """載入網域年齡資料庫（匯出檔比 .dage 新時自動重建）；兩者都沒有時維持空資料庫。"""
+    global DOMAIN_AGES
+
+    db_path = os.path.splitext(dump_path)[0] + ".dage"
+    try:
+        if os.path.exists(dump_path) and snapshot_is_stale(db_path, dump_path):
+            count = compile_domain_ages(dump_path, db_path)
+            print(f"[DOMAIN_AGE] 已重建網域年齡資料庫 {db_path}（{count} 筆）")
+        if not os.path.exists(db_path):
+            print(f"[DOMAIN_AGE] 找不到 {dump_path}，網域年齡僅做格式檢查")
+            return
+        index = DomainAgeIndex(db_path)
+    except (OSError, ValueError) as e:
+        print("[DOMAIN_AGE] 網域年齡資料庫載入失敗:", e)
+        return
+    # 只換參考，舊的 mmap 留給正在查詢的執行緒讀完；快取偵測到 DOMAIN_AGES 換了會作廢舊結果
+    DOMAIN_AGES = index
+    print(f"[DOMAIN_AGE] 已載入網域年齡資料庫 {len(index)} 筆")
+
+
+@cached_feature("domain_age_days", depends=lambda: (DOMAIN_AGES,))
+def domain_age_days(domain: str):
+    """網域註冊至今的天數；資料庫沒有時回傳 None。"""
+    created = DOMAIN_AGES.created(domain)
+    if created is None:
+        return None
+    return (datetime.date.today() - created).days
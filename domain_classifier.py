@@ -0,0 +1,162 @@
+# domain_classifier.py — 網域分類：公共後綴、可註冊網域、允許名單與可疑 TLD（一次走訪反轉標籤的 trie）
+import os
+
+# 公共後綴清單（https://publicsuffix.org/list/public_suffix_list.dat 格式）；不存在時只用下面的常見多層後綴
+PUBLIC_SUFFIX_LIST = os.environ.get("PUBLIC_SUFFIX_LIST", "public_suffix_list.dat")
+
+# 常見的多層公共後綴，用來判斷「可註冊網域」；單層 TLD 不必列出（沒有規則時最後一段即為後綴）
+MULTI_LABEL_SUFFIXES = {
+    "com.tw", "net.tw", "org.tw", "edu.tw", "gov.tw", "idv.tw",
+    "com.cn", "com.hk", "co.jp", "co.kr", "co.uk", "org.uk",
+    "com.br", "com.au", "co.in", "co.id", "com.mx", "com.tr", "it.com",
+}
+
+_SUFFIX = 1       # 公共後綴規則
+_EXCEPTION = 2    # 例外規則（!www.ck）：這一段不算後綴
+
+
+class _Node:
+    __slots__ = ("children", "rule", "allow", "deny")
+
+    def __init__(self):
+        self.children = {}
+        self.rule = 0
+        self.allow = None   # 允許名單條目（此節點即條目本身）
+        self.deny = None    # 可疑 TLD / 網域條目
+
+
+def read_public_suffixes(path: str) -> list:
+    """讀公共後綴清單：每行一條規則，// 開頭為註解，支援 *.ck 與 !www.ck。"""
+    rules = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            rule = line.split("//", 1)[0].strip().split(" ")[0]
+            if rule:
+                rules.append(rule)
+    return rules
+
+
+def _is_ip(host: str) -> bool:
+    return ":" in host or host.replace(".", "").isdigit()
+
+
+def normalize_host(domain: str) -> str:
+    """網址的 netloc 或主機 → 小寫主機名（去掉 userinfo、port、結尾的點；非 ASCII 轉 punycode）。"""
+    host = (domain or "").strip().lower().rpartition("@")[2]
+    if host.startswith("["):
+        return host[1:host.find("]")] if "]" in host else host[1:]
+    host = host.split(":", 1)[0].rstrip(".")
+    if not host.isascii():
+        try:
+            host = host.encode("idna").decode("ascii")
+        except UnicodeError:
+            pass
+    return host
+
+
+class DomainClassifier:
+    """公共後綴規則、允許名單與可疑 TLD 放進同一棵以反轉標籤為鍵的 trie（com → google → mail）。
+
+    classify() 從 TLD 往內走一次就得到可註冊網域、TLD 類別與是否在允許名單；
+    每次查詢只和主機的標籤數有關，名單有 10 萬筆以上也一樣。
+    名單條目以完整標籤比對：google.com 涵蓋 mail.google.com，但不涵蓋 evilgoogle.com。
+    """
+
+    def __init__(self, suffixes=(), allow=(), deny=()):
+        self._root = _Node()
+        for rule in suffixes:
+            self.add_suffix(rule)
+        for entry in allow:
+            self.add_allow(entry)
+        for entry in deny:
+            self.add_deny(entry)
+
+    def _node(self, name: str) -> _Node:
+        node = self._root
+        for label in reversed(name.strip(".").lower().split(".")):
+            child = node.children.get(label)
+            if child is None:
+                child = node.children[label] = _Node()
+            node = child
+        return node
+
+    def add_suffix(self, rule: str):
+        rule = rule.strip().lower()
+        if rule.startswith("!"):
+            self._node(rule[1:]).rule |= _EXCEPTION
+        elif rule:
+            self._node(normalize_host(rule) if "*" not in rule else rule).rule |= _SUFFIX
+
+    def add_allow(self, entry: str):
+        host = normalize_host(entry)
+        if host:
+            self._node(host).allow = host
+
+    def add_deny(self, entry: str):
+        """可疑 TLD（.xyz）或網域；以完整標籤比對。"""
+        host = normalize_host(entry.lstrip("."))
+        if host:
+            self._node(host).deny = entry
+
+    def classify(self, domain: str) -> dict:
+        """回傳 {host, registrable, suffix, tld, tld_class, allowlisted, allow_match, deny_match}。
+
+        tld_class："suspicious"（命中可疑清單）、"ip"、"normal"；主機本身就是公共後綴時 registrable 為 None。
+        結果可能被快取共用，呼叫端不要修改。
+        """
+        host = normalize_host(domain)
+        if not host or _is_ip(host):
+            return {"host": host, "registrable": host or None, "suffix": None, "tld": None,
+                    "tld_class": "ip" if host else "normal", "allowlisted": False,
+                    "allow_match": None, "deny_match": None}
+
+        labels = host.split(".")
+        suffix_len = 1          # 沒有規則時最後一段即為公共後綴（公共後綴演算法的預設 * 規則）
+        exception = False
+        allow = deny = None
+        node = self._root
+        for depth, label in enumerate(reversed(labels), 1):
+            child = node.children.get(label)
+            if not exception:
+                if child is not None and child.rule & _EXCEPTION:
+                    suffix_len, exception = depth - 1, True
+                elif (child is not None and child.rule & _SUFFIX) or \
+                        ("*" in node.children and node.children["*"].rule & _SUFFIX):
+                    suffix_len = depth
+            if child is None:
+                break
+            allow = child.allow or allow
+            deny = child.deny or deny
+            node = child
+
+        suffix_len = max(suffix_len, 1)
+        return {
+            "host": host,
+            "registrable": ".".join(labels[-suffix_len - 1:]) if len(labels) > suffix_len else None,
+            "suffix": ".".join(labels[-suffix_len:]),
+            "tld": labels[-1],
+            "tld_class": "suspicious" if deny else "normal",
+            "allowlisted": allow is not None,
+            "allow_match": allow,
+            "deny_match": deny,
+        }
+
+    def registrable(self, domain: str):
+        return self.classify(domain)["registrable"]
+
+
+def load_public_suffixes(path: str = PUBLIC_SUFFIX_LIST) -> list:
+    """公共後綴規則：清單檔存在時用檔案，否則用 MULTI_LABEL_SUFFIXES。"""
+    if path and os.path.exists(path):
+        try:
+            rules = read_public_suffixes(path)
+            print(f"[DOMAIN] 已載入公共後綴清單 {path}（{len(rules)} 條）")
+            return rules
+        except (OSError, UnicodeError) as e:
+            print("[DOMAIN] 公共後綴清單載入失敗，改用內建多層後綴:", e)
+    return sorted(MULTI_LABEL_SUFFIXES)
+
+
+PUBLIC_SUFFIX_RULES = load_public_suffixes()
+# 只有公共後綴規則的分類器：給只需要可註冊網域的地方（黑名單）
+PUBLIC_SUFFIXES = DomainClassifier(PUBLIC_SUFFIX_RULES)
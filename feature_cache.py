@@ -0,0 +1,109 @@
+# feature_cache.py — 網址 / 網域特徵的共用快取（tools 與 analyzer 共用）
+
+from collections import Counter, OrderedDict
+from functools import wraps
+import operator
+import os
+import threading
+import time
+
+# 快取筆數上限（超過時淘汰最久沒用到的）與每筆的存活秒數
+FEATURE_CACHE_SIZE = int(os.environ.get("FEATURE_CACHE_SIZE", 50000))
+FEATURE_CACHE_TTL = float(os.environ.get("FEATURE_CACHE_TTL", 600))
+
+
+class FeatureCache:
+    """(特徵名, host 或網址) → 計算結果，有筆數上限（LRU）與存活時間（TTL）。
+
+    - 同一批網域在流量中反覆出現，per-host 的特徵只需要算一次
+    - 每個特徵各自統計命中 / 未命中次數，stats() 回傳目前狀態
+    - 特徵依賴的名單改變時，以 invalidate(特徵名) 清掉該特徵的所有結果
+    - 多執行緒共用；計算本身在鎖外進行，同一個 key 同時未命中時可能重算一次，結果相同
+    """
+
+    def __init__(self, max_size: int = FEATURE_CACHE_SIZE, ttl: float = FEATURE_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._tokens = {}
+        self.hits = Counter()
+        self.misses = Counter()
+        self.evictions = 0
+
+    def get_or_compute(self, feature: str, key, compute):
+        """回傳快取中的結果；沒有或已過期時以 compute(key) 計算並存入。"""
+        entry_key = (feature, key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(entry_key)
+            if entry is not None and entry[0] > now:
+                self._data.move_to_end(entry_key)
+                self.hits[feature] += 1
+                return entry[1]
+            self.misses[feature] += 1
+
+        value = compute(key)
+        with self._lock:
+            self._data[entry_key] = (now + self.ttl, value)
+            self._data.move_to_end(entry_key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def check_token(self, feature: str, token: tuple):
+        """token 為特徵依賴的名單物件；任一個換成不同物件時清掉該特徵（以 is 比較，O(1)）。"""
+        previous = self._tokens.get(feature)
+        if previous is not None and all(map(operator.is_, previous, token)):
+            return
+        if previous is not None:
+            self.invalidate(feature)
+        self._tokens[feature] = token
+
+    def invalidate(self, feature: str = None):
+        """清掉某個特徵（None 為全部）的快取結果；命中統計保留。"""
+        with self._lock:
+            if feature is None:
+                self._data.clear()
+            else:
+                for entry_key in [k for k in self._data if k[0] == feature]:
+                    del self._data[entry_key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            features = sorted(set(self.hits) | set(self.misses))
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "evictions": self.evictions,
+                "features": {
+                    f: {
+                        "hits": self.hits[f],
+                        "misses": self.misses[f],
+                        "hit_rate": round(self.hits[f] / ((self.hits[f] + self.misses[f]) or 1), 4),
+                    }
+                    for f in features
+                },
+            }
+
+
+FEATURE_CACHE = FeatureCache()
+
+
+def cached_feature(name: str, depends=None):
+    """單一參數（host 或網址字串）的特徵函式改為查 FEATURE_CACHE。
+
+    depends：回傳依賴名單物件 tuple 的函式；名單被換掉時，這個特徵的舊結果全部作廢。
+    """
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            # LangChain 以關鍵字參數呼叫（url=...、domain=...），一般呼叫則是位置參數
+            key = args[0] if args else next(iter(kwargs.values()))
+            if depends is not None:
+                FEATURE_CACHE.check_token(name, depends())
+            return FEATURE_CACHE.get_or_compute(name, key, fn)
+        return wrapper
+    return decorate
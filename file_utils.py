@@ -0,0 +1,11 @@
+# file_utils.py — 編譯產物的檔案小工具（blacklist 快照與 domain_age 資料庫共用，不載入任何名單）
+
+import os
+
+
+def snapshot_is_stale(snap_path: str, *sources: str) -> bool:
+    """快照不存在，或任一來源檔比快照新，就需要重建。"""
+    if not os.path.exists(snap_path):
+        return True
+    snap_mtime = os.path.getmtime(snap_path)
+    return any(os.path.exists(p) and os.path.getmtime(p) > snap_mtime for p in sources)
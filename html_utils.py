@@ -1,30 +1,521 @@
 # HTML 處理與萃取
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, NavigableString
+from bs4.builder import HTMLTreeBuilder
+from bs4.dammit import EntitySubstitution, UnicodeDammit
+from functools import cached_property
+from html.parser import HTMLParser
+import os
 import re
-from urllib.parse import urlparse, urlunparse
-
-def extract_relevant_html(raw_html: str, max_length: int = 3000) -> str:
-    """保留 title、部分 meta 與可見文字，供模型快速分析。"""
-    soup = BeautifulSoup(raw_html, "html.parser")
-
-    title = soup.title.string if soup.title else ""
-    metas = [
-        str(meta)
-        for meta in soup.find_all("meta")
-        if meta.get("name") in ["description", "keywords", "author"]
-    ]
-    links = [a.get("href") for a in soup.find_all("a", href=True)[:10]]
-    body_text = soup.get_text("\n", strip=True)[:1000]
-
-    result = (
-        f"<title>{title}</title>\n"
-        f"{' '.join(metas)}\n"
-        f"<links>{links}</links>\n"
-        f"<body>{body_text}</body>"
-    )
-
-    return result[:max_length]
+from urllib.parse import urlsplit
+
+from domain_classifier import PUBLIC_SUFFIXES
+from url_utils import canonicalize_url
+
+# 解析後端（啟動時決定）：
+#   stream - HTMLParser 子類別，一次掃描 token 直接收集欄位，不建 DOM 樹（預設）
+#   bs4    - BeautifulSoup(..., "html.parser") 建完整的樹再查詢
+# 兩者輸出逐字相同（python benchmark.py parser 會比對）。lxml 會自動補 <html>/<body>、
+# 容錯規則也不同，無法保證輸出一致，因此不提供。
+HTML_PARSER_BACKENDS = ("stream", "bs4")
+HTML_PARSER_BACKEND = os.environ.get("HTML_PARSER_BACKEND", "stream").strip().lower()
+if HTML_PARSER_BACKEND not in HTML_PARSER_BACKENDS:
+    print(f"[HTML] 不支援的解析後端 {HTML_PARSER_BACKEND!r}，改用 stream（可用：{', '.join(HTML_PARSER_BACKENDS)}）")
+    HTML_PARSER_BACKEND = "stream"
+
+URL_PATTERN = re.compile(r"(?i)\b((?:https?://|www\.)[^\s<>\"'\)]{3,})")
+# 不對整份輸入做 lower()：非 ASCII 的大頁面 lower() 會暫時配置數倍大小的緩衝
+HTML_MARKER = re.compile(r"<html", re.IGNORECASE)
+LINK_MARKER = re.compile(r"<a |href=", re.IGNORECASE)
+RELEVANT_META_NAMES = ("description", "keywords", "author")
+# 不屬於可見文字的元素
+INVISIBLE_TAGS = {"script", "style", "noscript", "template", "head", "meta", "link"}
+# 可以出現在 <head> 的元素；遇到其他開始標籤就當作 head 已結束（之後不會再有 title/meta）
+HEAD_TAGS = {"html", "head", "title", "meta", "link", "style", "script", "base", "noscript", "template"}
+
+# relevant_html 的預算：連結數、body 文字字數；串流模式填滿就停止掃描
+RELEVANT_LINK_LIMIT = 10
+RELEVANT_TEXT_LIMIT = 1000
+# analysis_urls（規則評分、工具與 LLM 看到的網址）的上限：每個可註冊網域一個，最多幾個
+ANALYSIS_URL_LIMIT = int(os.environ.get("ANALYSIS_URL_LIMIT", RELEVANT_LINK_LIMIT))
+# 串流模式每次餵給 tokenizer 的字元數
+STREAM_CHUNK_CHARS = 64 * 1024
+
+# 以下規則取自 bs4 的 HTMLTreeBuilder，讓 stream 後端與 BeautifulSoup 建出的樹看到同一份內容
+_VOID_TAGS = frozenset(HTMLTreeBuilder.DEFAULT_EMPTY_ELEMENT_TAGS)
+_STRING_CONTAINER_TAGS = frozenset(HTMLTreeBuilder.DEFAULT_STRING_CONTAINERS)   # script/style/template/rt/rp
+_PRESERVE_WHITESPACE_TAGS = frozenset(HTMLTreeBuilder.DEFAULT_PRESERVE_WHITESPACE_TAGS)
+_ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+_DECIMAL_REF = re.compile("^([0-9]+)(.*)")
+_HEX_REF = re.compile("^([0-9a-f]+)(.*)")
+
+# 字串種類：一般文字、CDATA、其他（註解、DOCTYPE、宣告、PI）
+_TEXT, _CDATA, _OTHER = 0, 1, 2
+
+
+class _BudgetFilled(Exception):
+    """串流掃描的預算已填滿，提前結束。"""
+
+
+def _codepoint_text(codepoint: int) -> str:
+    """數字字元參照轉文字（與 bs4 相同：非法值換成 U+FFFD，0x80–0x9F 依 Windows-1252 對應）。"""
+    if codepoint <= 0 or codepoint > 0x10FFFF or 0xD800 <= codepoint <= 0xDFFF:
+        return "\ufffd"
+    if 0x80 <= codepoint <= 0x9F and codepoint in UnicodeDammit.WINDOWS_1252_TO_UTF8:
+        return UnicodeDammit.WINDOWS_1252_TO_UTF8[codepoint].decode("utf8")
+    return chr(codepoint)
+
+
+class _PageScanner(HTMLParser):
+    """stream 後端：一次掃描 token 串流，直接收集 ParsedPage 需要的欄位。
+
+    不建 DOM 樹，只維護一個開啟中標籤的堆疊；開/關標籤、空元素、文字合併與空白收合
+    都照 bs4 html.parser 建樹的規則，所以各欄位與 BeautifulSoup 版逐字相同。
+
+    給了 link_limit 等預算時是串流模式：分段餵入，只收 relevant_html 需要的欄位，
+    head 結束、連結與 body 文字都收滿（或 title + meta 已超過輸出長度）就停止，
+    後面的內容完全不掃描。
+    """
+
+    def __init__(self, link_limit: int = None, text_limit: int = None, output_limit: int = None):
+        super().__init__(convert_charrefs=False)
+        self.budgeted = link_limit is not None
+        self.link_limit = link_limit
+        self.text_limit = text_limit
+        self.output_limit = output_limit
+        self.head_done = False
+        self.body_chars = 0
+        self.meta_chars = 0
+        self.stopped_early = False
+
+        self.stack = []                 # [(tag, title 子樹的 children 或 None)]
+        self.container_depth = 0        # 開啟中的 script/style/template/rt/rp 數量
+        self.preserve_depth = 0         # 開啟中的 pre/textarea 數量
+        self.already_closed = {}        # 已自動關閉、之後若出現 </br> 等結尾要忽略的空元素 → 次數
+        self.pending = []               # 尚未成形的文字片段
+        self.script_parts = None        # 目前 <script> 內的文字
+
+        self.title_children = None      # 第一個 <title> 的子節點：[("s", 字串) | ("t", children)]
+        self.metas = []
+        self.links = []
+        self.body_parts = []
+        self.visible_parts = []
+        self.scripts = []
+        self.event_handlers = []
+        self.password_inputs = 0
+        self.form_actions = []
+
+    @classmethod
+    def scan(cls, raw: str, **budget) -> "_PageScanner":
+        scanner = cls(**budget)
+        try:
+            if scanner.budgeted:
+                for start in range(0, len(raw), STREAM_CHUNK_CHARS):
+                    scanner.feed(raw[start:start + STREAM_CHUNK_CHARS])
+            else:
+                scanner.feed(raw)
+            scanner.close()
+            scanner._flush()
+            scanner._close_script()     # 沒有 </script> 的 script 在 bs4 裡一樣算數
+        except _BudgetFilled:
+            scanner.stopped_early = True
+        return scanner
+
+    def _check_budget(self):
+        if not self.budgeted:
+            return
+        if self.meta_chars + len(self.title) >= self.output_limit or (
+            self.head_done
+            and len(self.links) >= self.link_limit
+            and self.body_chars >= self.text_limit
+        ):
+            raise _BudgetFilled
+
+    @property
+    def title(self) -> str:
+        children = self.title_children
+        while children is not None and len(children) == 1:
+            kind, value = children[0]
+            if kind == "s":
+                return value
+            children = value
+        return ""
+
+    # ── 文字 ──
+
+    def _flush(self, kind: int = _TEXT):
+        """等同 bs4 的 endData：合併片段、收合純空白，再交給各欄位。"""
+        if not self.pending:
+            return
+        text = "".join(self.pending)
+        self.pending = []
+        if not self.preserve_depth and not text.strip(_ASCII_SPACES):
+            text = "\n" if "\n" in text else " "
+
+        parent, children = self.stack[-1] if self.stack else (None, None)
+        if children is not None:
+            children.append(("s", text))
+        if kind == _OTHER:
+            return
+        if kind == _CDATA or not self.container_depth:
+            stripped = text.strip()
+            if not stripped:
+                return
+            if self.budgeted:
+                if self.body_chars < self.text_limit:
+                    self.body_parts.append(stripped)
+                    self.body_chars += len(stripped) + (len(self.body_parts) > 1)
+                    self._check_budget()
+                return
+            self.body_parts.append(stripped)
+            if kind == _TEXT and parent not in INVISIBLE_TAGS:
+                self.visible_parts.append(stripped)
+        elif parent == "script" and self.script_parts is not None:
+            self.script_parts.append(text)
+
+    def handle_data(self, data):
+        self.pending.append(data)
+
+    def handle_charref(self, name):
+        base, pattern = 10, _DECIMAL_REF
+        if name[:1] in ("x", "X"):
+            name, base, pattern = name[1:], 16, _HEX_REF
+        try:
+            codepoint = int(name, base)
+        except ValueError:
+            match = pattern.search(name)
+            if match is None:
+                self.pending.append(name)
+            else:
+                self.pending.append(_codepoint_text(int(match.group(1), base)))
+                self.pending.append(match.group(2))
+        else:
+            self.pending.append(_codepoint_text(codepoint))
+
+    def handle_entityref(self, name):
+        self.pending.append(EntitySubstitution.HTML_ENTITY_TO_CHARACTER.get(name) or f"&{name}")
+
+    def _special(self, data: str, kind: int = _OTHER):
+        self._flush()
+        self.pending.append(data)
+        self._flush(kind)
+
+    def handle_comment(self, data):
+        self._special(data)
+
+    def handle_decl(self, decl):
+        self._special(decl[len("DOCTYPE "):])
+
+    def handle_pi(self, data):
+        self._special(data)
+
+    def unknown_decl(self, data):
+        if data.upper().startswith("CDATA["):
+            self._special(data[len("CDATA["):], _CDATA)
+        else:
+            self._special(data)
+
+    # ── 標籤 ──
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs, auto_close=False)
+        self._end(tag)
+
+    def handle_starttag(self, tag, attrs, auto_close=True):
+        self._flush()
+        attr_dict = {}
+        for name, value in attrs:
+            attr_dict[name] = "" if value is None else value
+
+        if self.budgeted:
+            self._budgeted_starttag(tag, attr_dict)
+        else:
+            for name, value in attr_dict.items():
+                if name.startswith("on"):
+                    self.event_handlers.append(value)
+                elif name in ("href", "src", "action") and value.strip().lower().startswith("javascript:"):
+                    self.event_handlers.append(value.strip()[len("javascript:"):])
+            if tag == "a" and "href" in attr_dict:
+                self.links.append(attr_dict["href"])
+            elif tag == "meta" and attr_dict.get("name") in RELEVANT_META_NAMES:
+                self.metas.append(self._serialize_meta())
+            elif tag == "script":
+                self.script_parts = []
+            elif tag == "form":
+                self.form_actions.append(attr_dict.get("action", ""))
+            elif tag == "input" and attr_dict.get("type", "").strip().lower() == "password":
+                self.password_inputs += 1
+        self._push(tag, auto_close)
+
+    def _budgeted_starttag(self, tag, attr_dict):
+        """串流模式只收 title、head 裡的 meta 與前幾個連結。"""
+        if tag not in HEAD_TAGS and not self.head_done:
+            self.head_done = True
+            self._check_budget()
+        if tag == "a" and "href" in attr_dict and len(self.links) < self.link_limit:
+            self.links.append(attr_dict["href"])
+            self._check_budget()
+        elif tag == "meta" and attr_dict.get("name") in RELEVANT_META_NAMES and not self.head_done:
+            meta = self._serialize_meta()
+            self.metas.append(meta)
+            self.meta_chars += len(meta) + 1
+            self._check_budget()
+
+    def _serialize_meta(self) -> str:
+        # meta 很少，序列化（屬性排序、引號、charset 替換）直接交給 bs4 處理這一個標籤
+        return str(BeautifulSoup(self.get_starttag_text(), "html.parser").meta)
+
+    def _push(self, tag, auto_close):
+        children = None
+        if self.stack and self.stack[-1][1] is not None:
+            children = []
+            self.stack[-1][1].append(("t", children))
+        elif tag == "title" and self.title_children is None:
+            children = self.title_children = []
+        self.stack.append((tag, children))
+        if tag in _STRING_CONTAINER_TAGS:
+            self.container_depth += 1
+        if tag in _PRESERVE_WHITESPACE_TAGS:
+            self.preserve_depth += 1
+
+        if auto_close and tag in _VOID_TAGS:
+            self._end(tag)
+            self.already_closed[tag] = self.already_closed.get(tag, 0) + 1
+
+    def handle_endtag(self, tag):
+        if tag == "head" and self.budgeted and not self.head_done:
+            self.head_done = True
+            self._check_budget()
+        if self.already_closed.get(tag):
+            self.already_closed[tag] -= 1
+        else:
+            self._end(tag)
+
+    def _end(self, tag):
+        """等同 bs4 的 _popToTag：彈出到最近一個同名標籤為止；沒有開啟中的同名標籤就忽略。"""
+        self._flush()
+        if not any(name == tag for name, _ in self.stack):
+            return
+        while self.stack:
+            name, _ = self.stack.pop()
+            if name in _STRING_CONTAINER_TAGS:
+                self.container_depth -= 1
+            if name in _PRESERVE_WHITESPACE_TAGS:
+                self.preserve_depth -= 1
+            if name == "script":
+                self._close_script()
+            if name == tag:
+                break
+
+    def _close_script(self):
+        if self.script_parts is not None:
+            code = "".join(self.script_parts)
+            if code.strip():
+                self.scripts.append(code)
+            self.script_parts = None
+
+
+class ParsedPage:
+    """單次請求的頁面解析結果。
+
+    HTML 只解析一次；title、meta、連結、可見文字、script 內容、標準化網址等欄位
+    在第一次使用時才計算並快取，server / analyzer / tools 共用同一份。
+    stream 後端一次掃描就收齊所有欄位；bs4 後端建一棵樹，各欄位分別查詢。
+    """
+
+    def __init__(self, raw: str):
+        self.raw = raw or ""
+        self.is_html = HTML_MARKER.search(self.raw) is not None
+        self.has_markup = self.is_html or LINK_MARKER.search(self.raw) is not None
+
+    @cached_property
+    def soup(self):
+        return BeautifulSoup(self.raw, "html.parser")
+
+    @cached_property
+    def _scan(self):
+        """stream 後端的掃描結果；bs4 後端回傳 None。"""
+        if HTML_PARSER_BACKEND == "stream":
+            return _PageScanner.scan(self.raw)
+        return None
+
+    @cached_property
+    def title(self) -> str:
+        if self._scan is not None:
+            return self._scan.title
+        return (self.soup.title.string or "") if self.soup.title else ""
+
+    @cached_property
+    def metas(self) -> list:
+        if self._scan is not None:
+            return self._scan.metas
+        return [
+            str(meta)
+            for meta in self.soup.find_all("meta")
+            if meta.get("name") in RELEVANT_META_NAMES
+        ]
+
+    @cached_property
+    def links(self) -> list:
+        """所有 <a href> 的原始 href（依文件順序）。"""
+        if self._scan is not None:
+            return self._scan.links
+        return [a.get("href") for a in self.soup.find_all("a", href=True)]
+
+    @cached_property
+    def body_text(self) -> str:
+        """整份文件的文字（與舊版 extract_relevant_html 相同；script/style/template 內容不算）。"""
+        if self._scan is not None:
+            return "\n".join(self._scan.body_parts)
+        return self.soup.get_text("\n", strip=True)
+
+    @cached_property
+    def visible_text(self) -> str:
+        """使用者看得到的文字：略過 script/style/head 等元素與註解；純文字輸入原樣回傳。"""
+        if "<" not in self.raw:
+            return self.raw.strip()
+        if self._scan is not None:
+            parts = list(self._scan.visible_parts)
+        else:
+            parts = self._soup_visible_parts()
+        if self.title and self.title.strip() not in parts[:1]:
+            parts.insert(0, self.title.strip())
+        return "\n".join(parts)
+
+    def _soup_visible_parts(self) -> list:
+        parts = []
+        for node in self.soup.find_all(string=True):
+            if type(node) is not NavigableString or node.parent.name in INVISIBLE_TAGS:
+                continue
+            text = node.strip()
+            if text:
+                parts.append(text)
+        return parts
+
+    @cached_property
+    def scripts(self) -> list:
+        """內嵌 <script> 的程式碼（不含外部 src）。"""
+        if self._scan is not None:
+            return self._scan.scripts
+        bodies = []
+        for tag in self.soup.find_all("script"):
+            code = tag.string if tag.string is not None else tag.get_text()
+            if code and code.strip():
+                bodies.append(code)
+        return bodies
+
+    @cached_property
+    def event_handlers(self) -> list:
+        """on* 屬性與 javascript: 連結中的程式碼。"""
+        if self._scan is not None:
+            return self._scan.event_handlers
+        handlers = []
+        for tag in self.soup.find_all(True):
+            for name, value in tag.attrs.items():
+                if not isinstance(value, str):
+                    continue
+                if name.startswith("on"):
+                    handlers.append(value)
+                elif name in ("href", "src", "action") and value.strip().lower().startswith("javascript:"):
+                    handlers.append(value.strip()[len("javascript:"):])
+        return handlers
+
+    @cached_property
+    def password_inputs(self) -> int:
+        """<input type="password"> 的數量。"""
+        if self._scan is not None:
+            return self._scan.password_inputs
+        return sum(1 for tag in self.soup.find_all("input")
+                   if isinstance(tag.get("type"), str) and tag["type"].strip().lower() == "password")
+
+    @cached_property
+    def form_actions(self) -> list:
+        """各 <form> 的 action 原始值（依文件順序；沒有 action 時為空字串）。"""
+        if self._scan is not None:
+            return self._scan.form_actions
+        return [tag.get("action", "") for tag in self.soup.find_all("form")]
+
+    @cached_property
+    def offsite_form_actions(self) -> list:
+        """送到其他網站的表單：action 是絕對網址（http(s):// 或 //）；相對路徑送回頁面本身，不算。"""
+        return [a.strip() for a in self.form_actions
+                if isinstance(a, str) and a.strip().lower().startswith(("http://", "https://", "//"))]
+
+    @cached_property
+    def urls(self) -> list:
+        """<a href> 與文字中出現的網址，標準化、去重、排序。"""
+        urls = set()
+        if self.has_markup:
+            try:
+                for href in self.links:
+                    norm = _normalize_url((href or "").strip())
+                    if norm:
+                        urls.add(norm)
+            except Exception:
+                pass
+        for m in URL_PATTERN.finditer(self.raw):
+            norm = _normalize_url(m.group(1))
+            if norm:
+                urls.add(norm)
+        return sorted(urls)
+
+    @cached_property
+    def analysis_urls(self) -> list:
+        """規則評分、工具與 LLM 用的網址：<a href>（文件順序）再加上可見文字中的網址，
+        每個可註冊網域只取第一個，最多 ANALYSIS_URL_LIMIT 個。
+
+        規則每個網址加減分，不去重、不設上限的話分數會隨頁面大小無限增加；
+        <link href>、<script src> 這類資源網址也不算。黑名單檢查仍用完整的 urls。
+        """
+        candidates = list(self.links) if self.has_markup else []
+        candidates += [m.group(1) for m in URL_PATTERN.finditer(self.visible_text)]
+        seen, urls = set(), []
+        for raw in candidates:
+            norm = _normalize_url((raw or "").strip())
+            if not norm:
+                continue
+            host = urlsplit(norm).hostname or ""
+            domain = PUBLIC_SUFFIXES.registrable(host) or host
+            if domain in seen:
+                continue
+            seen.add(domain)
+            urls.append(norm)
+            if len(urls) >= ANALYSIS_URL_LIMIT:
+                break
+        return urls
+
+    def relevant_html(self, max_length: int = 3000, streaming: bool = False) -> str:
+        """保留 title、部分 meta 與可見文字，供模型快速分析。
+
+        streaming=True 時不做完整解析：串流掃描到 title、head 裡的 meta、前 10 個連結與
+        body 文字預算都收滿就停止，成本與頁面大小無關（body 之後才出現的 meta 不會收錄）。
+        """
+        if streaming:
+            scan = _PageScanner.scan(
+                self.raw,
+                link_limit=RELEVANT_LINK_LIMIT,
+                text_limit=RELEVANT_TEXT_LIMIT,
+                output_limit=max_length,
+            )
+            title, metas, links, body_text = scan.title, scan.metas, scan.links, "\n".join(scan.body_parts)
+        else:
+            title, metas, links, body_text = self.title, self.metas, self.links, self.body_text
+        result = (
+            f"<title>{title}</title>\n"
+            f"{' '.join(metas)}\n"
+            f"<links>{links[:RELEVANT_LINK_LIMIT]}</links>\n"
+            f"<body>{body_text[:RELEVANT_TEXT_LIMIT]}</body>"
+        )
+        return result[:max_length]
+
+
+def extract_relevant_html(raw_html: str, max_length: int = 3000, streaming: bool = True) -> str:
+    """保留 title、部分 meta 與可見文字，供模型快速分析（預設串流、提前停止）。
+
+    分析請求不再經過這裡：黑名單要檢查頁面上所有網址、JS 檢測要看所有 script，
+    兩者都需要完整掃描一次（ParsedPage），摘要省不掉這次掃描；請求成本由 ANALYZE_MAX_BYTES 限制。
+    """
+    return ParsedPage(raw_html).relevant_html(max_length, streaming=streaming)
 
 # URL 正規化
 def _normalize_url(url: str) -> str | None:
@@ -47,51 +538,10 @@ def _normalize_url(url: str) -> str | None:
     if url.startswith("www."):
         url = "http://" + url
 
-    try:
-        parsed = urlparse(url)
-        if parsed.scheme not in ("http", "https"):
-            return None
-
-        netloc = parsed.netloc.lower().rstrip('.')
-
-        # 移除預設 port
-        if netloc.endswith(":80") and parsed.scheme == "http":
-            netloc = netloc[:-3]
-        if netloc.endswith(":443") and parsed.scheme == "https":
-            netloc = netloc[:-4]
-
-        path = parsed.path or "/"
-
-        normalized = urlunparse((parsed.scheme, netloc, path, "", parsed.query, ""))
-        return normalized
-
-    except Exception:
-        return None
+    # 其餘規則（大小寫、預設 port、路徑、fragment）與黑名單共用
+    return canonicalize_url(url)
 
 # 擷取 URL
 def extract_urls(text: str, max_count: int = 50) -> list[str]:
     """從 HTML 或純文字中萃取網址，並格式化。"""
-    urls = set()
-    lowered = text.lower()
-
-    # HTML 模式（<a href>）
-    if "<html" in lowered or "<a " in lowered or "href=" in lowered:
-        try:
-            soup = BeautifulSoup(text, "html.parser")
-            for a in soup.find_all("a", href=True):
-                href = (a.get("href") or "").strip()
-                norm = _normalize_url(href)
-                if norm:
-                    urls.add(norm)
-        except:
-            pass
-
-    # Regex 模式（www., http://, https://）
-    pattern = re.compile(r"(?i)\b((?:https?://|www\.)[^\s<>\"'\)]{3,})")
-    for m in pattern.finditer(text):
-        cand = m.group(1)
-        norm = _normalize_url(cand)
-        if norm:
-            urls.add(norm)
-
-    return sorted(urls)[:max_count]
+    return ParsedPage(text).urls[:max_count]
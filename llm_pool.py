@@ -0,0 +1,201 @@
+# llm_pool.py — LLM 後端連線池：長駐的 ChatOllama 客戶端，多個 Ollama 端點間以「未完成請求最少」分流並限制並行數
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import httpx
+from langchain_core.runnables import Runnable
+from langchain_ollama import ChatOllama
+
+# Ollama 端點（逗號分隔）；未設定時用 OLLAMA_HOST，再沒有則為本機預設埠
+OLLAMA_ENDPOINTS = [u.strip() for u in os.environ.get(
+    "OLLAMA_ENDPOINTS", os.environ.get("OLLAMA_HOST", "http://127.0.0.1:11434")).split(",") if u.strip()]
+# 每個端點同時處理的請求上限（對應該端點 Ollama 的 OLLAMA_NUM_PARALLEL），超過的請求在池內排隊
+LLM_ENDPOINT_CONCURRENCY = int(os.environ.get("LLM_ENDPOINT_CONCURRENCY", 2))
+# 所有端點都滿載時最多排隊幾秒，逾時丟 TimeoutError（呼叫端走 LLM 失敗的保底結果）
+LLM_QUEUE_TIMEOUT = float(os.environ.get("LLM_QUEUE_TIMEOUT", 120))
+# 連不上的端點暫停分流幾秒
+LLM_ENDPOINT_COOLDOWN = float(os.environ.get("LLM_ENDPOINT_COOLDOWN", 10))
+# 模型留在端點記憶體的時間（Ollama 的 keep_alive，例如 30m）；留空用伺服器預設
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "") or None
+
+# 端點連不上（ollama 套件在非串流時包成 ConnectionError，串流時直接丟 httpx 的例外）
+_CONNECT_ERRORS = (ConnectionError, httpx.ConnectError)
+
+
+class _Endpoint:
+    __slots__ = ("url", "max_concurrency", "outstanding", "requests", "errors", "busy", "down_until", "clients")
+
+    def __init__(self, url: str, max_concurrency: int):
+        self.url = url
+        self.max_concurrency = max_concurrency
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.busy = 0.0         # 請求累計耗時（秒）
+        self.down_until = 0.0
+        self.clients = {}       # 設定 → 長駐的 ChatOllama（各自持有 keep-alive 的 httpx 連線）
+
+
+class LLMPool:
+    """多個 Ollama 端點的連線池。
+
+    acquire() 挑未完成請求最少、且未達並行上限的端點（同數時挑累計請求較少的）；全部滿載時依到達順序排隊，
+    stats() 的 waiting / max_waiting 即排隊深度。每個端點、每組模型設定只建一個 ChatOllama，
+    重複使用其 HTTP 連線。連線失敗的端點暫停分流 cooldown 秒；全部暫停時仍照常嘗試。多執行緒共用。
+    """
+
+    def __init__(self, endpoints=OLLAMA_ENDPOINTS, max_concurrency: int = LLM_ENDPOINT_CONCURRENCY,
+                 queue_timeout: float = LLM_QUEUE_TIMEOUT, cooldown: float = LLM_ENDPOINT_COOLDOWN):
+        self.queue_timeout = queue_timeout
+        self.cooldown = cooldown
+        self._cond = threading.Condition()
+        self._queue = deque()   # 排隊中的請求，依到達順序取得端點
+        self._endpoints = []
+        self.set_endpoints(endpoints, max_concurrency)
+
+    def __len__(self):
+        return len(self._endpoints)
+
+    def set_endpoints(self, endpoints, max_concurrency: int = None):
+        """換一組端點（例如擴充 GPU 主機）；進行中的請求照常在舊端點完成。"""
+        max_concurrency = max_concurrency or LLM_ENDPOINT_CONCURRENCY
+        urls = [u.rstrip("/") for u in endpoints if u]
+        if not urls:
+            raise ValueError("至少需要一個 Ollama 端點")
+        with self._cond:
+            self._endpoints = [_Endpoint(url, max(1, max_concurrency)) for url in urls]
+            self.max_waiting = 0
+            self.queued = 0
+            self.wait_time = 0.0
+            self.timeouts = 0
+            self._cond.notify_all()
+
+    def _pick(self, now: float):
+        free = [e for e in self._endpoints if e.outstanding < e.max_concurrency]
+        healthy = [e for e in free if e.down_until <= now]
+        if not healthy and all(e.down_until > now for e in self._endpoints):
+            healthy = free
+        return min(healthy, key=lambda e: (e.outstanding, e.requests), default=None)
+
+    def acquire(self, timeout: float = None) -> _Endpoint:
+        """借一個端點；所有端點都滿載時等待，超過 timeout（預設 queue_timeout）丟 TimeoutError。"""
+        timeout = self.queue_timeout if timeout is None else timeout
+        with self._cond:
+            now = time.time()
+            # 已有人排隊時新請求排在後面，不插隊搶剛空出的名額
+            endpoint = None if self._queue else self._pick(now)
+            if endpoint is None:
+                deadline = now + timeout
+                ticket = object()
+                self._queue.append(ticket)
+                self.queued += 1
+                self.max_waiting = max(self.max_waiting, len(self._queue))
+                try:
+                    while True:
+                        if self._queue[0] is ticket:
+                            endpoint = self._pick(time.time())
+                            if endpoint is not None:
+                                break
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            self.timeouts += 1
+                            raise TimeoutError(f"LLM 端點全部滿載，排隊超過 {timeout:g} 秒")
+                        # 暫停中的端點到期不會有人通知，最多等 cooldown 秒再重新挑選
+                        self._cond.wait(min(remaining, self.cooldown))
+                finally:
+                    self._queue.remove(ticket)
+                    self.wait_time += time.time() - now
+                    self._cond.notify_all()
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def release(self, endpoint: _Endpoint, elapsed: float, failed: bool = False):
+        """歸還端點；failed=True（連不上）時暫停分流 cooldown 秒。"""
+        with self._cond:
+            endpoint.outstanding -= 1
+            endpoint.busy += elapsed
+            if failed:
+                endpoint.errors += 1
+                endpoint.down_until = time.time() + self.cooldown
+            self._cond.notify_all()
+
+    def client(self, endpoint: _Endpoint, settings: dict) -> ChatOllama:
+        """端點上對應這組設定的長駐 ChatOllama。"""
+        key = json.dumps(settings, sort_keys=True, ensure_ascii=False)
+        llm = endpoint.clients.get(key)
+        if llm is None:
+            with self._cond:
+                llm = endpoint.clients.get(key)
+                if llm is None:
+                    llm = endpoint.clients[key] = ChatOllama(base_url=endpoint.url, keep_alive=OLLAMA_KEEP_ALIVE, **settings)
+        return llm
+
+    def chat(self, **settings) -> "PooledChatModel":
+        """取代 ChatOllama(**settings)，可直接接在 prompt | 後面。"""
+        return PooledChatModel(self, settings)
+
+    def stats(self) -> dict:
+        with self._cond:
+            now = time.time()
+            return {
+                "endpoints": [{
+                    "url": e.url,
+                    "outstanding": e.outstanding,
+                    "max_concurrency": e.max_concurrency,
+                    "requests": e.requests,
+                    "errors": e.errors,
+                    "avg_ms": round(e.busy / (e.requests - e.outstanding or 1) * 1000, 1),
+                    "down": e.down_until > now,
+                } for e in self._endpoints],
+                "outstanding": sum(e.outstanding for e in self._endpoints),
+                "capacity": sum(e.max_concurrency for e in self._endpoints),
+                "waiting": len(self._queue),
+                "max_waiting": self.max_waiting,
+                "queued": self.queued,
+                "avg_wait_ms": round(self.wait_time / (self.queued or 1) * 1000, 1),
+                "timeouts": self.timeouts,
+            }
+
+
+class PooledChatModel(Runnable):
+    """每次呼叫向 LLMPool 借一個端點，交給該端點長駐的 ChatOllama 執行，結束後歸還。
+
+    invoke() 連不上某個端點時換下一個端點重試；stream() 在呼叫端停止讀取（關閉產生器）時即歸還端點。
+    """
+
+    def __init__(self, pool: LLMPool, settings: dict):
+        self.pool = pool
+        self.settings = settings
+
+    def invoke(self, input, config=None, **kwargs):
+        for attempt in range(len(self.pool)):
+            endpoint = self.pool.acquire()
+            t0 = time.time()
+            failed = False
+            try:
+                return self.pool.client(endpoint, self.settings).invoke(input, config, **kwargs)
+            except _CONNECT_ERRORS:
+                failed = True
+                if attempt == len(self.pool) - 1:
+                    raise
+            finally:
+                self.pool.release(endpoint, time.time() - t0, failed)
+
+    def stream(self, input, config=None, **kwargs):
+        endpoint = self.pool.acquire()
+        t0 = time.time()
+        failed = False
+        try:
+            yield from self.pool.client(endpoint, self.settings).stream(input, config, **kwargs)
+        except _CONNECT_ERRORS:
+            failed = True
+            raise
+        finally:
+            self.pool.release(endpoint, time.time() - t0, failed)
+
+
+LLM_POOL = LLMPool()
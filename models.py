@@ -17,5 +17,13 @@ class SimplePhishingAnalysis(BaseModel):
     is_potential_phishing: bool
     explanation: str
 
+class FastPhishingVerdict(BaseModel):
+    """fast 模式一次呼叫的輸出格式；JSON Schema 直接交給 Ollama 的 format 限制輸出。"""
+    is_potential_phishing: bool
+    risk_level: PhishingProbability
+    explanation: List[str] = Field(..., max_length=3, description="最多三條短理由（請用繁體中文）")
+    confidence: int = Field(..., ge=0, le=100)
+    reasoning: str = Field("", max_length=200, description="一兩句話的判斷依據，可留空（請用繁體中文）")
+
 
 
@@ -0,0 +1,407 @@
+# near_dup.py — 近似重複頁面索引：同一套釣魚工具包只改幾個字重新部署，也能找回先前的判斷
+import atexit
+import hashlib
+import multiprocessing
+import os
+import re
+import struct
+import sys
+import threading
+import time
+from array import array
+
+# 索引筆數上限（環狀緩衝，滿了覆蓋最舊的）與每筆存活秒數
+NEAR_DUP_SIZE = int(os.environ.get("NEAR_DUP_SIZE", 200000))
+NEAR_DUP_TTL = float(os.environ.get("NEAR_DUP_TTL", 86400))
+# 估計的 Jaccard 相似度（shingle 集合）達到多少才算同一個頁面
+NEAR_DUP_THRESHOLD = float(os.environ.get("NEAR_DUP_THRESHOLD", 0.8))
+# 持久化檔案；留空則只放記憶體。有新資料時每隔 NEAR_DUP_SAVE_INTERVAL 秒與結束時寫回
+NEAR_DUP_DB = os.environ.get("NEAR_DUP_DB", "")
+NEAR_DUP_SAVE_INTERVAL = 300
+
+# shingle 太少的頁面（只有「Loading...」之類）相似度估計不可靠，不比對
+NEAR_DUP_MIN_SHINGLES = 32
+# 只取可見文字開頭這麼多字元：工具包的特徵在前面，也讓大頁面的成本有上限
+NEAR_DUP_MAX_CHARS = 10000
+SHINGLE_SIZE = 3
+
+# MinHash（one permutation hashing）：每個 shingle 只算一次雜湊，低 5 位元決定放進 32 個 bin 的哪一個，
+# 每個 bin 取最小值的最低 8 位元（b-bit MinHash）→ 每個頁面 32 bytes 的草圖。
+# LSH 分成 8 個 band × 4 列：相似度 0.8 的頁面被找成候選的機率 98.5%，0.9 時 99.99%。
+# 每個 band 4 bytes 剛好是一個 uint32，比對時直接以整數比較。
+SKETCH_BINS = 32
+BANDS = 8
+_NIL = 0xFFFFFFFF
+# 空 bin 由右邊第一個非空 bin 補值（旋轉 densification），每跨一格加上這個偏移
+_ROTATE = 0x9D
+
+# 英數字連成一個 token，其他文字（中文等）一個字一個 token
+_TOKEN = re.compile(r"[0-9a-z_]+|\w")
+
+# 判斷結果壓成一個 byte：bit0 有資料、bit1 疑似釣魚、bit2-3 風險等級
+_USED = 1
+_PHISHING = 2
+RISK_LEVELS = ("low", "medium", "high")
+
+# ------------------ 持久化格式（little-endian） ------------------
+#   header : magic(8) + 容量 uint32 + 下一個寫入位置 uint32 + 筆數 uint32 + 規則版本(16)
+#   欄位   : 容量 個草圖(32 bytes)、網址主機簽章(uint64)、寫入時間(double)、判斷(byte)、信心(byte)、
+#            VERDICT_CACHE 的指紋(16 bytes)、各 band 的 next 指標(BANDS 個 uint32)
+#   最後   : 各 band 的桶頭(uint32)
+NEAR_DUP_MAGIC = b"NEARDUP1"
+_HEADER = struct.Struct("<8sIII16s")
+# (array typecode 或 None 表示 bytes, 每個槽位的 bytes 數)，順序同 NearDupIndex._columns()
+_COLUMN_LAYOUT = [(None, SKETCH_BINS), ("Q", 8), ("d", 8), (None, 1), (None, 1), (None, 16), ("I", 4 * BANDS)]
+
+
+def shingles(text: str) -> set:
+    """可見文字 → 連續 SHINGLE_SIZE 個 token 組成的集合（小寫，空白與標點不影響）。"""
+    tokens = _TOKEN.findall(text[:NEAR_DUP_MAX_CHARS].lower())
+    return {" ".join(gram) for gram in zip(*(tokens[i:] for i in range(SHINGLE_SIZE)))}
+
+
+def minhash_sketch(text: str):
+    """可見文字 → 32 bytes 的 MinHash 草圖；shingle 少於 NEAR_DUP_MIN_SHINGLES 時回傳 None。"""
+    grams = shingles(text)
+    if len(grams) < NEAR_DUP_MIN_SHINGLES:
+        return None
+    blake = hashlib.blake2b
+    values = array("Q", b"".join([blake(g.encode("utf-8", "surrogatepass"), digest_size=8).digest()
+                                  for g in grams]))
+    if sys.byteorder != "little":
+        values.byteswap()
+    mins = [None] * SKETCH_BINS
+    mask = SKETCH_BINS - 1
+    for h in values:
+        b = h & mask
+        v = h >> 5
+        m = mins[b]
+        if m is None or v < m:
+            mins[b] = v
+    sketch = bytearray(SKETCH_BINS)
+    for b in range(SKETCH_BINS):
+        for step in range(SKETCH_BINS):
+            m = mins[(b + step) & mask]
+            if m is not None:
+                sketch[b] = (m + step * _ROTATE) & 0xFF
+                break
+    return bytes(sketch)
+
+
+def similarity(a: bytes, b: bytes) -> float:
+    """兩個草圖估計的 Jaccard 相似度（扣掉 8 位元截斷造成的 1/256 偶然相同）。"""
+    same = sum(x == y for x, y in zip(a, b)) / SKETCH_BINS
+    return max(0.0, (same - 1 / 256) / (1 - 1 / 256))
+
+
+def site_signature(hosts) -> int:
+    """頁面連到的主機集合 → 64 位元簽章（順序、重複不影響）；沒有主機時為 0。"""
+    hosts = sorted(set(h for h in hosts if h))
+    if not hosts:
+        return 0
+    return int.from_bytes(hashlib.blake2b("\n".join(hosts).encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class NearDupIndex:
+    """MinHash 草圖 → 先前的判斷；記憶體在建立時一次配置（容量 × 約 100 bytes），之後不再增長。
+
+    每個 band 是一組鏈結串列（桶頭與 next 指標都是 array，桶子數約為容量的 1/4），沒有逐筆的 Python 物件。
+    查詢只走 8 個桶子、比對 band 內容完全相同的候選，再用整個草圖估計相似度。
+    資料放在環狀陣列裡，滿了覆蓋最舊的槽位；超過 TTL 的條目查詢時略過。
+
+    沿用判斷有方向性：仿冒頁本來就和正牌頁面幾乎一樣，所以「安全」的鄰居只有在網址主機完全相同時才沿用，
+    「疑似釣魚」的鄰居則不限主機（同一工具包換網域重新部署）。
+    """
+
+    def __init__(self, capacity: int = NEAR_DUP_SIZE, ttl: float = NEAR_DUP_TTL,
+                 threshold: float = NEAR_DUP_THRESHOLD):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.threshold = threshold
+        self._bucket_bits = self._bucket_bits_for(capacity)
+        self.tag = ""
+        self.path = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._reset()
+
+    @staticmethod
+    def _bucket_bits_for(capacity: int) -> int:
+        """每個 band 的桶子數（2 的次方）：平均每串約 4 筆，查詢成本不隨容量增加。"""
+        return min(max((capacity - 1).bit_length() - 2, 8), 20)
+
+    def _reset(self):
+        capacity = self.capacity
+        self._sketches = bytearray(SKETCH_BINS * capacity)
+        self._words = memoryview(self._sketches).cast("I")     # 第 slot 筆第 b 個 band：[slot * BANDS + b]
+        self._sites = array("Q", bytes(8 * capacity))
+        self._times = array("d", bytes(8 * capacity))
+        self._verdicts = bytearray(capacity)
+        self._confidence = bytearray(capacity)
+        self._keys = bytearray(16 * capacity)
+        self._heads = array("I", [_NIL]) * (BANDS << self._bucket_bits)
+        self._next = array("I", [_NIL]) * (BANDS * capacity)
+        self._head = 0
+        self._count = 0
+        self._dirty = False
+        self._saved_at = time.time()
+
+    def __len__(self):
+        return self._count
+
+    def reset(self, tag: str = ""):
+        """清空索引（規則改版時呼叫，舊判斷不再沿用）。"""
+        with self._lock:
+            self._reset()
+            self.tag = tag
+            self._dirty = True
+
+    # ---------- 槽位與 band 串列 ----------
+    def _bucket(self, b: int, band: int) -> int:
+        """第 b 個 band 的值 → 桶頭陣列的位置。"""
+        return (b << self._bucket_bits) | ((band * 0x9E3779B1 & 0xFFFFFFFF) >> (32 - self._bucket_bits))
+
+    def _link(self, slot: int):
+        heads, nxt, words, capacity = self._heads, self._next, self._words, self.capacity
+        for b in range(BANDS):
+            h = self._bucket(b, words[slot * BANDS + b])
+            nxt[b * capacity + slot] = heads[h]
+            heads[h] = slot
+
+    def _link_all(self, n: int):
+        """前 n 個槽位一次串進所有 band（載入時用，比逐筆 _link 快）。"""
+        heads, nxt, capacity, bits = self._heads, self._next, self.capacity, self._bucket_bits
+        shift = 32 - bits
+        for b in range(BANDS):
+            base, offset = b << bits, b * capacity
+            for slot, band in enumerate(self._words[b:n * BANDS:BANDS]):
+                h = base | ((band * 0x9E3779B1 & 0xFFFFFFFF) >> shift)
+                nxt[offset + slot] = heads[h]
+                heads[h] = slot
+
+    def _unlink(self, slot: int):
+        heads, nxt, words, capacity = self._heads, self._next, self._words, self.capacity
+        for b in range(BANDS):
+            h = self._bucket(b, words[slot * BANDS + b])
+            node = heads[h]
+            if node == slot:
+                heads[h] = nxt[b * capacity + slot]
+            else:
+                while nxt[b * capacity + node] != slot:
+                    node = nxt[b * capacity + node]
+                nxt[b * capacity + node] = nxt[b * capacity + slot]
+        self._verdicts[slot] = 0
+        self._count -= 1
+
+    def _nearest(self, sketch: bytes, now: float, accept):
+        """accept(slot) 為真的有效槽位中相似度最高（相同時取較新）的一個與其相似度；沒有時 (None, 0)。"""
+        heads, nxt, words, sketches, capacity = self._heads, self._next, self._words, self._sketches, self.capacity
+        times, verdicts, deadline = self._times, self._verdicts, now - self.ttl
+        best, best_sim = None, 0.0
+        seen = set()
+        for b, band in enumerate(memoryview(sketch).cast("I")):
+            slot = heads[self._bucket(b, band)]
+            while slot != _NIL:
+                if words[slot * BANDS + b] == band and slot not in seen:
+                    seen.add(slot)
+                    if verdicts[slot] and times[slot] > deadline and accept(slot):
+                        sim = similarity(sketch, sketches[slot * SKETCH_BINS:(slot + 1) * SKETCH_BINS])
+                        if sim >= self.threshold and (best is None or sim > best_sim or
+                                                      (sim == best_sim and times[slot] > times[best])):
+                            best, best_sim = slot, sim
+                slot = nxt[b * capacity + slot]
+        return best, best_sim
+
+    # ---------- 查詢與寫入 ----------
+    def lookup(self, sketch, site: int = 0, reuse_phishing: bool = True):
+        """找可沿用判斷的近似頁面：回傳 {similarity, is_potential_phishing, risk_level, confidence, key, age}，
+        沒有時回傳 None。site 是這個頁面的 site_signature。
+
+        主機相同的鄰居一律可沿用；不同主機的鄰居只沿用釣魚判斷（工具包換網域重新部署），
+        reuse_phishing=False 時連釣魚判斷也不沿用（頁面本身的主機可信，文字相似的是仿冒它的複製頁）。
+        """
+        if sketch is None:
+            return None
+        now = time.time()
+        with self._lock:
+            verdicts, sites = self._verdicts, self._sites
+            slot, sim = self._nearest(sketch, now, lambda i: (reuse_phishing and verdicts[i] & _PHISHING)
+                                      or (site and sites[i] == site))
+            if slot is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            flags = verdicts[slot]
+            level = flags >> 2
+            return {
+                "similarity": round(sim, 4),
+                "is_potential_phishing": bool(flags & _PHISHING),
+                "risk_level": RISK_LEVELS[level] if level < len(RISK_LEVELS) else "unknown",
+                "confidence": self._confidence[slot],
+                "key": bytes(self._keys[16 * slot:16 * slot + 16]).hex(),
+                "age": now - self._times[slot],
+            }
+
+    def add(self, sketch, site: int, is_phishing: bool, risk_level: str, confidence, key: str):
+        """記錄一個分析完的頁面；key 是它在 VERDICT_CACHE 的指紋（16 bytes hex），用來取回完整結果。
+
+        已有相似、主機與判斷都相同的舊條目時先移除，同一工具包的大量部署不會塞滿同一串桶子。
+        """
+        if sketch is None:
+            return
+        try:
+            confidence = int(confidence)
+        except (TypeError, ValueError):
+            confidence = 0
+        flags = _USED | (_PHISHING if is_phishing else 0) | \
+            ((RISK_LEVELS.index(risk_level) if risk_level in RISK_LEVELS else 3) << 2)
+        now = time.time()
+        with self._lock:
+            verdicts, sites = self._verdicts, self._sites
+            old, _ = self._nearest(sketch, now, lambda i: sites[i] == site and verdicts[i] == flags)
+            if old is not None:
+                self._unlink(old)
+            slot = self._head
+            if self._verdicts[slot]:
+                self._unlink(slot)
+            self._sketches[slot * SKETCH_BINS:(slot + 1) * SKETCH_BINS] = sketch
+            self._sites[slot] = site
+            self._times[slot] = now
+            self._verdicts[slot] = flags
+            self._confidence[slot] = max(0, min(confidence, 255))
+            self._keys[16 * slot:16 * slot + 16] = bytes.fromhex(key)[:16].ljust(16, b"\0")
+            self._link(slot)
+            self._head = (slot + 1) % self.capacity
+            self._count += 1
+            self._dirty = True
+            due = self.path and now - self._saved_at >= NEAR_DUP_SAVE_INTERVAL
+        if due:
+            self.save()
+
+    # ---------- 持久化 ----------
+    def save(self, path: str = None):
+        """寫到 path（預設 load 時的路徑）；鎖內只複製欄位，寫檔不擋查詢。先寫暫存檔再原子替換。
+
+        連同 band 串列一起寫出，容量相同時載入只需複製陣列，不必重建。
+        """
+        path = path or self.path
+        if not path:
+            return
+        with self._lock:
+            if path == self.path and not self._dirty:
+                return
+            header = _HEADER.pack(NEAR_DUP_MAGIC, self.capacity, self._head, self._count,
+                                  self.tag.encode("ascii")[:16])
+            columns = [array(column.typecode, column) if isinstance(column, array) else bytes(column)
+                       for column in self._columns() + [self._heads]]
+            self._dirty = False
+            self._saved_at = time.time()
+        tmp = path + ".tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(header)
+                for column in columns:
+                    if isinstance(column, array) and sys.byteorder != "little":
+                        column.byteswap()
+                    f.write(column)
+            os.replace(tmp, path)
+        except OSError as e:
+            print("[NEAR_DUP] 索引寫回失敗:", e)
+
+    def _columns(self) -> list:
+        """依持久化順序排列的欄位。"""
+        return [self._sketches, self._sites, self._times, self._verdicts, self._confidence, self._keys, self._next]
+
+    def load(self, path: str, tag: str = "") -> int:
+        """讀回 save() 的檔案並記下之後寫回的路徑，回傳載入筆數。
+
+        檔案的規則版本與 tag 不同時不載入（舊規則的判斷不沿用）；容量不同時依新舊順序保留最新、未過期的條目並重建串列。
+        """
+        with self._lock:
+            self.path = path
+            self.tag = tag
+        if not os.path.exists(path):
+            return 0
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, capacity, head, count, saved_tag = _HEADER.unpack_from(data, 0)
+        if magic != NEAR_DUP_MAGIC:
+            raise ValueError(f"近似重複索引格式不符：{path}")
+        if saved_tag.rstrip(b"\0").decode("ascii") != tag:
+            print("[NEAR_DUP] 規則版本已變更，捨棄舊索引")
+            return 0
+
+        sizes = [(typecode, width * capacity) for typecode, width in _COLUMN_LAYOUT]
+        sizes.append(("I", 4 * BANDS << self._bucket_bits_for(capacity)))      # 桶頭
+        columns, start = [], _HEADER.size
+        for typecode, size in sizes:
+            chunk = data[start:start + size]
+            if len(chunk) != size:
+                raise ValueError(f"近似重複索引檔案不完整：{path}")
+            if typecode:
+                chunk = array(typecode, chunk)
+                if sys.byteorder != "little":
+                    chunk.byteswap()
+            columns.append(chunk)
+            start += size
+        sketches, sites, times, verdicts, confidence, keys, nxt, heads = columns
+
+        with self._lock:
+            self._reset()
+            if capacity == self.capacity:
+                self._sketches[:] = sketches
+                self._sites, self._times, self._next, self._heads = sites, times, nxt, heads
+                self._verdicts[:], self._confidence[:], self._keys[:] = verdicts, confidence, keys
+                self._head, self._count = head, count
+                return count
+
+            deadline = time.time() - self.ttl
+            order = [i % capacity for i in range(head, head + capacity)]      # 由舊到新
+            live = [i for i in order if verdicts[i] and times[i] > deadline][-self.capacity:]
+            n = len(live)
+            self._sketches[:SKETCH_BINS * n] = b"".join([sketches[i * SKETCH_BINS:(i + 1) * SKETCH_BINS] for i in live])
+            self._sites[:n] = array("Q", [sites[i] for i in live])
+            self._times[:n] = array("d", [times[i] for i in live])
+            self._verdicts[:n] = bytes([verdicts[i] for i in live])
+            self._confidence[:n] = bytes([confidence[i] for i in live])
+            self._keys[:16 * n] = b"".join([keys[16 * i:16 * i + 16] for i in live])
+            self._link_all(n)
+            self._count = n
+            self._head = n % self.capacity
+            return n
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": self._count,
+                "capacity": self.capacity,
+                "ttl": self.ttl,
+                "threshold": self.threshold,
+                "memory_mb": round(sum(len(column) * column.itemsize if isinstance(column, array) else len(column)
+                                       for column in (self._sketches, self._sites, self._times, self._verdicts,
+                                                      self._confidence, self._keys, self._heads, self._next)) / 2**20, 1),
+                "path": self.path,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / (lookups or 1), 4),
+            }
+
+
+NEAR_DUP_INDEX = NearDupIndex()
+
+
+def load_near_duplicates(tag: str, path: str = NEAR_DUP_DB):
+    """啟動時載入持久化的索引（NEAR_DUP_DB 有設定時），並在結束時寫回。"""
+    if not path:
+        return
+    try:
+        count = NEAR_DUP_INDEX.load(path, tag)
+    except (OSError, ValueError, struct.error) as e:
+        print("[NEAR_DUP] 索引載入失敗，從空索引開始:", e)
+        count = 0
+    # /analyze_batch 的 spawn 子行程也會匯入 server；只有主行程在結束時寫回，子行程的舊副本不能蓋掉檔案
+    if multiprocessing.parent_process() is None:
+        atexit.register(NEAR_DUP_INDEX.save)
+    print(f"[NEAR_DUP] 已載入近似重複索引 {count} 筆（{path}）")
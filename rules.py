@@ -0,0 +1,418 @@
+# rules.py — 分析的 CPU 階段：工具證據、網域分類與規則評分（prepare_analysis）
+# 不載入 LLM 客戶端、快取或名單，/analyze_batch 的子行程只需匯入這個模組；分層判斷與 LLM 在 analyzer
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+
+from brand_index import brand_lookalike, brand_official
+from domain_age import NEW_DOMAIN_DAYS, domain_age_days
+from domain_classifier import PUBLIC_SUFFIX_RULES, DomainClassifier
+from feature_cache import cached_feature
+from html_utils import ParsedPage
+from text_utils import KeywordMatcher
+from tools import (
+    check_url_safety,
+    analyze_domain_age,
+    check_url_patterns,
+    extract_contact_info,
+    detect_language_anomaly,
+)
+
+# ------------------ TOOL REGISTRY & CONFIG ------------------
+# 值是 LangChain StructuredTool；它本身不能直接呼叫（先前的 "'StructuredTool' object is not callable"），
+# 執行時一律走 .func，不經過 callback 與參數驗證的額外成本
+TOOL_REGISTRY = {
+    t.name: t for t in (check_url_safety, analyze_domain_age, check_url_patterns, extract_contact_info, detect_language_anomaly)
+}
+# 不必等 planner、每次都執行的便宜工具（逗號分隔；設成空字串則只跑 planner 選的）
+ALWAYS_ON_TOOLS = [t for t in os.environ.get("TOOL_ALWAYS_ON", ",".join(TOOL_REGISTRY)).split(",") if t in TOOL_REGISTRY]
+# planner 要多一次 LLM 往返，預設關閉；開啟後同樣受 TOOL_STAGE_BUDGET_MS 限制，來不及就只用 always-on 的結果
+TOOL_PLANNER_ENABLED = os.environ.get("TOOL_PLANNER", "0") == "1"
+# 整個工具階段最多增加的延遲，以及單一工具的上限（毫秒）
+TOOL_STAGE_BUDGET_MS = int(os.environ.get("TOOL_STAGE_BUDGET_MS", 300))
+TOOL_TIMEOUT_MS = int(os.environ.get("TOOL_TIMEOUT_MS", 200))
+TOOL_WORKERS = int(os.environ.get("TOOL_WORKERS", 8))
+# 以網址為參數的工具：頁面沒有網址時不必預設執行
+URL_TOOLS = {"check_url_safety", "analyze_domain_age", "check_url_patterns"}
+# 交給文字類工具的內文上限（字元）
+TOOL_TEXT_LIMIT = 20000
+# 交給 LLM 的可見文字上限（字元）；規則關鍵字也只掃這一段，長頁面後段零散的「帳號」「必須」不會湊出 hard_flag
+LLM_TEXT_LIMIT = int(os.environ.get("LLM_TEXT_LIMIT", 3000))
+TOOL_EXECUTOR = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="tool")
+# 逾時後仍在背景跑完的工具最多佔幾個執行緒；達到上限時新的工具直接記為略過，
+# 不必排隊等到 TOOL_STAGE_BUDGET_MS 才拿到逾時結果
+TOOL_MAX_STRAGGLERS = int(os.environ.get("TOOL_MAX_STRAGGLERS", max(TOOL_WORKERS // 2, 1)))
+_STRAGGLERS = 0
+_STRAGGLERS_LOCK = threading.Lock()
+
+# 工具結果計分：工具名 → (權重, 代表「有可疑特徵」的結果開頭)；同一個工具不論跑幾次只加一次
+TOOL_EVIDENCE_RULES = {
+    "check_url_safety": (2, ("URL 分析結果",)),
+    "analyze_domain_age": (1, ("域名分析結果", "域名格式不完整")),
+    "check_url_patterns": (1, ("批量 URL 分析結果",)),
+    "detect_language_anomaly": (2, ("語言異常",)),
+}
+# 只在已有其他可疑訊號時才加分的工具結果：大多數正常頁面的內文也沒有 email / 電話，單獨出現不代表可疑
+CORROBORATING_EVIDENCE_RULES = {
+    "extract_contact_info": (1, ("未找到聯絡資訊",)),
+}
+
+# 兩份名單與公共後綴規則編成同一棵 trie（domain_classifier），分類結果快取在 FEATURE_CACHE；
+# 名單用 frozenset，要修改就整個換掉（rules.SAFE_DOMAINS = frozenset(...)），trie 與快取會自動跟著更新
+SAFE_DOMAINS = frozenset({"google.com", "google.com.tw", "microsoft.com", "facebook.com", "github.com", "gov.tw", "edu.tw"})
+SUSPICIOUS_TLDS = frozenset({".xyz", ".top", ".loan", ".vip", ".click", ".buzz", ".shop", ".loan", ".info", ".ru", ".tk"})
+LOG_PATH = "planner_tool_log.jsonl"
+
+# rule_score 的關鍵字組：組名 → (每個命中的權重, 理由標籤, 關鍵字)
+# 全部編進同一個 KeywordMatcher，新增一組不會多掃一次內文；理由依此順序輸出
+RULE_KEYWORD_GROUPS = {
+    "auth": (3, "身份/驗證要求", ["驗證", "重新驗證", "帳號", "密碼", "登入", "解除限制", "確認身分", "身份驗證"]),
+    "money": (3, "金錢/付款相關", ["付款", "轉帳", "刷卡", "金額", "匯款", "銀行", "信用卡"]),
+    "urgent": (2, "緊急語氣", ["立即", "馬上", "盡快", "緊急", "限時", "逾期", "警告", "必須"]),
+    "click": (1, "要求點擊", ["點擊", "點此", "連結", "href"]),
+}
+RULE_KEYWORDS = KeywordMatcher({name: words for name, (_, _, words) in RULE_KEYWORD_GROUPS.items()})
+# brand_lookalike 的比對類型 → 理由文字
+BRAND_MATCH_LABELS = {"typo": "拼字相近", "homoglyph": "同形字", "embedded": "品牌名嵌入"}
+
+# ------------------ HELPERS ------------------
+def log_decision(record: dict):
+    try:
+        with open(LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except Exception:
+        pass
+
+@cached_feature("domain_of")
+def domain_of(url: str) -> str:
+    try:
+        return urlparse(url).netloc.lower()
+    except:
+        return ""
+
+_CLASSIFIER = (None, None)
+
+def domain_classifier() -> DomainClassifier:
+    """公共後綴 + SAFE_DOMAINS + SUSPICIOUS_TLDS 的 trie；名單被換掉時重建。"""
+    global _CLASSIFIER
+    lists, classifier = _CLASSIFIER
+    if lists is None or lists[0] is not SAFE_DOMAINS or lists[1] is not SUSPICIOUS_TLDS:
+        lists = (SAFE_DOMAINS, SUSPICIOUS_TLDS)
+        classifier = DomainClassifier(PUBLIC_SUFFIX_RULES, allow=SAFE_DOMAINS, deny=SUSPICIOUS_TLDS)
+        _CLASSIFIER = (lists, classifier)
+    return classifier
+
+@cached_feature("classify_domain", depends=lambda: (SAFE_DOMAINS, SUSPICIOUS_TLDS))
+def classify_domain(domain: str) -> dict:
+    """一次走訪取得 {host, registrable, suffix, tld, tld_class, allowlisted, ...}（見 DomainClassifier.classify）。"""
+    return domain_classifier().classify(domain)
+
+def is_suspicious_tld(domain: str) -> bool:
+    return classify_domain(domain)["tld_class"] == "suspicious"
+
+def contains_brand_typo(domain: str) -> bool:
+    # 品牌仿冒索引（brand_index）：打錯字、同形字、品牌名嵌入；官方網域本身不算
+    return brand_lookalike(domain) is not None
+
+def is_safe_domain(domain: str) -> bool:
+    # 以完整標籤比對：mail.google.com 安全，evilgoogle.com 不算
+    return classify_domain(domain)["allowlisted"]
+
+def is_trusted_domain(domain: str) -> bool:
+    """在允許名單內，或屬於受保護品牌本身（官方 / infra 網域、品牌名.國碼後綴）。
+
+    github.io、amazonaws.com 這類任何人都能放內容的平台，以及 paypal.top 這類泛用 TLD 上的品牌名都不算。
+    """
+    return is_safe_domain(domain) or brand_official(domain)
+
+# ------------------ PLANNER + TOOL INVOCATION ------------------
+ALLOWED_TOOLS = set(TOOL_REGISTRY.keys())
+
+def validate_plan(raw_plan: dict) -> list:
+    if not isinstance(raw_plan, dict):
+        return []
+    calls = raw_plan.get("calls")
+    if not isinstance(calls, list):
+        return []
+    valid_calls = []
+    for c in calls[:3]:
+        if not isinstance(c, dict):
+            continue
+        tool = c.get("tool")
+        args = c.get("args", {}) or {}
+        if tool not in ALLOWED_TOOLS:
+            continue
+        if not isinstance(args, dict):
+            continue
+        valid_calls.append({"tool": tool, "args": args})
+    return valid_calls
+
+def _first_suspect_url(urls: list) -> str:
+    """per-URL 工具預設檢查的網址：第一個不在安全名單的網址，沒有就用第一個。"""
+    for u in urls:
+        if not is_safe_domain(domain_of(u)):
+            return u
+    return urls[0] if urls else ""
+
+def default_tool_args(tool: str, urls: list, visible: str) -> dict:
+    """planner 沒給（或給不完整）的參數由此補足。"""
+    if tool == "check_url_safety":
+        return {"url": _first_suspect_url(urls)}
+    if tool == "analyze_domain_age":
+        return {"domain": domain_of(_first_suspect_url(urls))}
+    if tool == "check_url_patterns":
+        return {"urls": urls[:20]}
+    return {"text": visible[:TOOL_TEXT_LIMIT]}
+
+def _run_tool(tool: str, args: dict):
+    t0 = time.perf_counter()
+    result = TOOL_REGISTRY[tool].func(**args)
+    return result, (time.perf_counter() - t0) * 1000
+
+def _straggler(future):
+    """逾時但已在執行、取消不了的工具：計入 _STRAGGLERS，跑完時扣回。"""
+    global _STRAGGLERS
+    with _STRAGGLERS_LOCK:
+        _STRAGGLERS += 1
+    future.add_done_callback(_straggler_done)
+
+def _straggler_done(_future):
+    global _STRAGGLERS
+    with _STRAGGLERS_LOCK:
+        _STRAGGLERS -= 1
+
+def collect_tool_evidence(urls: list, visible: str) -> dict:
+    """
+    並行執行工具檢查，回傳 {工具名: 結果字串}；失敗或逾時的工具為 {"error": ...}。
+
+    - ALWAYS_ON_TOOLS 立即送出；TOOL_PLANNER_ENABLED 時 planner 同時執行，選出的工具回來後再補送
+    - 每個工具最多等 TOOL_TIMEOUT_MS，整個階段最多 TOOL_STAGE_BUDGET_MS；時間到就用已完成的結果，
+      未完成的留在背景執行緒跑完後丟棄，不會拖慢這次請求；這類工具佔住的執行緒達 TOOL_MAX_STRAGGLERS 時，
+      新的工具不送出，直接記為略過
+    - 同一個工具以不同參數重跑時（planner 指定了別的網址），以 "工具名:參數" 為 key
+    - 結果依 TOOL_REGISTRY 的順序排列（同一工具依送出順序），不隨完成順序改變：LLM prompt 與快取內容每次相同
+    """
+    stage_start = time.perf_counter()
+    stage_deadline = stage_start + TOOL_STAGE_BUDGET_MS / 1000
+    evidence = {}
+    timings = {}
+    pending = {}      # future → (key, 工具截止時間)；key 為 None 代表 planner
+    scheduled = {}    # key → args
+
+    def submit(tool, args):
+        args = {k: v for k, v in args.items() if k in TOOL_REGISTRY[tool].args}
+        args = {**default_tool_args(tool, urls, visible), **args}
+        key = tool
+        if key in scheduled:
+            if scheduled[key] == args:
+                return
+            key = f"{tool}:{next(iter(args.values()), '')}"
+            if key in scheduled:
+                return
+        scheduled[key] = args
+        if _STRAGGLERS >= TOOL_MAX_STRAGGLERS:
+            evidence[key] = {"error": "工具執行緒忙碌，略過"}
+            return
+        deadline = min(time.perf_counter() + TOOL_TIMEOUT_MS / 1000, stage_deadline)
+        pending[TOOL_EXECUTOR.submit(_run_tool, tool, args)] = (key, deadline)
+
+    if TOOL_PLANNER_ENABLED:
+        # planner 要呼叫 LLM：開啟時才載入 analyzer（批次的子行程預設不會用到）
+        from analyzer import plan_tool_calls
+        pending[TOOL_EXECUTOR.submit(plan_tool_calls, urls, visible)] = (None, stage_deadline)
+    for tool in ALWAYS_ON_TOOLS:
+        if urls or tool not in URL_TOOLS:
+            submit(tool, {})
+
+    planner_calls = None
+    while pending:
+        now = time.perf_counter()
+        for future, (key, deadline) in list(pending.items()):
+            if deadline <= now and not future.done():
+                if not future.cancel():
+                    _straggler(future)
+                del pending[future]
+                if key is None:
+                    planner_calls = {"error": "逾時未完成"}
+                else:
+                    evidence[key] = {"error": "逾時未完成"}
+        if not pending:
+            break
+        timeout = min(deadline for _, deadline in pending.values()) - now
+        done, _ = wait(list(pending), timeout=max(timeout, 0), return_when=FIRST_COMPLETED)
+        for future in done:
+            key, _ = pending.pop(future)
+            try:
+                if key is None:
+                    planner_calls = future.result()
+                    for call in planner_calls:
+                        submit(call["tool"], call["args"])
+                else:
+                    evidence[key], timings[key] = future.result()
+            except Exception as e:
+                if key is None:
+                    planner_calls = {"error": str(e)}
+                else:
+                    evidence[key] = {"error": str(e)}
+
+    order = {tool: i for i, tool in enumerate(TOOL_REGISTRY)}
+    evidence = {key: evidence[key] for key in sorted(scheduled, key=lambda k: order[k.partition(":")[0]])
+                if key in evidence}
+    log_decision({
+        "time": datetime.datetime.utcnow().isoformat(),
+        "phase": "evidence",
+        "visible_snippet": visible[:300],
+        "urls": urls[:3],
+        "planner_calls": planner_calls,
+        "evidence": evidence,
+        "tool_ms": {k: round(v, 2) for k, v in timings.items()},
+        "stage_ms": round((time.perf_counter() - stage_start) * 1000, 2),
+    })
+    return evidence
+
+# ------------------ RULE-BASED SCORING ------------------
+def rule_score(visible: str, urls: list, evidence: dict, page: ParsedPage = None) -> dict:
+    """
+    Compute rule-based risk score and reasons.
+    page: 已解析的頁面（可選），JS 檢測會改用其中的 script 內容
+    Returns: {"score": int, "reasons": [...], "hard_flag": bool, "keyword_hits": int, "gross_score": int,
+              "password_inputs": int, "offsite_forms": int}
+    """
+    score = 0
+    reasons = []
+    hard_flag = False
+
+    # keyword groups：一次掃描取得各組命中的不同關鍵字數（只看 LLM 也看得到的前 LLM_TEXT_LIMIT 字）
+    counts = RULE_KEYWORDS.counts(visible[:LLM_TEXT_LIMIT])
+    cnt_urgent = counts["urgent"]
+    cnt_auth = counts["auth"]
+
+    # weight and reasons
+    for name, (weight, label, _) in RULE_KEYWORD_GROUPS.items():
+        if counts[name]:
+            score += counts[name] * weight
+            reasons.append(f"{label} x{counts[name]}")
+
+    # URL based checks
+    young_domains = set()
+    allowlist_discount = 0
+    for u in urls:
+        d = domain_of(u)
+        if not d:
+            continue
+        # 優先採用安全規則：如果是安全域名，跳過可疑檢查
+        if is_safe_domain(d):
+            reasons.append(f"安全域名：{d}")
+            # 對安全域名減分（降低風險）
+            score -= 1
+            allowlist_discount += 1
+        else:
+            # 只在非安全域名時才檢查可疑特徵
+            lookalike = brand_lookalike(d)
+            if lookalike:
+                score += 4
+                reasons.append(f"疑似仿冒品牌 {lookalike[0]}（{BRAND_MATCH_LABELS[lookalike[1]]}）：{d}")
+            elif is_suspicious_tld(d) or any(x in d for x in ["verify", "secure", "account", "login", "update", "reset"]):
+                score += 4
+                reasons.append(f"疑似可疑域名：{d}")
+            # very high risk for credential phishing patterns
+            if any(x in d for x in ["-secure-", "login-", "verify-", "account-"]):
+                score += 5
+                reasons.append(f"域名含 phishing pattern：{d}")
+            # 註冊日期查本地網域年齡資料庫；同一網域只加一次
+            age = domain_age_days(d)
+            if age is not None and age < NEW_DOMAIN_DAYS and d not in young_domains:
+                young_domains.add(d)
+                score += 3
+                reasons.append(f"{d}：網域年齡小於90天（{age} 天）")
+
+    # Evidence-based bumps (tools)
+    flagged_tools = set()
+    corroborating = []
+    for k, v in evidence.items():
+        tool = k.partition(":")[0]
+        if tool in CORROBORATING_EVIDENCE_RULES:
+            weight, flagged = CORROBORATING_EVIDENCE_RULES[tool]
+            if isinstance(v, str) and v.startswith(flagged) and tool not in flagged_tools:
+                flagged_tools.add(tool)
+                corroborating.append((weight, k))
+            continue
+        if tool in TOOL_EVIDENCE_RULES:
+            weight, flagged = TOOL_EVIDENCE_RULES[tool]
+            if isinstance(v, str) and v.startswith(flagged) and tool not in flagged_tools:
+                flagged_tools.add(tool)
+                score += weight
+                reasons.append(f"工具 {k} 標記可疑")
+            continue
+        sv = str(v).lower()
+        if "suspicious" in sv or "phish" in sv or "malicious" in sv or "blacklist" in sv:
+            score += 4
+            reasons.append(f"工具 {k} 標記可疑")
+
+    # JS 混淆檢測
+    from tools import detect_suspicious_js
+    js_result = detect_suspicious_js(page if page is not None else visible)
+    if js_result["has_suspicious_js"]:
+        if js_result["severity"] == "high":
+            score += 5
+        elif js_result["severity"] == "medium":
+            score += 3
+        elif js_result["severity"] == "low":
+            score += 1
+        reasons.append(f"檢測到可疑 JavaScript：{'; '.join(js_result['findings'])}")
+
+    # 佐證型工具結果：允許名單減分前已有分數（其他訊號）才加分
+    if score + allowlist_discount > 0:
+        for weight, k in corroborating:
+            score += weight
+            reasons.append(f"工具 {k} 標記可疑")
+
+    # Hard rules: if both auth + urgent present -> high risk regardless
+    if cnt_auth >= 1 and cnt_urgent >= 1:
+        hard_flag = True
+        reasons.append("同時出現身份驗證要求與緊急語氣（強制標記）")
+
+    # clamp and return；keyword_hits、gross_score（允許名單減分前的分數）與表單欄位給 rule_tier_verdict 用
+    return {"score": max(score, 0), "reasons": reasons, "hard_flag": hard_flag,
+            "keyword_hits": sum(counts.values()), "gross_score": max(score + allowlist_discount, 0),
+            "password_inputs": page.password_inputs if page is not None else 0,
+            "offsite_forms": len(page.offsite_form_actions) if page is not None else 0}
+
+
+def page_code_digest(page: ParsedPage) -> str:
+    """script、事件處理程式與表單欄位的摘要。
+
+    rule_score 的 JS 檢測與分層判斷的表單條件都看這些，可見文字與網址相同、程式碼不同的頁面不能共用快取結果。
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for group in (page.scripts, page.event_handlers, page.form_actions, [str(page.password_inputs)]):
+        for part in group:
+            h.update(part.encode("utf-8", "surrogatepass"))
+            h.update(b"\0")
+        h.update(b"\1")
+    return h.hexdigest()
+
+
+def prepare_analysis(html_text) -> dict:
+    """CPU 階段：解析 HTML、收集工具證據、計算規則分數。
+
+    回傳只含基本型別的 dict（visible、urls、evidence、rule、page_urls、code），可以在子行程執行後傳回（/analyze_batch）。
+    urls 是 ParsedPage.analysis_urls（每個可註冊網域一個、有上限）；page_urls 是頁面上的全部網址，給黑名單檢查用；
+    code 是 page_code_digest，算進結果快取的指紋。
+    """
+    page = html_text if isinstance(html_text, ParsedPage) else ParsedPage(html_text)
+    visible = page.visible_text
+    urls = page.analysis_urls
+
+    # Collect evidence
+    evidence = collect_tool_evidence(urls, visible)
+
+    # Compute rule score
+    r = rule_score(visible, urls, evidence, page)
+    return {"visible": visible, "urls": urls, "evidence": evidence, "rule": r, "page_urls": page.urls,
+            "code": page_code_digest(page)}
@@ -1,22 +1,30 @@
 # server.py
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import time
 import datetime
+import json
 import os
 
-from html_utils import extract_relevant_html, extract_urls
+from html_utils import ParsedPage, _normalize_url
 from blacklist import (
     load_blacklist,
-    is_blacklisted,
-    check_blacklist_source,
+    lookup_blacklist,
     add_to_user_blacklist,
     delete_from_user_blacklist,
     get_user_blacklist,
-    clear_user_blacklist
+    clear_user_blacklist,
+    ingest_feed,
+    blacklist_stats
 )
-from analyzer import analyze_deep
+from analyzer import ANALYSIS_MODE, ANALYSIS_MODES, analyze_deep, analyze_stages, cached_verdict, ruleset_version
+from batch_pipeline import analyze_batch
+from domain_age import load_domain_ages
+from feature_cache import FEATURE_CACHE
+from llm_pool import LLM_POOL
+from near_dup import NEAR_DUP_INDEX, load_near_duplicates
+from verdict_cache import VERDICT_CACHE
 
 app = Flask(__name__)
 CORS(app)
@@ -31,15 +39,52 @@ TASKS = {}
 TASKS_LOCK = Lock()
 EXECUTOR = ThreadPoolExecutor(max_workers=2)
 
-if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
-    load_blacklist("phishtank.csv")
+# /check_urls：單次請求上限，以及超過多少筆改用 NDJSON 串流回傳
+CHECK_URLS_MAX = 50000
+CHECK_URLS_STREAM_THRESHOLD = 1000
+
+# /analyze、/analyze_async：單次接受的 HTML 上限（UTF-8 位元組），超過直接 413、不解析。
+# 每個請求都要完整掃描一次頁面（黑名單看全部網址、JS 檢測看全部 script），成本由這個上限決定
+ANALYZE_MAX_BYTES = int(os.environ.get("ANALYZE_MAX_BYTES", 2 * 1024 * 1024))
+# /analyze_batch：單次最多幾個頁面、整個請求的上限（位元組）
+BATCH_MAX_PAGES = int(os.environ.get("BATCH_MAX_PAGES", 500))
+BATCH_MAX_BYTES = int(os.environ.get("BATCH_MAX_BYTES", 64 * 1024 * 1024))
+
+_INITIALIZED = False
+_INIT_LOCK = Lock()
+
+
+def init():
+    """載入黑名單、網域註冊日期與近似重複索引；重複呼叫不會重載。
+
+    import server 本身不載入任何東西：/analyze_batch 的 spawn 子行程、reloader 的監看行程、
+    測試與 benchmark 都會 import 這個檔案，不該各自去重建快照或壓縮使用者黑名單日誌。
+    以 python server.py 啟動時由 __main__ 呼叫；用 WSGI 伺服器部署時需自行呼叫 server.init()。
+    """
+    global _INITIALIZED
+    with _INIT_LOCK:
+        if _INITIALIZED:
+            return
+        # 黑名單走 mmap 快照，載入只需數毫秒
+        load_blacklist("phishtank.csv")
+        # 網域註冊日期：WHOIS 匯出檔編譯成 mmap 資料庫（DOMAIN_AGE_DUMP，預設 domain_ages.csv）
+        load_domain_ages()
+        # 近似重複頁面索引：NEAR_DUP_DB 有設定時載入上次的索引（規則版本不同則捨棄）
+        load_near_duplicates(ruleset_version())
+        _INITIALIZED = True
 
 def log(title):
     print("\n==========", title, "==========")
 
 @app.route("/user_blacklist", methods=["GET"])
 def get_blacklist_route():
-    return jsonify({"success": True, "list": get_user_blacklist()})
+    """使用者黑名單；帶 ?limit=N 時分頁，下一頁以 ?cursor=<next_cursor> 取得。"""
+    limit = request.args.get("limit", type=int)
+    if limit is None:
+        return jsonify({"success": True, "list": get_user_blacklist()})
+    cursor = request.args.get("cursor", type=int)
+    page, next_cursor = get_user_blacklist(cursor, max(1, min(limit, 1000)))
+    return jsonify({"success": True, "list": page, "next_cursor": next_cursor})
 
 @app.route("/add_blacklist", methods=["POST"])
 def add_blacklist_route():
@@ -65,67 +110,310 @@ def handle_clear_blacklist():
         return jsonify({"success": True, "message": "使用者黑名單已全部清空"})
     else:
         return jsonify({"success": False, "message": "清空失敗，請檢查伺服器日誌"})
+@app.route("/admin/blacklist", methods=["GET"])
+def blacklist_stats_route():
+    """目前黑名單版本與筆數。"""
+    return jsonify({"success": True, **blacklist_stats()})
+
+@app.route("/admin/feature_cache", methods=["GET"])
+def feature_cache_stats_route():
+    """網址 / 網域特徵快取的筆數與各特徵命中率。"""
+    return jsonify({"success": True, **FEATURE_CACHE.stats()})
+
+@app.route("/admin/verdict_cache", methods=["GET"])
+def verdict_cache_stats_route():
+    """分析結果快取的筆數與命中率。"""
+    return jsonify({"success": True, **VERDICT_CACHE.stats()})
+
+@app.route("/admin/near_dup", methods=["GET"])
+def near_dup_stats_route():
+    """近似重複頁面索引的筆數與命中率。"""
+    return jsonify({"success": True, **NEAR_DUP_INDEX.stats()})
+
+@app.route("/admin/llm_pool", methods=["GET"])
+def llm_pool_stats_route():
+    """各 Ollama 端點的進行中請求、並行上限與排隊深度。"""
+    return jsonify({"success": True, **LLM_POOL.stats()})
+
+@app.route("/admin/blacklist/ingest", methods=["POST"])
+def blacklist_ingest_route():
+    """套用官方黑名單增量：{"added": [...], "removed": [...]}（皆為網址字串陣列，可省略）。
+
+    整份新 feed 的比對（ingest_feed 的 feed_path）只在伺服器端呼叫，不開放由請求指定檔案路徑。
+    """
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"success": False, "message": "body 必須是 JSON 物件"}), 400
+    lists = {}
+    for field in ("added", "removed"):
+        value = data.get(field) or []
+        if not isinstance(value, list) or not all(isinstance(u, str) for u in value):
+            return jsonify({"success": False, "message": f"{field} 必須是字串陣列"}), 400
+        lists[field] = value
+    try:
+        info = ingest_feed(added=lists["added"], removed=lists["removed"])
+    except Exception as e:
+        return jsonify({"success": False, "message": f"更新失敗：{e}"}), 500
+    return jsonify({"success": True, **info})
+
+@app.route("/check_urls", methods=["POST"])
+def check_urls_route():
+    """批次查詢網址信譽（只查黑名單，不走 LLM）。
+
+    body: {"urls": [...], "stream": true/false}
+    筆數超過 CHECK_URLS_STREAM_THRESHOLD 或 stream=true 時，以 NDJSON 逐筆回傳。
+    """
+    data = request.get_json(silent=True) or {}
+    urls = data.get("urls")
+    if not isinstance(urls, list):
+        return jsonify({"success": False, "message": "urls 必須是陣列"}), 400
+    if len(urls) > CHECK_URLS_MAX:
+        return jsonify({"success": False, "message": f"單次最多 {CHECK_URLS_MAX} 筆"}), 413
+
+    # 同一批常有重複網址：正規化結果相同者只查一次
+    seen = {}
+
+    def _check(raw):
+        norm = _normalize_url(raw) if isinstance(raw, str) else None
+        if norm not in seen:
+            seen[norm] = lookup_blacklist(norm) if norm else None
+        hit = seen[norm]
+        return {
+            "url": raw,
+            "normalized": norm,
+            "is_blacklisted": hit is not None,
+            "blacklist_source": hit[0] if hit else None,
+            "blacklist_match": hit[1] if hit else None,
+        }
+
+    stream = data.get("stream")
+    if stream is None:
+        stream = len(urls) > CHECK_URLS_STREAM_THRESHOLD
+    if stream:
+        def _generate():
+            for raw in urls:
+                yield json.dumps(_check(raw), ensure_ascii=False) + "\n"
+        return Response(_generate(), mimetype="application/x-ndjson")
+
+    t0 = time.time()
+    results = [_check(raw) for raw in urls]
+    return jsonify({
+        "success": True,
+        "results": results,
+        "hits": sum(1 for r in results if r["is_blacklisted"]),
+        "elapsed_time": round(time.time() - t0, 4),
+    })
+
+def _read_analyze_text():
+    """取出 /analyze 系列請求的 text 與分析模式 mode（省略時用 ANALYSIS_MODE）；
+    回傳 (text, mode, None) 或 (None, None, 400 / 413 回應)。"""
+    # JSON 跳脫（\"、\n）最多讓 body 膨脹約兩倍；明顯超量的請求連 JSON 都不解析
+    if (request.content_length or 0) > ANALYZE_MAX_BYTES * 2 + 1024:
+        return None, None, (jsonify({"success": False, "message": f"內容超過上限 {ANALYZE_MAX_BYTES} bytes"}), 413)
+    data = request.get_json(silent=True) or {}
+    text = data.get("text", "")
+    if not isinstance(text, str):
+        return None, None, (jsonify({"success": False, "message": "text 必須是字串"}), 400)
+    if len(text) > ANALYZE_MAX_BYTES or len(text.encode("utf-8")) > ANALYZE_MAX_BYTES:
+        return None, None, (jsonify({"success": False, "message": f"內容超過上限 {ANALYZE_MAX_BYTES} bytes"}), 413)
+    mode = data.get("mode") or ANALYSIS_MODE
+    if mode not in ANALYSIS_MODES:
+        return None, None, (jsonify({"success": False, "message": f"mode 必須是 {' / '.join(ANALYSIS_MODES)}"}), 400)
+    return text, mode, None
+
+def _blacklist_hit(urls: list):
+    """頁面前 50 個網址中第一個命中黑名單的 (url, source, match)，沒有時 None。"""
+    for u in urls[:50]:
+        hit = lookup_blacklist(u)
+        if hit:
+            return (u,) + tuple(hit)
+    return None
+
+def _blacklist_verdict(url: str, source: str, match: str, elapsed: float) -> dict:
+    return {
+        "is_potential_phishing": True,
+        "is_blacklisted": True,
+        "blacklist_source": source,   # ✅ official / user
+        "blacklist_match": match,     # exact / path / host / domain
+        "explanation": f"偵測到黑名單惡意網址：{url}",
+        "elapsed_time": elapsed,
+        "tier": "blacklist",
+    }
+
 @app.route("/analyze", methods=["POST"])
 def analyze_route():
     t0 = time.time()
-    data = request.json or {}
-    text = data.get("text", "")
+    text, mode, error = _read_analyze_text()
+    if error:
+        return error
 
     now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     log("收到分析請求")
     print(f"時間：{now}")
     print(f"IP  ：{request.remote_addr}")
     print(f"長度：{len(text)}")
+    print(f"模式：{mode}")
+
+    # 整個請求只解析一次 HTML，黑名單與深度分析共用
+    page = ParsedPage(text)
+    hit = _blacklist_hit(page.urls)
+    if hit:
+        u, source, match = hit
+        elapsed = round(time.time() - t0, 2)
+        log("黑名單命中 → 直接返回")
+        print(f"黑名單網址：{u}")
+        print(f"來源：{source}（{match}）")
+        print(f"耗時：{elapsed} 秒")
+
+        return jsonify(_blacklist_verdict(u, source, match, elapsed))
 
-    urls = extract_urls(text)
-    for u in urls:
-        if is_blacklisted(u):
-            source = check_blacklist_source(u)
-            elapsed = round(time.time() - t0, 2)
-            log("黑名單命中 → 直接返回")
-            print(f"黑名單網址：{u}")
-            print(f"來源：{source}")
-            print(f"耗時：{elapsed} 秒")
-
-            return jsonify({
-                "is_potential_phishing": True,
-                "is_blacklisted": True,
-                "blacklist_source": source,   # ✅ official / user
-                "explanation": f"偵測到黑名單惡意網址：{u}",
-                "elapsed_time": elapsed
-            })
-
-    cleaned = extract_relevant_html(text) if "<html" in text.lower() else text
-    result = analyze_deep(cleaned)
+    result = analyze_deep(page, mode=mode)
 
     #非黑名單也要固定回這兩欄，讓前端好判斷
     result["is_blacklisted"] = False
     result["blacklist_source"] = None
+    result["blacklist_match"] = None
 
     elapsed = round(result["elapsed_time"], 2)
-    log("分析完成（深度檢測）")
+    log("分析完成（快取命中）" if result.get("cached") else
+        "分析完成（規則判定）" if result.get("tier") == "rules" else "分析完成（深度檢測）")
     print(f"耗時：{elapsed} 秒")
     print(f"分析結果：{result['is_potential_phishing']}")
 
     return jsonify(result)
 
 
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route("/analyze_stream", methods=["POST"])
+def analyze_stream_route():
+    """以 Server-Sent Events 分段回傳分析進度，請求格式同 /analyze。
+
+    事件依序為 blacklist（是否命中黑名單）→ rules（規則分數、理由、證據與暫定結論）→ cot（推理過程片段，
+    fast 模式沒有）→ verdict（與 /analyze 相同的最終結果）；黑名單或快取命中時直接給 verdict。
+    JSON 判斷生成期間送 SSE 註解行，用戶端斷線時盡早發現；斷線即關閉分析的 generator，模型生成隨之中止。
+    """
+    t0 = time.time()
+    text, mode, error = _read_analyze_text()
+    if error:
+        return error
+    log("收到串流分析請求")
+    print(f"長度：{len(text)}")
+    print(f"模式：{mode}")
+
+    def _generate():
+        page = ParsedPage(text)
+        hit = _blacklist_hit(page.urls)
+        yield _sse("blacklist", {
+            "is_blacklisted": bool(hit),
+            "url": hit[0] if hit else None,
+            "blacklist_source": hit[1] if hit else None,
+            "blacklist_match": hit[2] if hit else None,
+            "elapsed_time": round(time.time() - t0, 4),
+        })
+        if hit:
+            yield _sse("verdict", _blacklist_verdict(*hit, round(time.time() - t0, 2)))
+            return
+        stages = analyze_stages(page, mode=mode, stream=True)
+        try:
+            for event, data in stages:
+                if event == "tick":
+                    yield ": generating\n\n"
+                    continue
+                if event == "verdict":
+                    data = dict(data, is_blacklisted=False, blacklist_source=None, blacklist_match=None)
+                elif event == "rules":
+                    data = dict(data, elapsed_time=round(time.time() - t0, 4))
+                yield _sse(event, data)
+        finally:
+            # 用戶端斷線時 WSGI 伺服器關閉這個 generator；立刻關閉分析，不等垃圾回收
+            stages.close()
+
+    return Response(_generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/analyze_batch", methods=["POST"])
+def analyze_batch_route():
+    """一次分析多個頁面（爬蟲用），以 NDJSON 依完成順序逐筆回傳。
+
+    body: {"pages": [{"id": ..., "text": "<html>"}, ...], "mode": "cot" | "fast"}；id 省略時為陣列索引。
+    每行 {"id": ..., "result": {...}}（格式同 /analyze）或 {"id": ..., "error": "..."}，
+    最後一行 {"done": true, "count": N, "elapsed_time": 秒}。解析與規則在行程池平行執行，LLM 階段重疊進行。
+    """
+    t0 = time.time()
+    if (request.content_length or 0) > BATCH_MAX_BYTES:
+        return jsonify({"success": False, "message": f"內容超過上限 {BATCH_MAX_BYTES} bytes"}), 413
+    data = request.get_json(silent=True) or {}
+    pages = data.get("pages")
+    if not isinstance(pages, list) or not all(isinstance(p, dict) for p in pages):
+        return jsonify({"success": False, "message": "pages 必須是物件陣列"}), 400
+    if len(pages) > BATCH_MAX_PAGES:
+        return jsonify({"success": False, "message": f"單次最多 {BATCH_MAX_PAGES} 頁"}), 413
+    mode = data.get("mode") or ANALYSIS_MODE
+    if mode not in ANALYSIS_MODES:
+        return jsonify({"success": False, "message": f"mode 必須是 {' / '.join(ANALYSIS_MODES)}"}), 400
+    items = []
+    for i, p in enumerate(pages):
+        text = p.get("text", "")
+        if not isinstance(text, str):
+            return jsonify({"success": False, "message": f"第 {i} 頁的 text 必須是字串"}), 400
+        if len(text) > ANALYZE_MAX_BYTES or len(text.encode("utf-8")) > ANALYZE_MAX_BYTES:
+            return jsonify({"success": False, "message": f"第 {i} 頁超過上限 {ANALYZE_MAX_BYTES} bytes"}), 413
+        items.append((p.get("id", i), text))
+    log("收到批次分析請求")
+    print(f"頁數：{len(items)}")
+    print(f"模式：{mode}")
+
+    def _screen(urls):
+        hit = _blacklist_hit(urls)
+        return _blacklist_verdict(*hit, round(time.time() - t0, 2)) if hit else None
+
+    def _generate():
+        count = 0
+        for page_id, result in analyze_batch(items, mode, screen=_screen):
+            count += 1
+            if "error" in result:
+                line = {"id": page_id, "error": result["error"]}
+            else:
+                if not result.get("is_blacklisted"):
+                    result = dict(result, is_blacklisted=False, blacklist_source=None, blacklist_match=None)
+                line = {"id": page_id, "result": result}
+            yield json.dumps(line, ensure_ascii=False) + "\n"
+        elapsed = round(time.time() - t0, 2)
+        log("批次分析完成")
+        print(f"頁數：{count}，耗時：{elapsed} 秒")
+        yield json.dumps({"done": True, "count": count, "elapsed_time": elapsed}) + "\n"
+
+    return Response(_generate(), mimetype="application/x-ndjson")
+
+
 @app.route("/analyze_async", methods=["POST"])
 def analyze_async_route():
     """Start analysis in background and return a task_id immediately.
 
     Frontend can poll `/analyze_result/<task_id>` to get status/result.
     """
-    data = request.json or {}
-    text = data.get("text", "")
+    text, mode, error = _read_analyze_text()
+    if error:
+        return error
 
     task_id = str(uuid.uuid4())
+    # 快取命中時直接完成，不必排進背景佇列
+    page = ParsedPage(text)
+    hit = cached_verdict(page, mode=mode)
+    if hit is not None:
+        with TASKS_LOCK:
+            TASKS[task_id] = {"status": "done", "result": hit}
+        return jsonify({"task_id": task_id, "status": "done", "result": hit})
+
     with TASKS_LOCK:
         TASKS[task_id] = {"status": "processing", "result": None}
 
-    def _run_and_store(tid, txt):
+    def _run_and_store(tid, page):
         try:
-            res = analyze_deep(txt)
+            res = analyze_deep(page, check_cache=False, mode=mode)
             with TASKS_LOCK:
                 TASKS[tid]["status"] = "done"
                 TASKS[tid]["result"] = res
@@ -134,7 +422,7 @@ def analyze_async_route():
                 TASKS[tid]["status"] = "error"
                 TASKS[tid]["result"] = {"error": str(e)}
 
-    EXECUTOR.submit(_run_and_store, task_id, text)
+    EXECUTOR.submit(_run_and_store, task_id, page)
     return jsonify({"task_id": task_id, "status": "processing"})
 
 
@@ -148,4 +436,8 @@ def analyze_result_route(task_id):
 
 if __name__ == "__main__":
     print("Flask 後端啟動中（Debug Mode）...")
+    # reloader 的父行程只監看檔案變動，真正服務請求的是 WERKZEUG_RUN_MAIN=true 的子行程；
+    # /analyze_batch 的 spawn 子行程以 __mp_main__ 執行這個檔案，不會走到這裡
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        init()
     app.run(host="127.0.0.1", port=5000, debug=True, use_reloader=True)
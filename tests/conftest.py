@@ -0,0 +1,5 @@
+# conftest.py — 測試從專案根目錄匯入模組（伺服器的模組都放在根目錄，不是套件）
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,137 @@
+# test_batch_pipeline.py — /analyze_batch：依完成順序回傳、同批重複頁面與跨批次的 cached 標記、spawn 子行程不載入名單
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import analyzer
+import batch_pipeline
+import blacklist
+import rules
+import server
+from near_dup import NearDupIndex
+from verdict_cache import VerdictCache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VERDICT = '{"is_potential_phishing": true, "risk_level": "high", "explanation": ["stub"], "confidence": 90, "reasoning": "stub"}'
+
+
+class StubChain:
+    """代替 fast 模式的 prompt | ChatOllama：gate 打開前呼叫停住，方便控制完成順序。"""
+
+    def __init__(self):
+        self.calls = 0
+        self.gate = threading.Event()
+        self.gate.set()
+        self._lock = threading.Lock()
+
+    def invoke(self, _inputs):
+        with self._lock:
+            self.calls += 1
+        self.gate.wait(5)
+        return type("Message", (), {"content": VERDICT})()
+
+
+def _page(text, link="https://shop.example.com/item"):
+    return f"<html><body><p>{text}</p><a href='{link}'>商品</a></body></html>"
+
+
+@pytest.fixture
+def llm(monkeypatch, tmp_path):
+    chain = StubChain()
+    monkeypatch.setattr(rules, "LOG_PATH", str(tmp_path / "log.jsonl"))
+    monkeypatch.setattr(analyzer, "VERDICT_CACHE", VerdictCache(max_size=64, ttl=60, db_path=""))
+    monkeypatch.setattr(analyzer, "NEAR_DUP_INDEX", NearDupIndex(capacity=64))
+    monkeypatch.setattr(analyzer, "TIERED_PIPELINE", False)       # 每頁都要走 LLM 階段
+    monkeypatch.setattr(analyzer, "build_fast_analysis_chain", lambda: chain)
+    monkeypatch.setattr(batch_pipeline, "BATCH_WORKERS", 0)
+    official = blacklist.BlacklistIndex()
+    official.add("https://phish-kit.top/login")
+    monkeypatch.setattr(blacklist, "OFFICIAL_BLACKLIST", official)
+    monkeypatch.setattr(blacklist, "USER_BLACKLIST", blacklist.BlacklistIndex())
+    return chain
+
+
+def _post(pages):
+    resp = server.app.test_client().post("/analyze_batch", json={"pages": pages, "mode": "fast"})
+    assert resp.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+    assert lines[-1]["done"] and lines[-1]["count"] == len(pages)
+    return lines[:-1]
+
+
+PAGES = [
+    {"id": "a", "text": _page("帳戶異常，請立即登入驗證")},
+    {"id": "a-copy", "text": _page("帳戶異常，請立即登入驗證")},        # 爬蟲重複抓到同一頁
+    {"id": "listed", "text": _page("限時優惠", "https://phish-kit.top/login")},
+    {"text": _page("本週新品上架")},                                  # 省略 id 時為陣列索引
+]
+
+
+def test_batch_order_and_cached_flags(llm):
+    llm.gate.clear()
+    order = []
+    # LLM 停住時，黑名單命中的頁面不必等，先回傳
+    thread = threading.Thread(target=lambda: order.extend(_post(PAGES)))
+    thread.start()
+    thread.join(0.5)
+    llm.gate.set()
+    thread.join(5)
+    results = {line["id"]: line["result"] for line in order}
+    ids = [line["id"] for line in order]
+    assert sorted(ids, key=str) == sorted(["a", "a-copy", "listed", 3], key=str)
+    assert ids[0] == "listed" and ids.index("a-copy") == ids.index("a") + 1
+    assert results["listed"]["is_blacklisted"] and results["listed"]["tier"] == "blacklist"
+    assert (results["a"]["cached"], results["a"]["tier"]) == (False, "llm")
+    assert (results["a-copy"]["cached"], results["a-copy"]["tier"]) == (True, "cache")
+    assert results[3]["cached"] is False and not results[3]["is_blacklisted"]
+    assert llm.calls == 2
+
+    # 同一批再送一次：LLM 頁面全部由結果快取回答，不再呼叫模型
+    again = {line["id"]: line["result"] for line in _post(PAGES)}
+    assert all(again[i]["cached"] and again[i]["tier"] == "cache" for i in ("a", "a-copy", 3))
+    assert again["listed"]["tier"] == "blacklist" and llm.calls == 2
+
+
+PROBE = ("(__import__('sys').modules['__mp_main__'].__file__,"
+         " __import__('sys').modules['__mp_main__']._INITIALIZED,"
+         " type(__import__('blacklist').OFFICIAL_BLACKLIST).__name__,"
+         " len(__import__('blacklist').OFFICIAL_BLACKLIST))")
+
+SCRIPT = f"""
+import json, runpy, sys
+import flask
+sys.path.insert(0, {ROOT!r})
+
+def run(app, **kwargs):
+    import batch_pipeline, blacklist
+    main = sys.modules["__main__"]
+    pages = [{{"id": "listed", "text": "<a href='https://phish-kit.top/login'>x</a>"}}]
+    lines = app.test_client().post("/analyze_batch", json={{"pages": pages}}).get_data(as_text=True).splitlines()
+    # 批次用過的同一個 spawn 子行程：回報它的 __mp_main__ 與名單狀態
+    child = batch_pipeline.cpu_pool().submit(eval, {PROBE!r}).result()
+    batch_pipeline.cpu_pool().shutdown()
+    print(json.dumps({{"parent": [main._INITIALIZED, len(blacklist.OFFICIAL_BLACKLIST)],
+                      "child": child, "result": json.loads(lines[0])["result"]}}))
+
+flask.Flask.run = run
+runpy.run_path({os.path.join(ROOT, "server.py")!r}, run_name="__main__")
+"""
+
+
+def test_spawn_workers_skip_server_setup(tmp_path):
+    # 以 python server.py（reloader 子行程）啟動：父行程載入名單，批次的 spawn 子行程以 __mp_main__ 執行 server.py 但不載入
+    (tmp_path / "phishtank.csv").write_text("url\nhttps://phish-kit.top/login\nhttps://evil.org/\n", encoding="utf-8")
+    env = dict(os.environ, WERKZEUG_RUN_MAIN="true", BATCH_WORKERS="1")
+    out = subprocess.run([sys.executable, "-c", SCRIPT], cwd=tmp_path, env=env,
+                         capture_output=True, text=True, timeout=120)
+    assert out.returncode == 0, out.stderr
+    report = json.loads(out.stdout.strip().splitlines()[-1])
+    assert report["parent"] == [True, 2]
+    assert report["result"]["is_blacklisted"] and report["result"]["blacklist_match"] == "exact"
+    main_file, initialized, index_type, entries = report["child"]
+    assert os.path.samefile(main_file, os.path.join(ROOT, "server.py"))
+    assert (initialized, index_type, entries) == (False, "BlacklistIndex", 0)
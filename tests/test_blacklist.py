@@ -0,0 +1,210 @@
+# test_blacklist.py — 官方黑名單：索引的命中粒度、二進位快照與 Bloom filter、PhishTank 增量熱更新
+import csv
+import random
+import zlib
+
+import pytest
+
+import blacklist
+from blacklist import (BlacklistIndex, BloomFilter, SharedSnapshot, SnapshotIndex, bloom_path_for,
+                       compile_snapshot, ingest_feed, read_csv_urls, write_snapshot)
+
+
+def _write_csv(path, urls):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["url"])
+        writer.writerows([u] for u in urls)
+
+
+@pytest.fixture
+def index():
+    idx = BlacklistIndex()
+    for url in ("https://phish.example.com/login", "http://kit.net/a/b",
+                "evil.com", "login.portal.org", "https://google.com/url?q=https://evil.top"):
+        idx.add(url)
+    return idx
+
+
+@pytest.mark.parametrize("url, level", [
+    ("https://phish.example.com/login", "exact"),
+    ("HTTP://PHISH.example.com:80/login#top", "exact"),
+    ("https://phish.example.com/login/step2", "path"),
+    ("http://kit.net/a/b/c/d", "path"),
+    ("http://kit.net/a/b?x=1", "path"),
+    ("https://evil.com/anything?x=1", "host"),
+    ("https://login.portal.org/", "host"),
+    ("https://www.evil.com/", "domain"),
+    ("https://a.b.evil.com/x", "domain"),
+    ("https://google.com/url?q=https://evil.top", "exact"),
+])
+def test_match_levels(index, url, level):
+    assert index.lookup(url) == level
+
+
+@pytest.mark.parametrize("url", [
+    "https://phish.example.com/loginx",     # 路徑前綴以「/」為界
+    "https://phish.example.com/",           # 路徑條目不蓋住整個主機
+    "http://kit.net/a",
+    "https://notevil.com/",                 # 網域以標籤為界
+    "https://evil.com.attacker.net/",
+    "https://www.login.portal.org/",        # 子網域條目不延伸到更深的子網域
+    "https://portal.org/",
+    "https://google.com/url?q=https://ok.tw",  # 帶 query 的條目只做精確比對
+    "https://google.com/url",
+    "",
+])
+def test_match_misses(index, url):
+    assert index.lookup(url) is None
+
+
+def test_discard_keeps_key_shared_by_other_entry(index):
+    index.add("https://EVIL.com")     # 與 evil.com 同一個鍵
+    index.discard("evil.com")
+    assert index.lookup("www.evil.com") == "domain"
+    index.discard("https://EVIL.com")
+    assert index.lookup("www.evil.com") is None and index.lookup("evil.com") is None
+
+
+def _random_urls(n, seed=7):
+    rng = random.Random(seed)
+
+    def label():
+        return "".join(rng.choice("abcdefghijklmnopqrstuvwxyz0123456789") for _ in range(rng.randint(3, 12)))
+
+    urls = []
+    for _ in range(n):
+        host = ".".join(label() for _ in range(rng.randint(1, 3))) + rng.choice([".com", ".net", ".com.tw", ".co.uk", ".xyz"])
+        path = "".join("/" + label() for _ in range(rng.randint(0, 3)))
+        query = f"?id={rng.randint(0, 999)}" if rng.random() < 0.2 else ""
+        urls.append(f"{rng.choice(['http', 'https'])}://{host}{path}{query}")
+    return urls
+
+
+def _probes(urls, seed=11):
+    """每筆條目本身、延伸路徑、子網域、根路徑，以及不相干的網址。"""
+    rng = random.Random(seed)
+    probes = []
+    for url in urls:
+        probes += [url, url.split("?")[0] + "/more", url.replace("://", "://www.", 1), url.split("?")[0].rsplit("/", 1)[0]]
+    return probes + [u.replace(".", "-miss.", 1) for u in rng.sample(urls, min(len(urls), 200))]
+
+
+@pytest.mark.parametrize("fp_rate", [0.0, 0.01])
+def test_snapshot_round_trip_matches_memory_index(tmp_path, fp_rate):
+    urls = _random_urls(2000) + ["evil.com", "login.portal.org", "http://kit.net/a/b", "https://dup.com/x", "HTTPS://DUP.com:443/x/"]
+    memory = BlacklistIndex()
+    for url in urls:
+        memory.add(url)
+    snap_path = str(tmp_path / "list.snap")
+    count = write_snapshot(urls, snap_path, fp_rate, version=5)
+    snap = SnapshotIndex(snap_path, bloom_path_for(snap_path) if fp_rate else None)
+    try:
+        assert count == len(snap) == len(memory) and snap.version == 5
+        assert (snap.bloom is not None) == bool(fp_rate)
+        for key, flags in memory.items():
+            assert snap._flags(key) == flags
+        for probe in _probes(urls):
+            assert snap.lookup(probe) == memory.lookup(probe), probe
+    finally:
+        snap.close()
+
+
+def test_empty_snapshot(tmp_path):
+    snap_path = str(tmp_path / "empty.snap")
+    assert write_snapshot([], snap_path) == 0
+    snap = SnapshotIndex(snap_path)
+    assert len(snap) == 0 and snap.lookup("https://evil.com") is None
+    snap.close()
+
+
+def test_bloom_filter_has_no_false_negatives(tmp_path):
+    keys = [f"com.site{i}/path/{i}".encode("utf-8") for i in range(20000)]
+    path = str(tmp_path / "keys.bloom")
+    BloomFilter.write(((zlib.crc32(k), k) for k in keys), len(keys), path, fp_rate=0.01, version=3)
+    bloom = BloomFilter(path)
+    try:
+        assert (bloom.count, bloom.version) == (len(keys), 3)
+        assert all(bloom.might_contain(k, zlib.crc32(k)) for k in keys)
+        misses = [f"org.other{i}/".encode("utf-8") for i in range(20000)]
+        false_positives = sum(bloom.might_contain(k, zlib.crc32(k)) for k in misses)
+        assert false_positives < len(misses) * 0.03
+    finally:
+        bloom.close()
+
+
+def test_snapshot_ignores_bloom_of_other_version(tmp_path):
+    snap_path = str(tmp_path / "list.snap")
+    write_snapshot(["evil.com"], snap_path, 0.01, version=1)
+    write_snapshot(["other.com"], snap_path, version=2)     # 只換快照、留下舊版 filter
+    snap = SnapshotIndex(snap_path, bloom_path_for(snap_path))
+    try:
+        assert snap.bloom is None and snap.lookup("other.com") == "host"
+    finally:
+        snap.close()
+
+
+@pytest.fixture
+def official(monkeypatch, tmp_path):
+    """以暫存 CSV 建好快照，換成模組的官方名單；回傳 SharedSnapshot。"""
+    csv_path = str(tmp_path / "feed.csv")
+    snap_path = str(tmp_path / "feed.snap")
+    _write_csv(csv_path, ["http://example.com", "https://evil.org/login", "phish.net/a?x=1"])
+    compile_snapshot(csv_path, snap_path)
+    shared = SharedSnapshot(snap_path, sync_interval=0)
+    shared.refresh(force=True)
+    monkeypatch.setattr(blacklist, "OFFICIAL_CSV", csv_path)
+    monkeypatch.setattr(blacklist, "OFFICIAL_BLACKLIST", shared)
+    monkeypatch.setattr(blacklist, "BLOOM_FP_RATE", 0.0)
+    yield shared
+    if shared._index is not None:
+        shared._index.close()
+
+
+def test_ingest_feed_adds_and_removes(official):
+    assert official.version == 1 and official.lookup("https://evil.org/login") == "exact"
+    info = ingest_feed(added=["new-kit.top/signin", "new-kit.top/signin", ""], removed=["https://evil.org/login"])
+    assert info == {"version": 2, "added": 1, "removed": 1, "entries": 3}
+    assert official.lookup("http://new-kit.top/signin/step") == "path"
+    assert official.lookup("https://evil.org/login") is None
+    assert list(read_csv_urls(blacklist.OFFICIAL_CSV)) == ["http://example.com", "phish.net/a?x=1", "new-kit.top/signin"]
+
+
+def test_ingest_feed_matches_removals_by_canonical_url(official):
+    info = ingest_feed(removed=["HTTP://Example.com/", "https://EVIL.org:443/login/"])
+    assert info["removed"] == 2 and info["version"] == 2
+    assert official.lookup("http://example.com") is None
+    assert official.lookup("https://evil.org/login") is None
+
+
+def test_ingest_feed_diffs_whole_feed(official, tmp_path):
+    feed = str(tmp_path / "new.csv")
+    _write_csv(feed, ["HTTP://EXAMPLE.COM/", "phish.net/a?x=1", "fresh.xyz"])
+    info = ingest_feed(feed_path=feed)
+    assert (info["added"], info["removed"]) == (1, 1)
+    assert official.lookup("https://evil.org/login") is None
+    assert official.lookup("http://fresh.xyz/") == "host"
+    assert official.lookup("http://example.com/") == "host"
+
+
+def test_ingest_without_changes_keeps_version(official):
+    # 已存在的網址換個寫法再加一次不算新增
+    info = ingest_feed(added=["HTTP://EXAMPLE.com:80/"], removed=["http://not-listed.com"])
+    assert (info["version"], info["added"], info["removed"]) == (1, 0, 0)
+
+
+def test_windows_swap_keeps_answering_lookups(official, monkeypatch):
+    # Windows 要先關掉舊 mmap 才能替換檔案：換版期間查詢改由新內容的記憶體索引回答
+    seen = []
+    write_snapshot = blacklist.write_snapshot
+
+    def checking_write(urls, snap_path, *args):
+        seen.append((official.lookup("https://evil.org/login"), official.lookup("http://late.top/x"), official.version))
+        return write_snapshot(urls, snap_path, *args)
+
+    with monkeypatch.context() as m:
+        m.setattr(blacklist.os, "name", "nt")
+        m.setattr(blacklist, "write_snapshot", checking_write)
+        ingest_feed(added=["late.top/x"])
+    assert seen == [("exact", "exact", 2)]
+    assert isinstance(official._index, blacklist.SnapshotIndex) and official.version == 2
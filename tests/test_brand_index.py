@@ -0,0 +1,86 @@
+# test_brand_index.py — 品牌仿冒索引：官方 / infra 網域不誤判，仿冒主機仍偵出
+import pytest
+
+import brand_index
+from domain_classifier import PUBLIC_SUFFIX_RULES, DomainClassifier
+from brand_index import BRAND_INDEX, BrandIndex, DEFAULT_BRANDS, brand_official
+
+
+@pytest.mark.parametrize("host", [
+    # 品牌自有的基礎設施網域，與使用者內容平台本身
+    "googleapis.com", "fonts.googleapis.com", "googleusercontent.com", "lh3.googleusercontent.com",
+    "amazonaws.com", "s3.us-east-1.amazonaws.com", "github.io", "microsoftonline.com", "login.microsoftonline.com",
+    "paypalobjects.com", "www.paypalobjects.com", "facebook.net", "connect.facebook.net",
+    # <品牌>.<公共後綴>：各國官方網域
+    "google.de", "www.google.co.uk", "yahoo.co.jp", "apple.com.cn",
+    # 和品牌名只差一兩個字的一般單字、品牌官方網域的子網域
+    "applied.com", "finance.yahoo.com", "login.paypal.com", "mail.google.com",
+])
+def test_official_and_infra_hosts_are_not_lookalikes(host):
+    assert BRAND_INDEX.match(host) is None
+
+
+@pytest.mark.parametrize("host, brand, kind", [
+    ("paypal-login.com", "paypal", "embedded"),
+    ("paypal.evil.com", "paypal", "embedded"),
+    ("paypal.com.evil.xyz", "paypal", "embedded"),
+    ("paypalsecure.net", "paypal", "embedded"),
+    ("g00gle.com", "google", "homoglyph"),
+    ("g00gle.de", "google", "homoglyph"),
+    ("xn--pypal-4ve.com", "paypal", "homoglyph"),
+    ("gooogle.com", "google", "typo"),
+    ("micrsoft.com", "microsoft", "typo"),
+])
+def test_lookalikes_still_detected(host, brand, kind):
+    assert BRAND_INDEX.match(host) == (brand, kind)
+
+
+def test_every_default_official_domain_is_clean():
+    for domains in DEFAULT_BRANDS.values():
+        for domain in domains:
+            assert BRAND_INDEX.match(domain) is None, domain
+            assert BRAND_INDEX.match("www." + domain) is None, domain
+
+
+def test_private_suffix_does_not_make_brand_official(monkeypatch):
+    # github.io 這類後綴讓任何人都能註冊子網域：paypal.github.io 不是 PayPal 的
+    monkeypatch.setattr(brand_index, "PUBLIC_SUFFIXES", DomainClassifier([*PUBLIC_SUFFIX_RULES, "github.io"]))
+    assert BRAND_INDEX.match("paypal.github.io") == ("paypal", "embedded")
+    assert BRAND_INDEX.match("paypal.co.uk") is None
+
+
+def test_infra_domains_can_be_added():
+    index = BrandIndex({"examplebank": ("examplebank.com",)})
+    assert index.match("examplebank-cdn.net") == ("examplebank", "embedded")
+    index.add_infra(["examplebank-cdn.net"])
+    assert index.match("static.examplebank-cdn.net") is None
+
+
+@pytest.mark.parametrize("host", ["paypal.xyz", "paypal.top", "google.tk", "microsoft.click", "netflix.vip", "paypal.co"])
+def test_brand_on_generic_or_abused_tld_is_lookalike(host):
+    assert not brand_official(host)
+    assert BRAND_INDEX.match(host) is not None
+
+
+@pytest.mark.parametrize("host", ["google.de", "www.google.co.uk", "yahoo.co.jp", "apple.com.cn", "login.microsoftonline.com",
+                                  "fonts.googleapis.com"])
+def test_country_and_infra_domains_are_official(host):
+    assert brand_official(host)
+
+
+@pytest.mark.parametrize("host", [
+    "evil.github.io", "evil-bucket.s3.amazonaws.com", "d1234.cloudfront.net",
+    "produbanenlineaa.z13.web.core.windows.net", "contoso.sharepoint.com", "storage.googleapis.com",
+    "evil-bucket.storage.googleapis.com",
+    "raw.githubusercontent.com", "github.io", "amazonaws.com",
+])
+def test_user_content_platforms_are_not_owned(host):
+    # 任何人都能在這些平台上放內容：不是仿冒，但也不屬於品牌
+    assert not brand_official(host)
+    assert BRAND_INDEX.match(host) is None
+
+
+def test_brand_name_on_user_content_platform_is_lookalike():
+    assert BRAND_INDEX.match("paypal-login.s3.amazonaws.com") == ("paypal", "embedded")
+    assert BRAND_INDEX.match("paypal.github.io") == ("paypal", "embedded")
+    assert BRAND_INDEX.match("microsoft-365.web.core.windows.net") == ("microsoft", "embedded")
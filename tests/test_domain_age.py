@@ -0,0 +1,98 @@
+# test_domain_age.py — 網域年齡資料庫：由產生的匯出檔編譯、查詢、過期重建
+import datetime
+import os
+import subprocess
+import sys
+
+import pytest
+
+import domain_age
+from domain_age import DomainAgeIndex, compile_domain_ages
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROWS = [
+    ("domain", "created"),
+    ("example.com", "2001-05-20"),
+    ("young-shop.xyz", "2024-03-01T12:34:56Z"),
+    ("Example.COM.", "1999-01-01"),             # 大小寫、結尾的點；同一網域保留最早日期
+    ("example.com", "2010-01-01"),
+    ("shop.example.com.tw", "1700000000"),      # Unix timestamp
+    ("xn--fiqs8s.example", "2020-02-02"),
+    ("中文.example", "2021-12-12"),             # 非 ASCII 轉 punycode
+    ("broken.example", "not-a-date"),
+    ("", "2020-01-01"),
+]
+
+
+def write_dump(path, rows=ROWS):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.write("\n".join(",".join(row) for row in rows) + "\n")
+
+
+@pytest.fixture
+def index(tmp_path):
+    dump, db = tmp_path / "domain_ages.csv", tmp_path / "domain_ages.dage"
+    write_dump(dump)
+    assert compile_domain_ages(str(dump), str(db)) == 5
+    idx = DomainAgeIndex(str(db))
+    yield idx
+    idx.close()
+
+
+def test_lookup_exact_and_earliest(index):
+    assert len(index) == 5
+    assert index.created("example.com") == datetime.date(1999, 1, 1)
+    assert index.created("EXAMPLE.com.") == datetime.date(1999, 1, 1)
+    assert index.created("young-shop.xyz") == datetime.date(2024, 3, 1)
+    assert index.created("shop.example.com.tw") == datetime.datetime.fromtimestamp(
+        1700000000, datetime.timezone.utc).date()
+
+
+def test_lookup_walks_up_to_parent_domain(index):
+    assert index.created("login.secure.example.com") == datetime.date(1999, 1, 1)
+    assert index.created("www.young-shop.xyz:8443") == datetime.date(2024, 3, 1)
+    # 不會走到只剩 TLD
+    assert index.created("other.com") is None
+
+
+def test_lookup_idna_and_misses(index):
+    assert index.created("中文.example") == datetime.date(2021, 12, 12)
+    assert index.created("xn--fiqs8s.example") == datetime.date(2020, 2, 2)
+    assert index.created("broken.example") is None
+    assert index.created("") is None
+    assert DomainAgeIndex().created("example.com") is None
+
+
+def test_rejects_foreign_file(tmp_path):
+    bogus = tmp_path / "bogus.dage"
+    bogus.write_bytes(b"NOTADAGE" + b"\0" * 16)
+    with pytest.raises(ValueError):
+        DomainAgeIndex(str(bogus))
+
+
+def test_load_rebuilds_when_dump_is_newer(tmp_path, monkeypatch):
+    dump, db = tmp_path / "domain_ages.csv", tmp_path / "domain_ages.dage"
+    write_dump(dump)
+    monkeypatch.setattr(domain_age, "DOMAIN_AGES", DomainAgeIndex())
+    domain_age.load_domain_ages(str(dump))
+    assert domain_age.DOMAIN_AGES.created("example.com") == datetime.date(1999, 1, 1)
+    assert domain_age.domain_age_days("young-shop.xyz") == (datetime.date.today() - datetime.date(2024, 3, 1)).days
+
+    write_dump(dump, ROWS[:1] + [("new-site.top", "2024-06-06")])
+    later = os.path.getmtime(db) + 10
+    os.utime(dump, (later, later))
+    domain_age.load_domain_ages(str(dump))
+    assert domain_age.DOMAIN_AGES.created("new-site.top") == datetime.date(2024, 6, 6)
+    assert domain_age.DOMAIN_AGES.created("example.com") is None
+
+
+def test_missing_dump_keeps_empty_database(tmp_path, monkeypatch):
+    empty = DomainAgeIndex()
+    monkeypatch.setattr(domain_age, "DOMAIN_AGES", empty)
+    domain_age.load_domain_ages(str(tmp_path / "absent.csv"))
+    assert domain_age.DOMAIN_AGES is empty
+
+
+def test_import_does_not_load_blacklist():
+    code = "import sys, domain_age; sys.exit('blacklist' in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", code], cwd=ROOT).returncode == 0
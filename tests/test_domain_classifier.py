@@ -0,0 +1,97 @@
+# test_domain_classifier.py — 網域分類：允許名單與可疑 TLD 以完整標籤比對、多層公共後綴與萬用 / 例外規則
+import pytest
+
+import rules
+from domain_classifier import MULTI_LABEL_SUFFIXES, DomainClassifier
+
+ALLOW = ["google.com", "google.com.tw", "github.com", "gov.tw"]
+DENY = [".xyz", ".top", ".tk"]
+
+
+@pytest.fixture(scope="module")
+def classifier():
+    return DomainClassifier(MULTI_LABEL_SUFFIXES, allow=ALLOW, deny=DENY)
+
+
+@pytest.mark.parametrize("domain, match", [
+    ("google.com", "google.com"),
+    ("mail.google.com", "google.com"),
+    ("GOOGLE.COM.:443", "google.com"),
+    ("user@accounts.google.com", "google.com"),
+    ("www.google.com.tw", "google.com.tw"),
+    ("www.moi.gov.tw", "gov.tw"),
+    ("evilgoogle.com", None),                 # 標籤邊界：字串結尾相同不算
+    ("google.com.evil.xyz", None),            # 允許的網域出現在左邊不算
+    ("google.co", None),
+    ("google.com.tw.evil.top", None),
+    ("github.com.attacker.net", None),
+    ("notgithub.com", None),
+    ("google.com@evil.xyz", None),            # userinfo 後面才是主機
+])
+def test_allowlist_matches_whole_labels(classifier, domain, match):
+    info = classifier.classify(domain)
+    assert info["allow_match"] == match
+    assert info["allowlisted"] is (match is not None)
+
+
+@pytest.mark.parametrize("domain, suspicious", [
+    ("evil.xyz", True),
+    ("a.b.evil.top", True),
+    ("google.com.evil.xyz", True),
+    ("evil.xyzz", False),
+    ("xyz.com", False),
+    ("top.example.com.tw", False),
+    ("evil.tk", True),
+])
+def test_deny_matches_whole_tld(classifier, domain, suspicious):
+    assert (classifier.classify(domain)["tld_class"] == "suspicious") is suspicious
+
+
+@pytest.mark.parametrize("domain, registrable, suffix", [
+    ("shop.example.com.tw", "example.com.tw", "com.tw"),
+    ("example.com.tw", "example.com.tw", "com.tw"),
+    ("com.tw", None, "com.tw"),
+    ("a.b.example.co.uk", "example.co.uk", "co.uk"),
+    ("login.evil.it.com", "evil.it.com", "it.com"),
+    ("it.com", None, "it.com"),
+    ("www.example.com", "example.com", "com"),
+    ("example.tw", "example.tw", "tw"),       # 沒有規則時最後一段即為後綴
+    ("tw", None, "tw"),
+    ("www.moi.gov.tw", "moi.gov.tw", "gov.tw"),
+])
+def test_multi_label_suffixes(classifier, domain, registrable, suffix):
+    info = classifier.classify(domain)
+    assert (info["registrable"], info["suffix"]) == (registrable, suffix)
+
+
+@pytest.mark.parametrize("domain, registrable", [
+    ("a.b.ck", "a.b.ck"),                     # *.ck：ck 之下的每個標籤都是後綴
+    ("x.a.b.ck", "a.b.ck"),
+    ("b.ck", None),
+    ("www.ck", "www.ck"),                     # !www.ck：例外規則
+    ("x.www.ck", "www.ck"),
+])
+def test_wildcard_and_exception_rules(domain, registrable):
+    assert DomainClassifier(["ck", "*.ck", "!www.ck"]).registrable(domain) == registrable
+
+
+@pytest.mark.parametrize("domain, host, tld_class", [
+    ("192.168.1.1", "192.168.1.1", "ip"),
+    ("[::1]:8080", "::1", "ip"),
+    ("bücher.de", "xn--bcher-kva.de", "normal"),
+    ("", "", "normal"),
+])
+def test_host_normalization(classifier, domain, host, tld_class):
+    info = classifier.classify(domain)
+    assert (info["host"], info["tld_class"]) == (host, tld_class)
+    assert not info["allowlisted"]
+
+
+def test_rules_safe_domain_follows_swapped_list(monkeypatch):
+    assert rules.is_safe_domain("mail.google.com")
+    assert not rules.is_safe_domain("evilgoogle.com") and not rules.is_safe_domain("google.com.evil.xyz")
+    assert rules.is_suspicious_tld("google.com.evil.xyz")
+    # 名單整個換掉時 trie 與快取跟著重建
+    monkeypatch.setattr(rules, "SAFE_DOMAINS", frozenset({"example.com.tw"}))
+    assert rules.is_safe_domain("shop.example.com.tw") and not rules.is_safe_domain("mail.google.com")
+    assert not rules.is_safe_domain("evil-example.com.tw")
@@ -0,0 +1,98 @@
+# test_html_parser.py — stream 與 bs4 兩種解析後端的輸出逐字相同（邊界案例 + 存下來的頁面）
+import os
+
+import pytest
+
+import html_utils
+from html_utils import ParsedPage, extract_relevant_html, extract_urls
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "fixtures", "pages")
+
+
+# 容易讓兩種後端分歧的寫法：實體、未關閉標籤、空元素結尾、template/ruby、CDATA、重複屬性、charset meta…
+EDGE_CASES = [
+    "純文字 https://example.com/login 沒有標籤",
+    "<title>T &amp; x &foo; &#150; &#x41;&#0;&#99999999;</title><p>a &lt;b&gt; &copy 2024</p>",
+    "<html><head><title>  </title><meta name='description' content='He said \"hi\"'>"
+    "<meta charset='big5' name='keywords' content='a&b'><meta name=author content=\"x'y\\\"z\"></head></html>",
+    '<meta http-equiv="Content-Type" content="text/html; charset=big5" name="description">',
+    "<title><!--c--></title><title>second</title>",
+    "<title><b>bold</b></title><title>x<i>y</i></title>",
+    "a<br>b</br>c<br/>d</br></br>e<img src=x onerror=\"alert(1)\">",
+    "<div><p>one<p>two</div>three</p>four</span>",
+    "<template><div>tpl <a href='/t'>t</a></div></template><ruby>漢<rt>kan</rt><rp>(</rp></ruby>",
+    "<pre>   </pre><textarea>\n\n</textarea><p>   </p><p>\n  \n</p>",
+    "<![CDATA[ cdata text ]]><!DOCTYPE html><?php echo 1 ?><!-- comment -->",
+    "<script>var a = '<b>' + \"</div>\";</script><script>   </script><script src='x.js'></script><script/>",
+    "<noscript><p>enable js</p>inline</noscript><style>p{}</style><head>head text</head>",
+    "<a href>empty</a><a>none</a><a href='' onclick='go()' ONMOUSEOVER='x()'>e</a>",
+    "<a href='JavaScript:void(0)' class='a  b'>j</a><form action=' javascript:steal()'></form>",
+    "<a href='1' href='2' onclick='a' onclick='b'>dup</a>",
+    "<div title='&quot;q&quot;'>&#x;&#;&#12abc;&#xzz;&amp</div>",
+    "<table><tr><td>cell<td>cell2</table><ul><li>i1<li>i2",
+    "<script>unterminated script with <a href='in-script'>",
+    "<p>before<!-- unterminated comment",
+    "<body><div>\xa0\u3000全形空白\u3000</div></body>",
+    "<form action='https://docs.google.com/forms/d/x'><input type=PASSWORD name=p><input type='text'></form>"
+    "<form><input type=' password '/></form><form action=//cdn.example/x></form><input type>",
+]
+
+
+
+
+def corpus() -> list:
+    """邊界案例 + tests/fixtures/pages 的頁面 + HTML_CORPUS_DIR 裡存下來的實際頁面（有設定時）。"""
+    pages = [(f"edge-{i}", html) for i, html in enumerate(EDGE_CASES)]
+    for directory in (FIXTURE_DIR, os.environ.get("HTML_CORPUS_DIR")):
+        if not directory:
+            continue
+        for name in sorted(os.listdir(directory)):
+            if name.lower().endswith((".html", ".htm", ".txt")):
+                with open(os.path.join(directory, name), encoding="utf-8", errors="replace") as f:
+                    pages.append((name, f.read()))
+    # 大頁面：存下來的頁面串接，跨越 STREAM_CHUNK_CHARS
+    saved = [html for name, html in pages if not name.startswith("edge-")]
+    pages.append(("concatenated", "".join(saved) * (html_utils.STREAM_CHUNK_CHARS // sum(map(len, saved)) + 2)))
+    return pages
+
+
+CORPUS = corpus()
+
+
+def parsed_fields(html: str) -> dict:
+    page = ParsedPage(html)
+    return {
+        "relevant_html": page.relevant_html(),
+        "urls": page.urls,
+        "analysis_urls": page.analysis_urls,
+        "title": page.title,
+        "metas": page.metas,
+        "links": page.links,
+        "body_text": page.body_text,
+        "visible_text": page.visible_text,
+        "scripts": page.scripts,
+        "event_handlers": page.event_handlers,
+        "password_inputs": page.password_inputs,
+        "form_actions": page.form_actions,
+        "extract_relevant_html": extract_relevant_html(html, streaming=False),
+        "extract_urls": extract_urls(html),
+    }
+
+
+@pytest.mark.parametrize("name, html", CORPUS, ids=[name for name, _ in CORPUS])
+def test_backends_produce_identical_fields(monkeypatch, name, html):
+    monkeypatch.setattr(html_utils, "HTML_PARSER_BACKEND", "bs4")
+    expected = parsed_fields(html)
+    monkeypatch.setattr(html_utils, "HTML_PARSER_BACKEND", "stream")
+    actual = parsed_fields(html)
+    for field, value in expected.items():
+        assert actual[field] == value, field
+
+
+SAVED = [(n, h) for n, h in CORPUS if not n.startswith("edge-") and n != "concatenated"]
+
+
+@pytest.mark.parametrize("name, html", SAVED, ids=[n for n, _ in SAVED])
+def test_streaming_relevant_html_matches_full_parse(name, html):
+    # 單一頁面的 meta 都在 head 裡，串流提前停止的摘要與完整解析相同（串接的大頁面 body 之後還有 meta，不適用）
+    assert extract_relevant_html(html, streaming=True) == extract_relevant_html(html, streaming=False)
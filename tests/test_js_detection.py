@@ -0,0 +1,76 @@
+# test_js_detection.py — detect_suspicious_js 一次線性掃描的結果與逐一執行舊版 regex 相同
+import random
+import re
+
+import pytest
+
+from tools import detect_suspicious_js
+
+PIECES = ["eval(", "eval (x)", "evaluate(", "atob(", "xatob(", "new Function(", "new  Function (",
+          "el.innerHTML = s;", "innerHTML==", "document.write(", "insertAdjacentHTML(",
+          "String.fromCharCode(", "String.fromCharCode", ".charCodeAt(0)", "_0x1a2b", "_0xzz", "_0x",
+          "s.replace(/a/g, 'b')", "s.replace(x)", ".split('').reverse().join('')", ".split(a).map(f)",
+          "var a = 1;", "\n", " ", "function f(){return 0}", "if (a < b) {", "}", ",", "'", ")"]
+
+
+def legacy_js_findings(code: str) -> tuple:
+    """改寫前的 detect_suspicious_js：對合併後的程式碼逐一執行各個 regex。"""
+    findings, score = [], 0
+    for pattern, text, points in [
+        (r'\beval\s*\(', "包含 eval() 動態執行代碼", 3),
+        (r'\batob\s*\(', "包含 atob() Base64 解碼", 2),
+        (r'\bnew\s+Function\s*\(', "包含 Function constructor 動態生成代碼", 3),
+        (r'innerHTML\s*=', "包含 innerHTML 動態注入", 2),
+        (r'document\.write\s*\(', "包含 document.write 動態注入", 2),
+        (r'insertAdjacentHTML\s*\(', "包含 insertAdjacentHTML 動態注入", 2),
+    ]:
+        if re.search(pattern, code):
+            findings.append(text)
+            score += points
+    n = len(re.findall(r'String\.fromCharCode\s*\(', code))
+    if n >= 3:
+        findings.append(f"大量使用 String.fromCharCode ({n} 次，通常用於混淆)")
+        score += n
+    n = len(re.findall(r'_0x[a-f0-9]+', code))
+    if n >= 5:
+        findings.append(f"檢測到大量十六進位混淆變數 ({n} 個，通常用於隱藏代碼)")
+        score += 2
+    for pattern in (r'\.replace\s*\([^,]+,\s*["\']', r'\.split\s*\([^)]+\)\s*\.join', r'String\.fromCharCode.*\.charCodeAt'):
+        if re.search(pattern, code):
+            findings.append("檢測到自我解密腳本特徵")
+            score += 2
+            break
+    return findings, score
+
+
+def legacy_severity(score: int) -> str:
+    return "none" if score == 0 else "low" if score <= 2 else "medium" if score <= 5 else "high"
+
+
+def random_js(rng: random.Random) -> str:
+    return "".join(rng.choice(PIECES) for _ in range(rng.randint(1, 30)))
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_findings_match_legacy(seed):
+    rng = random.Random(seed)
+    for _ in range(50):
+        code = random_js(rng)
+        findings, score = legacy_js_findings(code)
+        result = detect_suspicious_js(code)
+        assert result["findings"] == findings, code
+        assert result["severity"] == legacy_severity(score), code
+        assert result["has_suspicious_js"] == bool(findings)
+
+
+@pytest.mark.parametrize("code", [
+    "",
+    "String.fromCharCode(1)\n.charCodeAt(0)",          # 舊 regex 的 .* 不跨行
+    ".charCodeAt(0);String.fromCharCode(1)",           # 順序相反不算
+    "String.fromCharCode(97,98);" * 3 + "x.charCodeAt(0)",
+    "_0xab _0xcd _0xef _0x12 _0x34 _0xzz",
+    "s.replace(a,\n'b')",
+    "retrieval(1); new Functionx(); innerHTML\t= 1",
+])
+def test_edge_cases_match_legacy(code):
+    assert detect_suspicious_js(code)["findings"] == legacy_js_findings(code)[0]
@@ -0,0 +1,91 @@
+# test_keywords.py — KeywordMatcher 一次掃描的結果與逐一 in / str.count 檢查相同
+import random
+import re
+
+import pytest
+
+from rules import RULE_KEYWORD_GROUPS, RULE_KEYWORDS
+from text_utils import KeywordMatcher
+from tools import detect_language_anomaly
+
+FILLER = [chr(c) for c in range(0x4E00, 0x4E00 + 3000)] + list("们这的了")
+
+
+def legacy_rule_counts(visible: str) -> dict:
+    """改寫前的 rule_score：每組逐一檢查關鍵字是否出現在 lower() 後的文字中。"""
+    v = visible.lower()
+    return {name: sum(1 for k in words if k in v) for name, (_, _, words) in RULE_KEYWORD_GROUPS.items()}
+
+
+def legacy_language_anomaly(text: str) -> str:
+    """改寫前的 detect_language_anomaly。"""
+    findings = []
+    simplified_chars = "们这对机国观产层战领举办权进体为发过学说语讲"
+    simp_count = sum(1 for c in text if c in simplified_chars)
+    ratio = round(simp_count / max(len(text), 1), 3)
+    if ratio > 0.05:
+        findings.append(f"簡體字比例偏高({ratio})")
+    zh = len(re.findall(r"[一-龥]", text))
+    en = len(re.findall(r"[A-Za-z]", text))
+    if zh > 0 and en > 0 and (en / (zh + 1)) > 0.4:
+        findings.append("語言混雜比例異常")
+    if re.search(r"的的|了了|是不|會會|它它", text):
+        findings.append("疑似翻譯腔或重複片段")
+    if len(findings) == 0:
+        return "語言檢查正常"
+    return "語言異常：" + "、".join(findings)
+
+
+def random_text(rng: random.Random, size: int, keyword_rate: float) -> str:
+    keywords = [k for _, _, words in RULE_KEYWORD_GROUPS.values() for k in words]
+    parts, total = [], 0
+    while total < size:
+        roll = rng.random()
+        if roll < keyword_rate:
+            part = rng.choice(keywords)
+            if rng.random() < 0.3:
+                part = part.upper()
+        elif roll < keyword_rate + 0.1:
+            part = " " + "".join(rng.choice("abcdefghrefHREF") for _ in range(rng.randint(2, 6))) + " "
+        else:
+            part = "".join(rng.choice(FILLER) for _ in range(rng.randint(1, 6)))
+        parts.append(part)
+        total += len(part)
+    return "".join(parts)
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_rule_counts_match_legacy(seed):
+    rng = random.Random(seed)
+    text = random_text(rng, rng.choice([50, 2000, 20000]), rng.choice([0.001, 0.05, 0.3]))
+    assert RULE_KEYWORDS.counts(text) == legacy_rule_counts(text)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_language_anomaly_matches_legacy(seed):
+    rng = random.Random(seed)
+    text = random_text(rng, rng.choice([50, 2000, 20000]), rng.choice([0.001, 0.05, 0.3]))
+    assert detect_language_anomaly.func(text) == legacy_language_anomaly(text)
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "請重新驗證您的帳號",          # 被較長關鍵字包含的關鍵字也計入
+    "轉帳號碼",                    # 跨界重疊：轉帳 + 帳號
+    "HREF Href href",             # 英文不分大小寫
+    "立即立即立即",
+])
+def test_edge_cases_match_legacy(text):
+    assert RULE_KEYWORDS.counts(text) == legacy_rule_counts(text)
+
+
+def test_scan_counts_like_str_count():
+    matcher = KeywordMatcher({"a": ["驗證", "重新驗證", "帳號"], "b": ["轉帳", "href"]})
+    rng = random.Random(0)
+    pieces = ["驗證", "重新", "帳號", "轉", "帳", "HREF", "hre", "f", "號"]
+    for _ in range(200):
+        text = "".join(rng.choice(pieces) for _ in range(rng.randint(0, 30)))
+        lowered = text.lower()
+        expected = {name: {k: lowered.count(k) for k in words if k in lowered}
+                    for name, words in matcher.groups.items()}
+        assert matcher.scan(text) == expected, text
@@ -0,0 +1,184 @@
+# test_llm_pool.py — LLM 連線池：對本機假 Ollama 端點檢查分流、每端點並行上限、排隊順序、逾時與失效端點
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from llm_pool import LLMPool
+
+VERDICT = '{"is_potential_phishing": false, "risk_level": "low", "explanation": ["stub"], "confidence": 80}'
+
+
+class StubOllama:
+    """本機假 Ollama：POST /api/chat 回固定內容（非串流）；gate 未開時請求停在端點上，方便觀察同時處理數。"""
+
+    def __init__(self):
+        stub = self
+        self.gate = threading.Event()
+        self.gate.set()
+        self.requests = self.active = self.max_active = self.connections = 0
+        self._lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                with stub._lock:
+                    stub.requests += 1
+                    stub.active += 1
+                    stub.max_active = max(stub.max_active, stub.active)
+                stub.gate.wait(5)
+                with stub._lock:
+                    stub.active -= 1
+                data = json.dumps({"model": body.get("model", ""), "created_at": "2025-01-01T00:00:00Z",
+                                   "message": {"role": "assistant", "content": VERDICT},
+                                   "done": True, "done_reason": "stop", "prompt_eval_count": 1, "eval_count": 1})
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data.encode("utf-8"))
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.gate.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stubs():
+    created = []
+
+    def make(n):
+        created.extend(StubOllama() for _ in range(n))
+        return created[-n:]
+
+    yield make
+    for stub in created:
+        stub.close()
+
+
+def _wait_until(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while not predicate():
+        assert time.time() < deadline, "等待逾時"
+        time.sleep(0.005)
+
+
+def _dead_url():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return f"http://127.0.0.1:{port}"
+
+
+def test_acquire_picks_least_outstanding():
+    pool = LLMPool(["http://a", "http://b", "http://c"], max_concurrency=4)
+    first = [pool.acquire() for _ in range(3)]
+    assert sorted(e.url for e in first) == ["http://a", "http://b", "http://c"]
+    extra = pool.acquire()
+    pool.release(first[1], 0.1)
+    # b 的未完成請求最少
+    assert pool.acquire() is first[1]
+    # 未完成數相同時挑累計請求較少的（a、b 各 2 次，c 1 次）
+    pool.release(extra, 0.1)
+    assert pool.acquire().url == "http://c"
+
+
+def test_per_endpoint_cap_and_queueing(stubs):
+    a, b = stubs(2)
+    a.gate.clear()
+    b.gate.clear()
+    pool = LLMPool([a.url, b.url], max_concurrency=2, queue_timeout=10)
+    llm = pool.chat(model="stub", temperature=0)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(llm.invoke("hi").content)) for _ in range(7)]
+    for t in threads:
+        t.start()
+    _wait_until(lambda: a.active + b.active == 4 and pool.stats()["waiting"] == 3)
+    stats = pool.stats()
+    assert stats["outstanding"] == stats["capacity"] == 4
+    assert [e["outstanding"] for e in stats["endpoints"]] == [2, 2]
+    a.gate.set()
+    b.gate.set()
+    for t in threads:
+        t.join(5)
+    assert results == [VERDICT] * 7
+    assert a.max_active <= 2 and b.max_active <= 2
+    assert a.requests + b.requests == 7
+    stats = pool.stats()
+    assert stats["outstanding"] == stats["waiting"] == 0
+    assert stats["queued"] == 3 and stats["max_waiting"] == 3
+
+
+def test_queue_is_first_come_first_served():
+    pool = LLMPool(["http://a"], max_concurrency=1, queue_timeout=5)
+    held = pool.acquire()
+    order = []
+
+    def worker(name):
+        endpoint = pool.acquire()
+        order.append(name)
+        pool.release(endpoint, 0.0)
+
+    threads = []
+    for i in range(4):
+        threads.append(threading.Thread(target=worker, args=(i,)))
+        threads[-1].start()
+        _wait_until(lambda: pool.stats()["waiting"] == i + 1)
+    pool.release(held, 0.0)
+    for t in threads:
+        t.join(5)
+    assert order == [0, 1, 2, 3]
+
+
+def test_queue_timeout(stubs):
+    (stub,) = stubs(1)
+    stub.gate.clear()
+    pool = LLMPool([stub.url], max_concurrency=1, queue_timeout=0.05)
+    llm = pool.chat(model="stub", temperature=0)
+    first = threading.Thread(target=llm.invoke, args=("hi",))
+    first.start()
+    _wait_until(lambda: stub.active == 1)
+    with pytest.raises(TimeoutError):
+        llm.invoke("hi")
+    stub.gate.set()
+    first.join(5)
+    assert pool.stats()["timeouts"] == 1
+
+
+def test_unreachable_endpoint_fails_over_and_cools_down(stubs):
+    (stub,) = stubs(1)
+    pool = LLMPool([_dead_url(), stub.url], max_concurrency=2, cooldown=60)
+    llm = pool.chat(model="stub", temperature=0)
+    assert [llm.invoke(str(i)).content for i in range(5)] == [VERDICT] * 5
+    dead, alive = pool.stats()["endpoints"]
+    assert dead["down"] and dead["errors"] == 1 and dead["outstanding"] == 0
+    assert alive["requests"] == stub.requests == 5
+
+
+def test_client_reuses_connection(stubs):
+    (stub,) = stubs(1)
+    pool = LLMPool([stub.url], max_concurrency=2)
+    llm = pool.chat(model="stub", temperature=0)
+    for i in range(20):
+        llm.invoke(str(i))
+    assert stub.requests == 20 and stub.connections == 1
@@ -0,0 +1,61 @@
+# test_near_dup.py — 近似重複索引：工具包換網域仍沿用釣魚判斷，但可信主機上的真頁面不沿用
+import pytest
+
+import analyzer
+import rules
+from near_dup import NearDupIndex, minhash_sketch, site_signature
+
+LOGIN_PAGE = "請登入您的帳戶以繼續使用服務。" * 3 + "電子郵件地址 密碼 忘記密碼了嗎 建立帳戶 使用其他帳戶登入 隱私權 條款 說明"
+KEY = "00" * 16
+
+
+def _index():
+    index = NearDupIndex(capacity=1024)
+    index.add(minhash_sketch(LOGIN_PAGE), site_signature(["login-verify.xyz"]), True, "high", 90, KEY)
+    return index
+
+
+def test_phishing_verdict_reused_across_hosts():
+    match = _index().lookup(minhash_sketch(LOGIN_PAGE + " 2"), site_signature(["other-kit.top"]))
+    assert match is not None and match["is_potential_phishing"]
+
+
+def test_phishing_verdict_not_reused_for_trusted_page():
+    index = _index()
+    sketch = minhash_sketch(LOGIN_PAGE + " 2")
+    assert index.lookup(sketch, site_signature(["accounts.google.com"]), reuse_phishing=False) is None
+    # 主機相同時仍然沿用
+    assert index.lookup(sketch, site_signature(["login-verify.xyz"]), reuse_phishing=False) is not None
+
+
+@pytest.fixture
+def clone_index(monkeypatch, tmp_path):
+    monkeypatch.setattr(rules, "LOG_PATH", str(tmp_path / "log.jsonl"))
+    index = NearDupIndex(capacity=1024)
+    index.reset(analyzer.ruleset_version())
+    monkeypatch.setattr(analyzer, "NEAR_DUP_INDEX", index)
+    clone_urls = ["https://accounts-google.login-verify.xyz/signin"]
+    index.add(minhash_sketch(LOGIN_PAGE), analyzer.page_site_signature(clone_urls), True, "high", 90, KEY)
+    return index
+
+
+def test_genuine_login_page_does_not_inherit_clone_verdict(clone_index):
+    genuine = ["https://accounts.google.com/signin", "https://fonts.googleapis.com/css"]
+    assert analyzer.near_duplicate_verdict(LOGIN_PAGE, genuine) is None
+    redeployed = analyzer.near_duplicate_verdict(LOGIN_PAGE, ["https://secure-signin.top/"])
+    assert redeployed is not None and redeployed["is_potential_phishing"]
+
+
+@pytest.mark.parametrize("url", [
+    "https://evil-bucket.s3.amazonaws.com/index.html",
+    "https://d1234.cloudfront.net/signin",
+    "https://produbanenlineaa.z13.web.core.windows.net/",
+    "https://evil.github.io/login",
+    "https://paypal.top/signin",
+    "https://google.tk/signin",
+])
+def test_kit_redeployed_on_hosting_platform_inherits_verdict(clone_index, url):
+    # 任何人都能放內容的平台與泛用 TLD 上的品牌名都不是可信主機
+    redeployed = analyzer.near_duplicate_verdict(LOGIN_PAGE, [url])
+    assert redeployed is not None and redeployed["is_potential_phishing"]
+    assert redeployed["tier"] == "near_duplicate"
@@ -0,0 +1,92 @@
+# test_rule_score.py — 規則評分：「未找到聯絡資訊」只在有其他可疑訊號時才加分；rules 可單獨匯入
+import os
+import subprocess
+import sys
+
+import pytest
+
+import rules
+from analyzer import rule_tier_verdict
+from html_utils import ParsedPage
+from rules import prepare_analysis, rule_score
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NO_CONTACT = {"extract_contact_info": "未找到聯絡資訊"}
+# 英文登入頁：中文關鍵字一個都不會命中，唯一的連結與表單都在允許名單網域（docs.google.com）
+ENGLISH_LOGIN = """<html><head><title>Microsoft 365 - Verify your account</title></head><body>
+<h1>Your mailbox will be suspended</h1><p>Verify your password immediately to avoid account suspension.</p>
+<form action="https://docs.google.com/forms/d/e/1FAIpQL/formResponse" method="post">
+<input type="email" name="email"><input type="password" name="pass"><button>Sign in</button></form>
+<a href="https://docs.google.com/forms/d/e/1FAIpQL/viewform">Continue</a></body></html>"""
+
+
+@pytest.fixture(autouse=True)
+def _log_path(monkeypatch, tmp_path):
+    monkeypatch.setattr(rules, "LOG_PATH", str(tmp_path / "log.jsonl"))
+
+
+def test_missing_contact_alone_adds_nothing():
+    r = rule_score("歡迎光臨本站，今日營業時間如下。", ["https://www.google.com/maps"], NO_CONTACT)
+    assert r["gross_score"] == 0 and r["score"] == 0
+    assert not any("extract_contact_info" in reason for reason in r["reasons"])
+    verdict = rule_tier_verdict(r, ["https://www.google.com/maps"])
+    assert verdict is not None and verdict[:3] == (False, "low", 80)
+
+
+def test_missing_contact_corroborates_other_signals():
+    text = "請點擊以下連結完成付款。"
+    base = rule_score(text, [], {})
+    r = rule_score(text, [], NO_CONTACT)
+    assert r["score"] == base["score"] + 1
+    assert "工具 extract_contact_info 標記可疑" in r["reasons"]
+
+
+def test_contact_found_never_scores():
+    text = "請點擊以下連結完成付款。"
+    r = rule_score(text, [], {"extract_contact_info": "聯絡資訊正常：找到電子郵件 1 組"})
+    assert r["score"] == rule_score(text, [], {})["score"]
+
+
+def test_corroborating_rules_are_separate_from_tool_rules():
+    assert "extract_contact_info" not in rules.TOOL_EVIDENCE_RULES
+    assert "extract_contact_info" in rules.CORROBORATING_EVIDENCE_RULES
+
+
+def test_rules_import_stays_out_of_llm_and_server_setup():
+    # /analyze_batch 的子行程只匯入 rules：不建 LLM 連線池、不載入名單、不建 Flask app
+    code = ("import sys, rules; heavy = {'analyzer', 'llm_pool', 'blacklist', 'server', 'flask', 'langchain_ollama'}; "
+            "sys.exit(sorted(heavy & set(sys.modules)) or 0)")
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+
+def test_english_credential_page_is_not_short_circuited_as_benign():
+    prepared = prepare_analysis(ParsedPage(ENGLISH_LOGIN))
+    r = prepared["rule"]
+    assert r["keyword_hits"] == 0 and r["password_inputs"] == 1 and r["offsite_forms"] == 1
+    assert rule_tier_verdict(r, prepared["urls"]) is None
+
+
+@pytest.mark.parametrize("html", [
+    ENGLISH_LOGIN.replace('<input type="password" name="pass">', ""),
+    ENGLISH_LOGIN.replace("https://docs.google.com/forms/d/e/1FAIpQL/formResponse", "/session"),
+])
+def test_password_field_or_offsite_form_alone_needs_llm(html):
+    prepared = prepare_analysis(ParsedPage(html))
+    assert rule_tier_verdict(prepared["rule"], prepared["urls"]) is None
+
+
+def test_allowlisted_page_without_forms_still_short_circuits():
+    html = ENGLISH_LOGIN.split("<form")[0] + '<a href="https://docs.google.com/document/d/1">Docs</a></body></html>'
+    prepared = prepare_analysis(ParsedPage(html))
+    verdict = rule_tier_verdict(prepared["rule"], prepared["urls"])
+    assert verdict is not None and verdict[0] is False
+
+
+def test_keywords_only_scored_in_llm_window():
+    # 長頁面：開頭提到「帳號」，LLM 看不到的後段才有「必須」，不應湊成 hard_flag
+    filler = "本站提供各類商品與服務說明。" * (rules.LLM_TEXT_LIMIT // 10)
+    far = rule_score("會員帳號設定說明。" + filler + "退貨必須保留發票。", [], {})
+    assert not far["hard_flag"] and "緊急語氣 x1" not in far["reasons"]
+    near = rule_score("會員帳號設定說明。退貨必須保留發票。" + filler, [], {})
+    assert near["hard_flag"]
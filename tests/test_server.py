@@ -0,0 +1,98 @@
+# test_server.py — Flask 端點：啟動時的名單載入、/check_urls 的 JSON 與 NDJSON 回傳
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import blacklist
+import server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_import_does_not_load_lists():
+    # spawn 子行程、reloader 監看行程都會 import server，不能在 import 時重建快照
+    code = ("import blacklist, server\n"
+            "assert type(blacklist.OFFICIAL_BLACKLIST) is blacklist.BlacklistIndex\n"
+            "assert not server._INITIALIZED\n")
+    subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True)
+
+
+def test_init_loads_once(monkeypatch):
+    calls = []
+    monkeypatch.setattr(server, "_INITIALIZED", False)
+    monkeypatch.setattr(server, "load_blacklist", lambda path: calls.append(("blacklist", path)))
+    monkeypatch.setattr(server, "load_domain_ages", lambda: calls.append(("domain_ages",)))
+    monkeypatch.setattr(server, "load_near_duplicates", lambda version: calls.append(("near_dup", version)))
+    server.init()
+    server.init()
+    assert calls == [("blacklist", "phishtank.csv"), ("domain_ages",), ("near_dup", server.ruleset_version())]
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    official = blacklist.BlacklistIndex()
+    for url in ("https://evil.com", "http://phish.net/login"):
+        official.add(url)
+    user = blacklist.UserBlacklistJournal(str(tmp_path / "user.jsonl"), sync_interval=0, compact_min=10 ** 6)
+    user.load()
+    user.add("http://phish.net/login/step")
+    user.add("scam.org")
+    monkeypatch.setattr(blacklist, "OFFICIAL_BLACKLIST", official)
+    monkeypatch.setattr(blacklist, "USER_BLACKLIST", user)
+    return server.app.test_client()
+
+
+URLS = ["https://www.evil.com/x", "HTTP://PHISH.net/login/step", "https://phish.net/login",
+        "//scam.org/a", "https://ok.tw", "https://www.evil.com/x", "javascript:alert(1)", 42]
+EXPECTED = [
+    ("https://www.evil.com/x", "official", "domain"),
+    ("http://phish.net/login/step", "user", "exact"),      # 使用者名單較精確
+    ("https://phish.net/login", "official", "exact"),
+    ("http://scam.org/a", "user", "host"),
+    ("https://ok.tw/", None, None),
+    ("https://www.evil.com/x", "official", "domain"),
+    (None, None, None),
+    (None, None, None),
+]
+
+
+def _summary(rows):
+    return [(r["normalized"], r["blacklist_source"], r["blacklist_match"]) for r in rows]
+
+
+def _ndjson(resp):
+    assert resp.mimetype == "application/x-ndjson"
+    return [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+
+
+def test_check_urls_json(client):
+    resp = client.post("/check_urls", json={"urls": URLS})
+    assert resp.mimetype == "application/json"
+    body = resp.get_json()
+    assert body["success"] and body["hits"] == 5
+    assert [r["url"] for r in body["results"]] == URLS
+    assert _summary(body["results"]) == EXPECTED
+    assert [r["is_blacklisted"] for r in body["results"]] == [s is not None for _, s, _ in EXPECTED]
+
+
+def test_check_urls_stream_matches_json(client):
+    rows = _ndjson(client.post("/check_urls", json={"urls": URLS, "stream": True}))
+    assert rows == client.post("/check_urls", json={"urls": URLS}).get_json()["results"]
+
+
+def test_check_urls_switches_to_ndjson_above_threshold(client, monkeypatch):
+    monkeypatch.setattr(server, "CHECK_URLS_STREAM_THRESHOLD", 3)
+    assert _summary(_ndjson(client.post("/check_urls", json={"urls": URLS}))) == EXPECTED
+    assert client.post("/check_urls", json={"urls": URLS[:3]}).mimetype == "application/json"
+    # 明確指定 stream=false 時即使超過門檻也一次回傳
+    assert client.post("/check_urls", json={"urls": URLS, "stream": False}).get_json()["hits"] == 5
+
+
+def test_check_urls_rejects_bad_requests(client, monkeypatch):
+    assert client.post("/check_urls", json={"urls": "https://evil.com"}).status_code == 400
+    assert client.post("/check_urls", data="not json").status_code == 400
+    monkeypatch.setattr(server, "CHECK_URLS_MAX", 3)
+    assert client.post("/check_urls", json={"urls": URLS}).status_code == 413
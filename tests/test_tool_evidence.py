@@ -0,0 +1,64 @@
+# test_tool_evidence.py — 工具階段：結果順序固定、逾時工具佔住的執行緒有上限
+import threading
+import time
+
+import pytest
+
+import rules
+
+URLS = ["https://login-verify.example.xyz/signin"]
+TEXT = "請立即登入驗證帳號"
+
+
+@pytest.fixture(autouse=True)
+def _log_path(monkeypatch, tmp_path):
+    monkeypatch.setattr(rules, "LOG_PATH", str(tmp_path / "log.jsonl"))
+    monkeypatch.setattr(rules, "TOOL_PLANNER_ENABLED", False)
+    monkeypatch.setattr(rules, "ALWAYS_ON_TOOLS", list(rules.TOOL_REGISTRY))
+
+
+def test_evidence_follows_registry_order(monkeypatch):
+    names = list(rules.TOOL_REGISTRY)
+    run_tool = rules._run_tool
+
+    def reversed_finish(tool, args):
+        # 越前面的工具越晚完成
+        time.sleep(0.01 * (len(names) - names.index(tool)))
+        return run_tool(tool, args)
+
+    monkeypatch.setattr(rules, "_run_tool", reversed_finish)
+    monkeypatch.setattr(rules, "TOOL_TIMEOUT_MS", 2000)
+    monkeypatch.setattr(rules, "TOOL_STAGE_BUDGET_MS", 2000)
+    evidence = rules.collect_tool_evidence(URLS, TEXT)
+    assert list(evidence) == names
+    assert all(isinstance(v, str) for v in evidence.values())
+
+
+def test_timed_out_tools_are_capped(monkeypatch):
+    release = threading.Event()
+    run_tool = rules._run_tool
+
+    def hang_on_safety(tool, args):
+        if tool == "check_url_safety":
+            release.wait(5)
+        return run_tool(tool, args)
+
+    monkeypatch.setattr(rules, "_run_tool", hang_on_safety)
+    monkeypatch.setattr(rules, "TOOL_TIMEOUT_MS", 50)
+    monkeypatch.setattr(rules, "TOOL_STAGE_BUDGET_MS", 50)
+    monkeypatch.setattr(rules, "TOOL_MAX_STRAGGLERS", 1)
+    try:
+        first = rules.collect_tool_evidence(URLS, TEXT)
+        assert first["check_url_safety"] == {"error": "逾時未完成"}
+        assert rules._STRAGGLERS == 1
+        # 上限已滿：新的工具直接略過，不再排進被佔住的執行緒
+        second = rules.collect_tool_evidence(URLS, TEXT)
+        assert list(second) == list(rules.TOOL_REGISTRY)
+        assert all(v == {"error": "工具執行緒忙碌，略過"} for v in second.values())
+    finally:
+        release.set()
+    deadline = time.time() + 5
+    while rules._STRAGGLERS and time.time() < deadline:
+        time.sleep(0.01)
+    assert rules._STRAGGLERS == 0
+    assert isinstance(rules.collect_tool_evidence(URLS, TEXT)["check_url_safety"], str)
@@ -0,0 +1,52 @@
+# test_url_utils.py — 網址正規化：黑名單的鍵與頁面擷取的網址都以這套規則比對
+import pytest
+
+from url_utils import canonical_parts, canonicalize_url
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("HTTPS://Example.COM/A/B", "https://example.com/A/B"),          # 路徑大小寫保留
+    ("https://example.com:443/", "https://example.com/"),
+    ("http://example.com:80", "http://example.com/"),
+    ("http://example.com:8080", "http://example.com:8080/"),
+    ("https://example.com:80/", "https://example.com:80/"),          # 只去掉協定本身的預設 port
+    ("https://example.com/a/b/?x=1#frag", "https://example.com/a/b?x=1"),
+    ("https://example.com/#frag", "https://example.com/"),
+    ("https://example.com/?", "https://example.com/"),
+    ("https://example.com//a///b/", "https://example.com/a/b"),
+    ("https://example.com/path?b=2&a=1", "https://example.com/path?b=2&a=1"),   # query 不重排
+    ("https://user:pw@evil.com./login", "https://evil.com/login"),
+    ("https://bücher.de/x", "https://xn--bcher-kva.de/x"),
+    ("http://[::1]:8080/a", "http://[::1]:8080/a"),
+    ("http://[::1]:80/", "http://[::1]/"),
+    ("//cdn.example.com/x.js", "http://cdn.example.com/x.js"),
+    ("  https://example.com/a  ", "https://example.com/a"),
+    ("http://example.com/%7Euser", "http://example.com/%7Euser"),
+])
+def test_canonicalize_url(url, expected):
+    assert canonicalize_url(url) == expected
+
+
+@pytest.mark.parametrize("url", [
+    "", None, "   ", "https://", "ftp://example.com/a", "javascript:alert(1)",
+    "mailto:a@example.com", "http://example.com:99999/", "example.com/login",
+])
+def test_canonicalize_url_rejects(url):
+    assert canonicalize_url(url) is None
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("evil.com", "http://evil.com/"),
+    ("EVIL.com:80/login/", "http://evil.com/login"),
+    ("https://evil.com/login", "https://evil.com/login"),
+    # query 裡的網址不代表條目本身帶協定
+    ("google.com/url?q=https://evil.top", "http://google.com/url?q=https://evil.top"),
+])
+def test_assume_http(url, expected):
+    assert canonicalize_url(url, assume_http=True) == expected
+
+
+def test_equivalent_spellings_share_parts():
+    spellings = ["http://x.com", "https://x.com/", "HTTP://X.COM:80", "http://X.com.#top", "x.com/"]
+    parts = {canonical_parts(u, assume_http=True)[1:] for u in spellings}
+    assert parts == {("x.com", None, "/", "")}
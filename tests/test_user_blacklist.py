@@ -0,0 +1,166 @@
+# test_user_blacklist.py — 使用者黑名單日誌：壓縮寫成共用快照後，各 worker 只為之後的新增條目建記憶體索引
+import json
+import time
+
+import pytest
+
+import blacklist
+from blacklist import UserBlacklistJournal
+
+
+@pytest.fixture
+def workers(tmp_path):
+    path = str(tmp_path / "user_blacklist.jsonl")
+    created = []
+
+    def make():
+        journal = UserBlacklistJournal(path, sync_interval=0, compact_min=10 ** 6)
+        journal.load()
+        created.append(journal)
+        return journal
+
+    yield make
+    for journal in created:
+        if journal._base is not None:
+            journal._base.close()
+
+
+def test_compaction_moves_entries_into_shared_snapshot(workers):
+    a, b = workers(), workers()
+    for url in ("evil.com", "http://phish.example.net/login", "https://bad.org/a?x=1"):
+        a.add(url)
+    assert b.lookup("http://www.evil.com/x") == "domain"
+    a.compact()
+    assert a.snapshot_version == 3 and a.overlay_entries == 0
+
+    b.sync(force=True)
+    assert b.snapshot_version == 3 and b.overlay_entries == 0 and len(b._index) == 0
+    assert b.lookup("http://www.evil.com/x") == "domain"
+    assert b.lookup("phish.example.net/login/step2") == "path"
+    assert b.lookup("https://bad.org/a?x=1") == "exact"
+    assert b.lookup("https://bad.org/a?x=2") is None
+
+    # 快照之後的新增只進小索引
+    a.add("later.io/path")
+    assert b.lookup("https://later.io/path") == "exact"
+    assert b.overlay_entries == 1 and b.version == 4
+
+
+def test_delete_masks_snapshot_key(workers):
+    a, b = workers(), workers()
+    a.add("evil.com")
+    a.add("other.com")
+    a.compact()
+    assert a.delete("evil.com")
+    assert b.lookup("evil.com") is None and a.lookup("evil.com") is None
+    assert b.lookup("other.com") == "host"
+    # 刪除後再加回：新 seq 在快照之後，從小索引命中
+    a.add("evil.com")
+    assert b.lookup("www.evil.com/login") == "domain"
+    assert b.page() == (["other.com", "evil.com"], None)
+
+
+def test_delete_keeps_key_shared_by_other_entry(workers):
+    a, b = workers(), workers()
+    a.add("http://dup.com/login")
+    a.add("https://DUP.com/login")     # 同一個鍵
+    a.compact()
+    a.delete("http://dup.com/login")
+    assert b.lookup("dup.com/login") == "exact"
+    a.delete("https://DUP.com/login")
+    assert b.lookup("dup.com/login") is None
+
+
+def test_clear_drops_snapshot(workers):
+    a, b = workers(), workers()
+    a.add("evil.com")
+    a.compact()
+    a.clear()
+    assert b.lookup("evil.com") is None and len(b) == 0 and b.snapshot_version == 0
+    a.add("new.com")
+    assert b.lookup("new.com") == "host" and b.version == 2
+
+
+def test_reload_and_paging_after_compaction(workers):
+    a = workers()
+    for i in range(5):
+        a.add(f"site{i}.com")
+    a.delete("site1.com")
+    a.compact()
+    c = workers()
+    assert c.snapshot_version == 5 and c.overlay_entries == 0 and c.dead_records == 0
+    page, cursor = c.page(limit=2)
+    assert page == ["site0.com", "site2.com"]
+    assert c.page(cursor, 10) == (["site3.com", "site4.com"], None)
+    assert c.lookup("site1.com") is None and c.lookup("www.site4.com") == "domain"
+
+
+def test_journal_falls_back_when_snapshot_was_replaced(workers, tmp_path):
+    a = workers()
+    a.add("evil.com")
+    a.compact()
+    path = tmp_path / "user_blacklist.jsonl"
+    lines = path.read_text(encoding="utf-8").splitlines()
+    # 模擬讀到舊日誌時快照已被更新的壓縮換掉：版本對不上就全部走記憶體索引
+    lines[0] = json.dumps({"op": "snap", "version": 99, "dups": {}})
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    b = workers()
+    assert b.snapshot_version == 0 and b.overlay_entries == 1
+    assert b.lookup("evil.com") == "host"
+
+
+def test_growth_triggers_background_snapshot(tmp_path):
+    journal = UserBlacklistJournal(str(tmp_path / "user_blacklist.jsonl"), sync_interval=0, compact_min=3)
+    journal.load()
+    for i in range(3):
+        journal.add(f"site{i}.com")
+    for _ in range(200):
+        if not journal._compacting and journal.snapshot_version:
+            break
+        time.sleep(0.01)
+    assert journal.snapshot_version == 3 and journal.overlay_entries == 0
+    assert journal.lookup("site2.com") == "host"
+    journal._base.close()
+
+
+def test_lookups_during_reload_see_previous_state(workers, monkeypatch):
+    a, b = workers(), workers()
+    a.add("evil.com")
+    a.add("phish.net/login")
+    a.compact()
+    a.add("late.org")
+    b.sync(force=True)
+    a.compact()     # inode 改變：b 下次同步要整份重讀
+    seen = []
+    apply = b._apply
+
+    def checking_apply(rec):
+        # 重讀途中其他執行緒的查詢（不持鎖）仍要命中原本的條目
+        seen.append((b._lookup("evil.com", b._view), b._lookup("late.org/x", b._view), len(b), "evil.com" in b._view[3]))
+        apply(rec)
+
+    monkeypatch.setattr(b, "_apply", checking_apply)
+    b.sync(force=True)
+    assert seen and all(s == ("host", "host", 3, True) for s in seen)
+    assert b.snapshot_version == 3 and b.lookup("phish.net/login") == "exact"
+
+
+def test_windows_compaction_keeps_answering_lookups(workers, monkeypatch):
+    a = workers()
+    a.add("evil.com")
+    a.compact()
+    a.add("late.org")
+    seen = []
+    write_snapshot = blacklist.write_snapshot
+
+    def checking_write(urls, snap_path, **kwargs):
+        # 舊快照已關閉、新快照還沒寫好：查詢由記憶體索引回答
+        seen.append((a.lookup("evil.com"), a.lookup("late.org")))
+        return write_snapshot(urls, snap_path, **kwargs)
+
+    with monkeypatch.context() as m:
+        m.setattr(blacklist.os, "name", "nt")
+        m.setattr(blacklist, "write_snapshot", checking_write)
+        a.compact()
+    assert seen == [("host", "host")]
+    assert a.snapshot_version == 2 and a.lookup("late.org") == "host"
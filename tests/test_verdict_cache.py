@@ -0,0 +1,53 @@
+# test_verdict_cache.py — 結果快取的指紋：空白與網址順序不影響，內嵌 JS 與表單不同則不共用
+import pytest
+
+import analyzer
+import rules
+from html_utils import ParsedPage
+from near_dup import NearDupIndex
+from verdict_cache import VerdictCache
+
+BODY = "<p>請 立即登入</p><a href='https://a.example/'>連結</a><a href='https://b.example/'>連結</a>"
+SCRIPT = "<script>var k = atob('ZXZhbA=='); window[k](document.cookie);</script>"
+
+
+def _key(html: str) -> str:
+    page = ParsedPage(html)
+    return analyzer.verdict_key(page.visible_text, page.analysis_urls, "cot", rules.page_code_digest(page))
+
+
+@pytest.fixture
+def caches(monkeypatch, tmp_path):
+    monkeypatch.setattr(rules, "LOG_PATH", str(tmp_path / "log.jsonl"))
+    monkeypatch.setattr(analyzer, "VERDICT_CACHE", VerdictCache(max_size=16, ttl=60, db_path=""))
+    monkeypatch.setattr(analyzer, "NEAR_DUP_INDEX", NearDupIndex(capacity=16))
+
+
+def test_whitespace_and_url_order_share_key():
+    reordered = "<p>請  立即登入</p>\n<a href='https://b.example/'>連結</a><a href='https://a.example/'>連結</a>"
+    assert _key(BODY) == _key(reordered)
+
+
+@pytest.mark.parametrize("variant", [
+    BODY + SCRIPT,
+    BODY.replace("<a href='https://a.example/'>", "<a href='https://a.example/' onclick='steal()'>"),
+    BODY + "<form action='https://collect.example/post'></form>",
+    BODY + "<input type='password'>",
+])
+def test_code_and_forms_change_key(variant):
+    page = ParsedPage(variant)
+    assert page.visible_text == ParsedPage(BODY).visible_text
+    assert _key(variant) != _key(BODY)
+
+
+def test_cached_verdict_not_shared_across_different_scripts(caches):
+    plain = ParsedPage(BODY)
+    analyzer.VERDICT_CACHE.put(_key(BODY), {"is_potential_phishing": False, "risk_level": "low", "confidence": 80})
+    assert analyzer.cached_verdict(plain, mode="cot")["tier"] == "cache"
+    assert analyzer.cached_verdict(ParsedPage(BODY + SCRIPT), mode="cot") is None
+
+
+def test_prepared_code_matches_page_digest(caches):
+    prepared = rules.prepare_analysis(BODY + SCRIPT)
+    assert prepared["code"] == rules.page_code_digest(ParsedPage(BODY + SCRIPT))
+    assert prepared["code"] != rules.prepare_analysis(BODY)["code"]
@@ -0,0 +1,116 @@
+# text_utils.py — 多組關鍵字一次比對（rules.rule_score 與 tools.detect_language_anomaly 共用）
+
+from collections import Counter
+import re
+
+
+class KeywordMatcher:
+    """把多組關鍵字編成一個 regex，一次線性掃描就得到每組命中的關鍵字與出現次數。
+
+    - 同一位置以最長的關鍵字為準；被它包含的關鍵字（「重新驗證」裡的「驗證」）依包含次數一併計入
+    - 跨界重疊的關鍵字（「轉帳號」裡的「轉帳」與「帳號」）：前一個命中後，後一個可能被吃掉，
+      只在前一個命中時才另外確認後一個，命中與否仍然精確
+    - 英文字母不分大小寫，中文照原樣比對；不必先對整段文字 lower()
+    - 新增關鍵字組只會讓 regex 多幾個分支，仍然只掃描一次
+    - 出現次數以不重疊比對計算（與 str.count 相同）
+
+    用法：
+        matcher = KeywordMatcher({"auth": ["驗證", "密碼"], "money": ["付款"]})
+        matcher.counts(text)  # {"auth": 2, "money": 0}，每組命中幾個不同的關鍵字
+        matcher.scan(text)    # {"auth": {"驗證": 3, "密碼": 1}, "money": {}}，每個關鍵字出現幾次
+    """
+
+    def __init__(self, groups: dict = None):
+        self.groups = {}
+        self._pattern = None
+        for name, keywords in (groups or {}).items():
+            self.add_group(name, keywords)
+
+    def add_group(self, name: str, keywords):
+        """新增（或取代）一組關鍵字，下次掃描時重新編譯。"""
+        self.groups[name] = [k for k in dict.fromkeys(keywords) if k]
+        self._pattern = None
+
+    def _compile(self):
+        # 關鍵字（小寫）→ 所屬組；同一個關鍵字可以屬於多組
+        self._owners = {}
+        for name, keywords in self.groups.items():
+            for keyword in keywords:
+                self._owners.setdefault(keyword.lower(), []).append(name)
+        keywords = sorted(self._owners, key=len, reverse=True)
+        # 每個關鍵字命中時，一併計入它所包含的關鍵字（含自己）與包含次數
+        self._contained = {
+            keyword: [(k, _count_overlapping(keyword, k)) for k in keywords if k in keyword]
+            for keyword in keywords
+        }
+        # a 的結尾是 b 的開頭：a 命中時 b 可能被吃掉，需要另外確認
+        self._partners = {}
+        for a in keywords:
+            partners = [b for b in keywords if a not in b and b not in a and _straddles(a, b)]
+            if partners:
+                self._partners[a] = partners
+        self._singles = {
+            b: re.compile(_case_insensitive_ascii(b))
+            for partners in self._partners.values() for b in partners
+        }
+        # 同一位置較長的優先
+        alternatives = "|".join(_case_insensitive_ascii(k) for k in keywords)
+        self._pattern = re.compile(alternatives or r"(?!)")
+
+    def scan(self, text: str) -> dict:
+        """回傳 {組名: {關鍵字: 出現次數}}（關鍵字以小寫表示）。"""
+        if self._pattern is None:
+            self._compile()
+        hits = {name: {} for name in self.groups}
+        if not text:
+            return hits
+
+        totals = Counter()
+        for matched, times in Counter(self._pattern.findall(text)).items():
+            for keyword, inside in self._contained[matched.lower()]:
+                totals[keyword] += times * inside
+
+        # 可能被吃掉的關鍵字另外重數一次（即使已在別處命中，被吃掉的那幾次也要算進去）
+        pending = [k for k in totals if k in self._partners]
+        recounted = set()
+        while pending:
+            for keyword in self._partners[pending.pop()]:
+                if keyword in recounted:
+                    continue
+                recounted.add(keyword)
+                times = len(self._singles[keyword].findall(text))
+                if times:
+                    if keyword not in totals and keyword in self._partners:
+                        pending.append(keyword)
+                    totals[keyword] = times
+
+        for keyword, times in totals.items():
+            for name in self._owners[keyword]:
+                hits[name][keyword] = times
+        return hits
+
+    def counts(self, text: str) -> dict:
+        """回傳 {組名: 命中的不同關鍵字數}。"""
+        return {name: len(found) for name, found in self.scan(text).items()}
+
+
+def _count_overlapping(text: str, keyword: str) -> int:
+    return sum(1 for i in range(len(text) - len(keyword) + 1) if text.startswith(keyword, i))
+
+
+def _straddles(a: str, b: str) -> bool:
+    """a 的結尾是否為 b 的開頭（兩者可能在文字中跨界重疊）。"""
+    return any(a.endswith(b[:n]) for n in range(1, min(len(a), len(b))))
+
+
+def _case_insensitive_ascii(keyword: str) -> str:
+    """英文字母不分大小寫，其餘字元字面比對。
+
+    開頭字母展開成兩個字面分支（href|Href 開頭），讓 regex 仍能用「首字元集合」快速跳過，
+    其餘字母用 [rR] 這類字元類別。
+    """
+    rest = "".join(f"[{c}{c.upper()}]" if "a" <= c <= "z" else re.escape(c) for c in keyword[1:])
+    first = keyword[0]
+    if "a" <= first <= "z":
+        return f"{first}{rest}|{first.upper()}{rest}"
+    return re.escape(first) + rest
@@ -7,6 +7,11 @@ from urllib.parse import urlparse
 import socket
 from datetime import datetime
 
+import domain_age
+from feature_cache import cached_feature
+from html_utils import ParsedPage
+from text_utils import KeywordMatcher
+
 # 常見第三方託管 host
 THIRD_PARTY_HOSTS = ("github.io", "netlify.app", "vercel.app", "pages.dev", "githubusercontent.com", "herokuapp.com")
 
@@ -17,7 +22,16 @@ SUSPICIOUS_DOMAIN_PATTERNS = [
     r"bit\.ly|tinyurl|t\.co|goo\.gl",  # 短網址服務
 ]
 
+# 語言品質檢查：簡體字與翻譯腔片段編成同一個 matcher，一次掃描
+LANGUAGE_MARKERS = KeywordMatcher({
+    "simplified": "们这对机国观产层战领举办权进体为发过学说语讲",
+    "translationese": ["的的", "了了", "是不", "會會", "它它"],
+})
+ZH_RUNS = re.compile(r"[\u4e00-\u9fa5]+")
+EN_RUNS = re.compile(r"[A-Za-z]+")
+
 @tool
+@cached_feature("check_url_safety")
 def check_url_safety(url: str) -> str:
     """檢查 URL 的安全性特徵。
     
@@ -77,11 +91,12 @@ def check_url_safety(url: str) -> str:
 
 
 @tool
+@cached_feature("analyze_domain_age", depends=lambda: (domain_age.DOMAIN_AGES,))
 def analyze_domain_age(domain: str) -> str:
-    """分析域名的註冊時間特徵（簡化版）。
+    """分析域名的註冊時間特徵。
     
-    注意：此為簡化版本，實際應用中需要調用 WHOIS API。
-    此工具主要檢查域名格式是否合理。
+    註冊日期查本地網域年齡資料庫（domain_age.DOMAIN_AGES，由 WHOIS 匯出檔編譯），不做即時 WHOIS；
+    資料庫沒有這個網域時只檢查域名格式是否合理。
     
     Args:
         domain: 要分析的域名
@@ -120,10 +135,19 @@ def analyze_domain_age(domain: str) -> str:
         except:
             pass
         
+        # 註冊日期（本地資料庫）
+        age_line = ""
+        created = domain_age.DOMAIN_AGES.created(domain)
+        if created is not None:
+            days = (datetime.now().date() - created).days
+            if days < domain_age.NEW_DOMAIN_DAYS:
+                findings.append(f"網域註冊未滿 {domain_age.NEW_DOMAIN_DAYS} 天，新註冊網域風險較高")
+            age_line = f"\n註冊日期：{created}（{days} 天前）"
+        
         if not findings:
-            return f"域名格式檢查通過：{domain}\n格式看起來正常。"
+            return f"域名格式檢查通過：{domain}\n格式看起來正常。" + age_line
         else:
-            return f"域名分析結果：{domain}\n" + "\n".join(findings)
+            return f"域名分析結果：{domain}\n" + "\n".join(findings) + age_line
             
     except Exception as e:
         return f"域名分析失敗：{str(e)}"
@@ -232,9 +256,10 @@ def detect_language_anomaly(text: str) -> str:
 
     findings = []
 
+    markers = LANGUAGE_MARKERS.scan(text)
+
     # --- 1. 檢查簡體字出現比例 ---
-    simplified_chars = "们这对机国观产层战领举办权进体为发过学说语讲"
-    simp_count = sum(1 for c in text if c in simplified_chars)
+    simp_count = sum(markers["simplified"].values())
     total_chars = len(text)
     ratio = round(simp_count / max(total_chars, 1), 3)
 
@@ -242,13 +267,14 @@ def detect_language_anomaly(text: str) -> str:
         findings.append(f"簡體字比例偏高({ratio})")
 
     # --- 2. 混雜語言檢查（中文 + 英文大量混合） ---
-    zh = len(re.findall(r"[\u4e00-\u9fa5]", text))
-    en = len(re.findall(r"[A-Za-z]", text))
+    # 以連續字串為單位計數，比逐字 findall 少建立大量 match 物件
+    zh = sum(map(len, ZH_RUNS.findall(text)))
+    en = sum(map(len, EN_RUNS.findall(text)))
     if zh > 0 and en > 0 and (en / (zh + 1)) > 0.4:
         findings.append("語言混雜比例異常")
 
     # --- 3. 偵測是否翻譯腔（重複片段、破碎文法） ---
-    if re.search(r"的的|了了|是不|會會|它它", text):
+    if markers["translationese"]:
         findings.append("疑似翻譯腔或重複片段")
 
     if len(findings) == 0:
@@ -271,14 +297,80 @@ def detect_language_anomaly(text: str) -> str:
 # 這些工具可以讓模型在分析過程中主動調用，獲取更多資訊來做出更準確的判斷。
 
 
+# JS 可疑特徵：全部編成一個 regex，每段程式碼只掃描一次。
+# - 每個分支只吃下固定的關鍵字本身（後續條件放在有上限的 lookahead 裡），不會把其他特徵的開頭吃掉，
+#   也沒有 .* 這種會回溯整行的寫法，掃描時間與長度成正比
+# - 分支都以字面字元開頭、不用具名群組與 \b，regex 才能用「首字元集合」快速跳過無關字元；
+#   特徵種類由命中字串的前三個字元判斷，eval/atob/new 的字首邊界另外檢查
+JS_SIGNAL_PATTERN = re.compile(
+    r"eval\s*\("
+    r"|atob\s*\("
+    r"|new\s+Function\s*\("
+    r"|innerHTML\s*="
+    r"|document\.write\s*\("
+    r"|insertAdjacentHTML\s*\("
+    r"|String\.fromCharCode(?:\s*\()?"
+    r"|\.charCodeAt"
+    r"|_0x(?=[a-f0-9])"
+    r"|\.replace(?=\s*\([^,]{1,256},\s*[\"'])"
+    r"|\.split(?=\s*\([^)]{1,256}\)\s*\.join)"
+)
+JS_SIGNAL_KINDS = {
+    "eva": "eval", "ato": "atob", "new": "function", "inn": "innerhtml", "doc": "write",
+    "ins": "adjacent", "Str": "fromcharcode", ".ch": "charcodeat", "_0x": "hexvar",
+    ".re": "deobf", ".sp": "deobf",
+}
+JS_WORD_START = ("eval", "atob", "function")     # 原本的 \b 條件：前一個字元不能是字母數字或底線
+# 掃描預算（字元）：單段 script / 事件處理器，以及整頁合計；超過的部分不檢查
+JS_SCRIPT_BUDGET = 256 * 1024
+JS_TOTAL_BUDGET = 1024 * 1024
+# 字串輸入含有這些標籤時視為 HTML，只檢查其中的 script 與事件處理器；否則當成程式碼本身
+HTML_TAG_HINT = re.compile(r"(?i)<(?:!doctype|html|head|body|script|div|form|a|img|iframe|input|span|p)[\s>/]")
+
+
+def _scan_js_signals(snippets: list) -> dict:
+    """一次掃描所有程式碼片段，回傳各特徵的出現次數（deobf 為 0/1）。"""
+    counts = dict.fromkeys(JS_SIGNAL_KINDS.values(), 0)
+    counts["fromcharcode_call"] = 0
+    remaining = JS_TOTAL_BUDGET
+    for code in snippets:
+        if remaining <= 0:
+            break
+        limit = min(len(code), JS_SCRIPT_BUDGET, remaining)
+        remaining -= limit
+        last_fromcharcode = None     # 同一行內 fromCharCode 之後出現 charCodeAt → 編解碼組合
+        for m in JS_SIGNAL_PATTERN.finditer(code, 0, limit):
+            token = m.group()
+            kind = JS_SIGNAL_KINDS[token[:3]]
+            start = m.start()
+            if kind in JS_WORD_START and start and (code[start - 1].isalnum() or code[start - 1] == "_"):
+                continue
+            if kind == "fromcharcode":
+                last_fromcharcode = start
+                if token.endswith("("):
+                    counts["fromcharcode_call"] += 1
+            elif kind == "charcodeat":
+                # 與最近一個 fromCharCode 之間沒有換行才算同一行；有換行就等下一個 fromCharCode，每個字元最多檢查一次
+                if last_fromcharcode is not None and code.find("\n", last_fromcharcode, start) == -1:
+                    counts["deobf"] = 1
+                last_fromcharcode = None
+            elif kind == "deobf":
+                counts["deobf"] = 1
+                continue
+            counts[kind] += 1
+    return counts
+
+
 def detect_suspicious_js(html_text: str) -> dict:
     """
     檢測 HTML 中是否包含可疑的 JavaScript 代碼。
     
     不標記不完整/minified 程式碼為惡意，只標記真正可疑的混淆與動態注入。
+    只檢查 script 內容與 on* / javascript: 事件處理器；所有特徵在一次線性掃描中取得，
+    並受 JS_SCRIPT_BUDGET、JS_TOTAL_BUDGET 限制。
     
     Args:
-        html_text: HTML 內容
+        html_text: 已解析的 ParsedPage、HTML 內容，或一段 JavaScript 程式碼
         
     Returns:
         {
@@ -287,63 +379,62 @@ def detect_suspicious_js(html_text: str) -> dict:
             "severity": "none" | "low" | "medium" | "high"
         }
     """
-    if not html_text:
+    if isinstance(html_text, str) and HTML_TAG_HINT.search(html_text):
+        html_text = ParsedPage(html_text)
+    if isinstance(html_text, ParsedPage):
+        snippets = html_text.scripts + html_text.event_handlers
+    else:
+        snippets = [html_text] if html_text else []
+    if not snippets:
         return {"has_suspicious_js": False, "findings": [], "severity": "none"}
     
+    counts = _scan_js_signals(snippets)
     findings = []
     severity_score = 0
     
     # 1. 檢查高風險函數：eval, atob, Function constructor
-    if re.search(r'\beval\s*\(', html_text):
+    if counts["eval"]:
         findings.append("包含 eval() 動態執行代碼")
         severity_score += 3
     
-    if re.search(r'\batob\s*\(', html_text):
+    if counts["atob"]:
         findings.append("包含 atob() Base64 解碼")
         severity_score += 2
     
-    if re.search(r'\bnew\s+Function\s*\(', html_text):
+    if counts["function"]:
         findings.append("包含 Function constructor 動態生成代碼")
         severity_score += 3
     
     # 2. 檢查動態注入
-    if re.search(r'innerHTML\s*=', html_text):
+    if counts["innerhtml"]:
         findings.append("包含 innerHTML 動態注入")
         severity_score += 2
     
-    if re.search(r'document\.write\s*\(', html_text):
+    if counts["write"]:
         findings.append("包含 document.write 動態注入")
         severity_score += 2
     
-    if re.search(r'insertAdjacentHTML\s*\(', html_text):
+    if counts["adjacent"]:
         findings.append("包含 insertAdjacentHTML 動態注入")
         severity_score += 2
     
     # 3. 檢查混淆特徵（明顯的混淆編碼）
     # 大量 String.fromCharCode - 通常用於隱藏代碼
-    fromcharcode_count = len(re.findall(r'String\.fromCharCode\s*\(', html_text))
+    fromcharcode_count = counts["fromcharcode_call"]
     if fromcharcode_count >= 3:  # 3 個以上才算可疑
         findings.append(f"大量使用 String.fromCharCode ({fromcharcode_count} 次，通常用於混淆)")
         severity_score += fromcharcode_count
     
     # 明顯的十六進位混淆變數：_0x開頭的變數名大量出現
-    hex_var_count = len(re.findall(r'_0x[a-f0-9]+', html_text))
+    hex_var_count = counts["hexvar"]
     if hex_var_count >= 5:  # 5 個以上的十六進位變數
         findings.append(f"檢測到大量十六進位混淆變數 ({hex_var_count} 個，通常用於隱藏代碼)")
         severity_score += 2
     
-    # 4. 檢查自我解密腳本特徵
-    # 尋找 replace, split, substring 等字符串操作的組合
-    deobf_patterns = [
-        r'\.replace\s*\([^,]+,\s*["\']',  # replace with string
-        r'\.split\s*\([^)]+\)\s*\.join',   # split-join pattern
-        r'String\.fromCharCode.*\.charCodeAt',  # 編解碼組合
-    ]
-    for pattern in deobf_patterns:
-        if re.search(pattern, html_text):
-            findings.append("檢測到自我解密腳本特徵")
-            severity_score += 2
-            break
+    # 4. 檢查自我解密腳本特徵：replace / split-join 字串操作，或 fromCharCode 與 charCodeAt 的編解碼組合
+    if counts["deobf"]:
+        findings.append("檢測到自我解密腳本特徵")
+        severity_score += 2
     
     # 判定嚴重程度
     if severity_score == 0:
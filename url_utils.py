@@ -0,0 +1,64 @@
+# url_utils.py — 網址正規化（blacklist 與 html_utils 共用同一套規則）
+
+import re
+from urllib.parse import urlsplit
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+# 網址開頭的協定；只看開頭，query 裡的 "https://..." 不算
+_SCHEME_RE = re.compile(r"[A-Za-z][A-Za-z0-9+.-]*://")
+
+
+def canonical_parts(url: str, assume_http: bool = False):
+    """把網址拆成標準化的 (scheme, host, port, path, query)；非 http/https 或無法解析時回傳 None。
+
+    - scheme、host 轉小寫；host 去掉 userinfo 與結尾的點，非 ASCII 網域轉成 punycode
+    - 去掉預設 port（http:80、https:443）與 fragment
+    - 空路徑補成 "/"，連續的 "/" 合併，非根路徑去掉結尾的 "/"
+    - assume_http=True 時，沒有協定的網址（例如 "evil.com/login"）視為 http
+    """
+    url = (url or "").strip()
+    if not url:
+        return None
+    if url.startswith("//"):
+        url = "http:" + url
+    elif assume_http and not _SCHEME_RE.match(url):
+        url = "http://" + url
+
+    try:
+        parsed = urlsplit(url)
+        scheme = parsed.scheme.lower()
+        if scheme not in DEFAULT_PORTS:
+            return None
+        host = (parsed.hostname or "").rstrip(".")
+        port = parsed.port
+    except ValueError:
+        return None
+    if not host:
+        return None
+    if not host.isascii():
+        try:
+            host = host.encode("idna").decode("ascii")
+        except UnicodeError:
+            pass
+    if port == DEFAULT_PORTS[scheme]:
+        port = None
+
+    path = parsed.path or "/"
+    while "//" in path:
+        path = path.replace("//", "/")
+    if len(path) > 1:
+        path = path.rstrip("/") or "/"
+
+    return scheme, host, port, path, parsed.query
+
+
+def canonicalize_url(url: str, assume_http: bool = False) -> str | None:
+    """回傳標準化後的網址字串（scheme://host[:port]/path[?query]），無法處理時回傳 None。"""
+    parts = canonical_parts(url, assume_http)
+    if not parts:
+        return None
+    scheme, host, port, path, query = parts
+    netloc = f"[{host}]" if ":" in host else host
+    if port:
+        netloc = f"{netloc}:{port}"
+    return f"{scheme}://{netloc}{path}" + (f"?{query}" if query else "")
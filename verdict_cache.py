@@ -0,0 +1,129 @@
+# verdict_cache.py — 深度分析結果快取：同一份內容不必再跑兩次 LLM
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# 記憶體層筆數上限與每筆存活秒數
+VERDICT_CACHE_SIZE = int(os.environ.get("VERDICT_CACHE_SIZE", 10000))
+VERDICT_CACHE_TTL = float(os.environ.get("VERDICT_CACHE_TTL", 3600))
+# 磁碟層（SQLite）路徑；留空則只用記憶體，重啟後清空
+VERDICT_CACHE_DB = os.environ.get("VERDICT_CACHE_DB", "")
+
+
+def content_fingerprint(visible: str, urls: list, ruleset: str, code: str = "") -> str:
+    """可見文字（空白正規化）+ 排序去重後的網址 + 規則版本 + 頁面程式碼摘要 → 穩定的指紋。
+
+    空白、換行與網址出現順序不同的同一頁面會得到同一個指紋；規則或模型改版時 ruleset 不同，舊結果自然失效。
+    code 是 script、事件處理程式等看不到但會影響規則分數的內容摘要（見 rules.page_code_digest）。
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(ruleset.encode("utf-8"))
+    h.update(b"\0")
+    h.update(" ".join(visible.split()).encode("utf-8", "surrogatepass"))
+    h.update(b"\0")
+    h.update("\n".join(sorted(set(urls))).encode("utf-8", "surrogatepass"))
+    h.update(b"\0")
+    h.update(code.encode("utf-8"))
+    return h.hexdigest()
+
+
+class VerdictCache:
+    """指紋 → 分析結果，記憶體 LRU + TTL，可選擇再加一層 SQLite 磁碟快取（重啟後仍可命中）。
+
+    記憶體未命中時查磁碟，命中就搬回記憶體；寫入時兩層都寫。多執行緒共用。
+    """
+
+    def __init__(self, max_size: int = VERDICT_CACHE_SIZE, ttl: float = VERDICT_CACHE_TTL, db_path: str = VERDICT_CACHE_DB):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.db_path = db_path or None
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._db = None
+        if self.db_path:
+            try:
+                self._db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS verdicts (key TEXT PRIMARY KEY, expires REAL NOT NULL, result TEXT NOT NULL)")
+                self._db.execute("DELETE FROM verdicts WHERE expires <= ?", (time.time(),))
+            except sqlite3.Error as e:
+                print("[VERDICT_CACHE] 磁碟快取開啟失敗，只用記憶體:", e)
+                self._db = None
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: str):
+        """回傳快取的結果（dict 副本），沒有或已過期時回傳 None。"""
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return dict(entry[1])
+                del self._data[key]
+            if self._db is not None:
+                try:
+                    row = self._db.execute(
+                        "SELECT expires, result FROM verdicts WHERE key = ? AND expires > ?", (key, now)).fetchone()
+                except sqlite3.Error:
+                    row = None
+                if row:
+                    result = json.loads(row[1])
+                    self._remember(key, row[0], result)
+                    self.disk_hits += 1
+                    return dict(result)
+            self.misses += 1
+            return None
+
+    def put(self, key: str, result: dict):
+        """存入結果的副本（呼叫端之後修改原 dict 不影響快取）。"""
+        expires = time.time() + self.ttl
+        result = dict(result)
+        with self._lock:
+            self._remember(key, expires, result)
+            if self._db is not None:
+                try:
+                    self._db.execute("INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?)",
+                                     (key, expires, json.dumps(result, ensure_ascii=False)))
+                except (sqlite3.Error, TypeError, ValueError) as e:
+                    print("[VERDICT_CACHE] 寫入磁碟快取失敗:", e)
+
+    def _remember(self, key: str, expires: float, result: dict):
+        self._data[key] = (expires, result)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM verdicts")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "disk": self.db_path,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / (lookups or 1), 4),
+            }
+
+
+VERDICT_CACHE = VerdictCache()